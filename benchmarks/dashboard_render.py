@@ -0,0 +1,141 @@
+"""
+ダッシュボードの描画前処理（セクション分け + 行の取り出し）の比較。1万件の合成タスクで計測する
+    python -m benchmarks.dashboard_render --tasks 10000 --repeat 20
+    python -m benchmarks.dashboard_render --app   # Streamlit の AppTest で dashboard.py 全体の再実行時間も測る
+
+  以前 : セクション・状態・トピックごとに真偽値マスクで絞り、iterrows で1行ずつ Series にして読む（履歴・ゴミ箱も毎回）
+  現在 : TaskPartition で一度だけ groupby し、namedtuple の行を読む（履歴・ゴミ箱は開いたときだけ）
+         分割はデータが変わったときだけ作るので、ボタン操作以外の再実行では行の読み出しだけになる
+"""
+import argparse
+import random
+import statistics
+import time
+
+import pandas as pd
+
+from benchmarks.fakes import FakeSupabase
+from modules.dashboard_data import ROUTINE_TOPICS, TaskPartition, TaskStore
+
+TOPICS = ROUTINE_TOPICS + ["旅行", "引越し", "卒業式", "車の買い替え", "リフォーム"]
+MEMBERS = [None, None, "私", "母", "父", "妹"]
+
+
+def make_client(n, seed=0):
+    random.seed(seed)
+    client = FakeSupabase()
+    for i in range(n):
+        client.table("tasks").insert({
+            "family_group_id": "bench-group",
+            "content": f"タスク{i}",
+            "type": "task",
+            "topic": random.choice(TOPICS),
+            "assignee_id": random.choice(MEMBERS),
+            # 実運用と同じく完了済みが大半
+            "status": random.choices(["pending", "done", "deleted"], weights=[2, 7, 1])[0],
+        }).execute()
+    return client
+
+
+def touch(row):
+    # 描画で読む列（id・本文・担当・日付）
+    return (row["id"], row["content"], row.get("assignee_id"), row["created_at"][5:10])
+
+
+def legacy(df):
+    df_routine = df[df["topic"].isin(ROUTINE_TOPICS)]
+    df_project = df[~df["topic"].isin(ROUTINE_TOPICS)]
+    n = 0
+    for part in (df_routine, df_project):
+        for status in ("pending", "done", "deleted"):
+            if part is df_project and status == "pending":
+                active = part[part["status"] == "pending"]
+                for topic in active["topic"].unique():
+                    for _, row in active[active["topic"] == topic].iterrows():
+                        touch(row)
+                        n += 1
+                continue
+            for _, row in part[part["status"] == status].iterrows():
+                touch(row)
+                n += 1
+    return n
+
+
+def current(part, open_history=False):
+    n = 0
+    statuses = ("pending", "done", "deleted") if open_history else ("pending",)
+    for status in statuses:
+        for row in part.rows("routine", status):
+            (row.id, row.content, row.assignee_id, row.created_at[5:10])
+            n += 1
+    for _, rows in part.topics("project", "pending"):
+        for row in rows:
+            (row.id, row.content, row.assignee_id, row.created_at[5:10])
+            n += 1
+    if open_history:
+        for status in ("done", "deleted"):
+            for row in part.rows("project", status):
+                (row.id, row.content, row.assignee_id, row.created_at[5:10])
+                n += 1
+    return n
+
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run_app(client, reruns):
+    from streamlit.testing.v1 import AppTest
+
+    from modules import database
+
+    database.supabase = client
+    database.topic_index = None
+    at = AppTest.from_file("../dashboard.py", default_timeout=600)
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    assert not at.exception, at.exception
+    times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - start)
+    print(f"AppTest  初回 {first:6.2f}s  再実行 中央値 {statistics.median(times):6.2f}s  (ボタン {len(at.button)}個)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--app", action="store_true")
+    parser.add_argument("--reruns", type=int, default=3)
+    args = parser.parse_args()
+
+    client = make_client(args.tasks)
+    df = TaskStore(client, "bench-group").frame()
+    legacy_df = pd.DataFrame(client.table("tasks").select("*").order("created_at", desc=True).execute().data)
+
+    part = TaskPartition(df)
+    assert legacy(legacy_df) == current(part, open_history=True), "行数が一致しません"
+    base = measure(lambda: legacy(legacy_df), args.repeat)
+    build = measure(lambda: TaskPartition(df), args.repeat)
+    print(f"{args.tasks}件（中央値, {args.repeat}回）")
+    print("-" * 60)
+    print(f"以前 (マスク + iterrows)                 {base * 1000:8.1f}ms")
+    print(f"現在 分割の作成（データ更新時のみ）      {build * 1000:8.1f}ms")
+    for label, open_history in [("現在 行の読み出し（履歴も開く）", True), ("現在 行の読み出し（履歴は閉じたまま）", False)]:
+        elapsed = measure(lambda: current(part, open_history), args.repeat)
+        print(f"{label:36s}  {elapsed * 1000:8.1f}ms  (x{base / elapsed:.1f}, 作成込み x{base / (build + elapsed):.1f})")
+
+    if args.app:
+        run_app(client, args.reruns)
+
+
+if __name__ == "__main__":
+    main()
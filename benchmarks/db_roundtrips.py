@@ -0,0 +1,87 @@
+"""
+handle_message 1件あたりのSupabase往復回数・所要時間の比較（FakeSupabase に往復遅延を入れて計測）
+    python -m benchmarks.db_roundtrips --rtt-ms 30 --messages 50
+
+  以前     : 履歴取得 → 保存 → トピック取得 → （引き受けなら）取得 → 更新 をすべて直列
+  並行     : ingest_message（履歴とトピックを並行に取得してから保存）+ assign_latest_task
+  RPC      : ingest_message / assign_latest_task をDB関数1回ずつで実行
+  メモリ   : トピック索引 + 履歴バッファ（メモリ）+ ログの後書き（write-behind）
+（3件に1件は「引き受け」、別の3件に1件はタスク追加も行う。往復回数にはタスク追加分も含む）
+
+実際の Postgres/PostgREST に対して測る場合は SUPABASE_URL/SUPABASE_KEY を設定し --real を付ける
+（supabase/migrations を適用済みであること）
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.fakes import FakeSupabase
+from modules import database
+
+
+def legacy(group_id, user_id, text, accept):
+    database.get_recent_messages(group_id, limit=5)
+    database.save_message(group_id, user_id, text, role="user")
+    database.get_active_topics(group_id)
+    if accept:
+        database.assign_latest_task(group_id, "私")
+
+
+def ingest(group_id, user_id, text, accept):
+    database.ingest_message(group_id, user_id, text, role="user")
+    if accept:
+        database.assign_latest_task(group_id, "私")
+
+
+def run(name, func, client, messages, use_rpc, topic_index=None, message_writer=None, history_buffer=None):
+    database.supabase = client
+    database.USE_RPC = use_rpc
+    database.topic_index = topic_index
+    database.history_buffer = history_buffer
+    database.message_writer = message_writer
+    before = getattr(client, "round_trips", 0)
+    times = []
+    for i in range(messages):
+        accept = i % 3 == 0
+        start = time.perf_counter()
+        func("bench-group", "bench-user", f"メッセージ{i}", accept)
+        times.append(time.perf_counter() - start)
+        if i % 3 == 2:
+            database.add_task("bench-group", f"タスク{i}", topic="買い物")
+    if message_writer:
+        message_writer.stop()  # 後書き分の往復も数える
+    trips = getattr(client, "round_trips", 0) - before
+    print(
+        f"{name:6s} avg {statistics.mean(times) * 1000:7.1f}ms  p95 {sorted(times)[int(len(times) * 0.95)] * 1000:7.1f}ms"
+        + (f"  往復 {trips / messages:4.2f}回/件" if trips else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rtt-ms", type=float, default=30)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--real", action="store_true")
+    args = parser.parse_args()
+
+    real = database.supabase
+    topic_index, message_writer, history_buffer = database.topic_index, database.message_writer, database.history_buffer
+    for name, func, use_rpc, cached in [
+        ("以前", legacy, False, False),
+        ("並行", ingest, False, False),
+        ("RPC", ingest, True, False),
+        ("メモリ", ingest, False, True),
+    ]:
+        client = real if args.real else FakeSupabase(rtt=args.rtt_ms / 1000)
+        for i in range(5):
+            client.table("messages").insert({"group_id": "bench-group", "user_id": "u", "content": f"過去{i}", "role": "user"}).execute()
+        if cached:
+            topic_index.invalidate()
+            history_buffer.invalidate()
+            run(name, func, client, args.messages, use_rpc, topic_index, message_writer, history_buffer)
+        else:
+            run(name, func, client, args.messages, use_rpc)
+
+
+if __name__ == "__main__":
+    main()
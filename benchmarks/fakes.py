@@ -0,0 +1,359 @@
+"""
+ベンチマーク用のローカル代役
+  FakeSupabase: supabase-py のクエリビルダのうち、このリポジトリで使う範囲だけを真似たインメモリ実装。
+                execute() 1回を1往復として数え、rtt 秒の待ちを入れる（PostgREST越しの通信の代わり）
+  FakeGenai   : google-genai の Client のうち aio.models.generate_content / aio.caches.create だけを真似る。
+                最新メッセージをキーワードで判定し、latency ± jitter 秒待ってから JSON を返す
+  LineApiStub : LINE Messaging API（返信・プッシュ）の代わりにローカルで立てる HTTP サーバー。
+                LINE_API_HOST をこれの url に向けると、SDK の通信をそのまま受けられる
+"""
+import asyncio
+import copy
+import itertools
+import json
+import random
+import re
+import socket
+import threading
+import time
+import types
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+
+class _Response:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeSupabase:
+    def __init__(self, rtt=0.0):
+        self.rtt = rtt
+        self.tables = defaultdict(list)
+        self.round_trips = 0
+        self._ids = itertools.count(1)
+        self._clock = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self._lock = threading.RLock()
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def rpc(self, name, params):
+        return _Rpc(self, name, params)
+
+    def _roundtrip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def _now(self):
+        # 同じ時刻にならないよう1マイクロ秒ずつ進める
+        with self._lock:
+            self._clock += timedelta(microseconds=1)
+            return self._clock.isoformat()
+
+    def _insert(self, name, row):
+        row = dict(row)
+        row.setdefault("id", next(self._ids))
+        now = self._now()
+        row.setdefault("created_at", now)
+        row.setdefault("updated_at", now)
+        if name == "tasks":
+            row.setdefault("status", "pending")
+        self.tables[name].append(row)
+        return copy.deepcopy(row)
+
+
+class _Query:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.action = "select"
+        self.columns = None
+        self.payload = None
+        self.conflict = None
+        self.filters = []
+        self.orders = []
+        self.offset = 0
+        self.max_rows = None
+        self.want_count = False
+
+    # --- 操作 ---
+    def select(self, columns="*", count=None):
+        self.action = "select"
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        self.want_count = count is not None
+        return self
+
+    def insert(self, rows):
+        self.action = "insert"
+        self.payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict="", ignore_duplicates=False):
+        # ignore_duplicates=True（on conflict do nothing）の使い方だけに対応する
+        if not ignore_duplicates:
+            raise NotImplementedError("FakeSupabase は ignore_duplicates=False の upsert に対応していません")
+        self.action = "upsert"
+        self.payload = rows if isinstance(rows, list) else [rows]
+        self.conflict = on_conflict
+        return self
+
+    def update(self, values):
+        self.action = "update"
+        self.payload = values
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    # --- 絞り込み ---
+    def eq(self, column, value):
+        self.filters.append(lambda r: r.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda r: r.get(column) != value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) > value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) < value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) >= value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) <= value)
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        self.filters.append(lambda r: r.get(column) in values)
+        return self
+
+    def or_(self, expression):
+        raise NotImplementedError("FakeSupabase は or_ に対応していません")
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n):
+        self.max_rows = n
+        return self
+
+    def range(self, start, end):
+        self.offset = start
+        self.max_rows = end - start + 1
+        return self
+
+    def _matches(self, row):
+        return all(f(row) for f in self.filters)
+
+    def execute(self):
+        self.db._roundtrip()
+        with self.db._lock:
+            rows = self.db.tables[self.name]
+            if self.action == "insert":
+                return _Response([self.db._insert(self.name, r) for r in self.payload])
+            if self.action == "upsert":
+                # NULL は重複扱いにしない（一意索引と同じ）
+                taken = {r.get(self.conflict) for r in rows} - {None}
+                inserted = []
+                for r in self.payload:
+                    key = r.get(self.conflict)
+                    if key is None or key not in taken:
+                        inserted.append(self.db._insert(self.name, r))
+                        taken.add(key)
+                return _Response(inserted)
+            if self.action == "update":
+                hit = [r for r in rows if self._matches(r)]
+                for r in hit:
+                    r.update(self.payload)
+                    r["updated_at"] = self.db._now()
+                return _Response(copy.deepcopy(hit))
+            if self.action == "delete":
+                hit = [r for r in rows if self._matches(r)]
+                self.db.tables[self.name] = [r for r in rows if not self._matches(r)]
+                return _Response(copy.deepcopy(hit))
+
+            hit = [r for r in rows if self._matches(r)]
+            for column, desc in reversed(self.orders):
+                hit.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+            total = len(hit)
+            hit = hit[self.offset:]
+            if self.max_rows is not None:
+                hit = hit[:self.max_rows]
+            if self.columns:
+                hit = [{c: r.get(c) for c in self.columns} for r in hit]
+            return _Response(copy.deepcopy(hit), total if self.want_count else None)
+
+
+class _Rpc:
+    """supabase/migrations のDB関数と同じ動きをする"""
+
+    def __init__(self, db, name, params):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.db._roundtrip()
+        with self.db._lock:
+            return _Response(getattr(self, f"_{self.name}")(**self.params))
+
+    def _ingest_message(self, p_group_id, p_user_id, p_content, p_role="user", p_history_limit=5,
+                        p_request_id=None):
+        messages = [
+            m for m in self.db.tables["messages"]
+            if m["group_id"] == p_group_id and (p_request_id is None or m.get("request_id") != p_request_id)
+        ]
+        recent = sorted(messages, key=lambda m: m["created_at"], reverse=True)[:p_history_limit]
+        history = [{k: m[k] for k in ("content", "role", "created_at")} for m in reversed(recent)]
+        if p_request_id is None or all(m.get("request_id") != p_request_id for m in self.db.tables["messages"]):
+            self.db._insert("messages", {
+                "group_id": p_group_id, "user_id": p_user_id, "content": p_content, "role": p_role,
+                "request_id": p_request_id,
+            })
+        topics = sorted({
+            t["topic"] for t in self.db.tables["tasks"]
+            if t["family_group_id"] == p_group_id and t["status"] == "pending" and t.get("topic")
+        })
+        return {"history": history, "topics": topics}
+
+    def _assign_latest_task(self, p_group_id, p_assignee, p_assignable_topics):
+        pending = [
+            t for t in self.db.tables["tasks"]
+            if t["family_group_id"] == p_group_id and t["status"] == "pending"
+        ]
+        if not pending:
+            return None
+        target = max(pending, key=lambda t: t["created_at"])
+        assigned = target.get("topic") in p_assignable_topics
+        if assigned:
+            target["assignee_id"] = p_assignee
+            target["updated_at"] = self.db._now()
+        return {"id": target["id"], "content": target["content"], "topic": target.get("topic"), "assigned": assigned}
+
+
+# FakeGenai の判定ルール（上から順に見る）
+_GEMINI_RULES = [
+    ("accept", ("私がやる", "やるよ", "私が行く", "任せて")),
+    ("idea", ("どうしよう", "行きたい", "いいかも", "アイデア")),
+    ("task", ("買", "お願い", "して", "予約", "払", "調べ", "切れ", "ない")),
+]
+
+
+def classify_text(text):
+    for category, words in _GEMINI_RULES:
+        if any(w in text for w in words):
+            topic = "買い物" if "買" in text else "一般"
+            return {"category": category, "topic": topic, "summary": text[:30], "due_date": None, "assignee": "null"}
+    return {"category": None, "topic": "一般", "summary": "", "due_date": None, "assignee": "null"}
+
+
+class FakeGenai:
+    def __init__(self, latency=0.5, jitter=0.2, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self._rng = random.Random(seed)
+        models = types.SimpleNamespace(generate_content=self._generate_content)
+        caches = types.SimpleNamespace(create=self._create_cache)
+        self.aio = types.SimpleNamespace(models=models, caches=caches)
+
+    async def _generate_content(self, model, contents, config=None):
+        self.requests += 1
+        texts = re.findall(r"最新メッセージ: (.*)", contents)
+        ids = [int(i) for i in re.findall(r"\(id: (\d+)\)", contents)]
+        await asyncio.sleep(max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)))
+        if ids:
+            text = json.dumps([{"id": i, **classify_text(t)} for i, t in zip(ids, texts)], ensure_ascii=False)
+        else:
+            text = json.dumps(classify_text(texts[-1] if texts else contents), ensure_ascii=False)
+        usage = types.SimpleNamespace(prompt_token_count=len(contents), candidates_token_count=len(text))
+        return types.SimpleNamespace(text=text, usage_metadata=usage)
+
+    async def _create_cache(self, model, config=None):
+        return types.SimpleNamespace(name="cachedContents/fake")
+
+
+class LineApiStub:
+    """
+    /v2/bot/message/reply と /v2/bot/message/push だけを持つ LINE API の代役（uvicorn で別スレッドに立てる）。
+    expired_tokens に入れた返信トークンや、受け取ってから token_ttl 秒を過ぎたトークンには
+    本物と同じく 400 "Invalid reply token" を返す。同じ X-Line-Retry-Key のプッシュは 409 を返して二重に送らない
+    """
+
+    def __init__(self, latency=0.0, token_ttl=None):
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.issued = {}  # 返信トークン → 発行時刻（token_ttl を使うときにテスト側で入れる）
+        self.expired_tokens = set()
+        self.replies = []  # (reply_token, messages, 受け取った時刻)
+        self.pushes = []  # (to, messages, retry_key, 受け取った時刻)
+        self._retry_keys = set()
+        self.url = None
+        self._server = None
+
+    def app(self):
+        from starlette.applications import Starlette
+        from starlette.responses import JSONResponse
+        from starlette.routing import Route
+
+        async def reply(request):
+            body = await request.json()
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            token = body["replyToken"]
+            issued = self.issued.get(token)
+            if token in self.expired_tokens or (
+                self.token_ttl is not None and issued is not None and time.time() - issued > self.token_ttl
+            ):
+                return JSONResponse({"message": "Invalid reply token"}, status_code=400)
+            self.replies.append((token, body["messages"], time.perf_counter()))
+            return JSONResponse({"sentMessages": [{"id": str(len(self.replies)), "quoteToken": "q"}]})
+
+        async def push(request):
+            body = await request.json()
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            retry_key = request.headers.get("X-Line-Retry-Key")
+            if retry_key and retry_key in self._retry_keys:
+                return JSONResponse({"message": "The retry key is already accepted"}, status_code=409)
+            if retry_key:
+                self._retry_keys.add(retry_key)
+            self.pushes.append((body["to"], body["messages"], retry_key, time.perf_counter()))
+            return JSONResponse({"sentMessages": [{"id": f"p{len(self.pushes)}", "quoteToken": "q"}]})
+
+        return Starlette(routes=[
+            Route("/v2/bot/message/reply", reply, methods=["POST"]),
+            Route("/v2/bot/message/push", push, methods=["POST"]),
+        ])
+
+    def start(self):
+        """空いているポートで起動し、url（http://127.0.0.1:ポート）を返す"""
+        import uvicorn
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        config = uvicorn.Config(self.app(), log_level="warning", access_log=False)
+        self._server = uvicorn.Server(config)
+        threading.Thread(target=self._server.run, kwargs={"sockets": [sock]}, name="line-stub", daemon=True).start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self.url
+
+    def stop(self):
+        if self._server:
+            self._server.should_exit = True
@@ -0,0 +1,38 @@
+"""
+1件ずつの analyze_with_ginza と nlp.pipe を使う analyze_many のスループット比較
+    python -m benchmarks.ginza_batch --repeat 50 --batch-size 16 64 256
+"""
+import argparse
+import time
+
+from benchmarks.sample_texts import FAMILY_CHAT
+from modules.ginza_logic import analyze_many, analyze_with_ginza, get_nlp
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--n-process", type=int, default=1)
+    args = parser.parse_args()
+
+    texts = FAMILY_CHAT * args.repeat
+    get_nlp()  # モデル読み込みは計測に含めない
+
+    start = time.perf_counter()
+    single = [analyze_with_ginza(t) for t in texts]
+    base = time.perf_counter() - start
+    print(f"{len(texts)}件")
+    print("-" * 50)
+    print(f"1件ずつ            {base:6.2f}s  {len(texts) / base:8.1f} msg/s")
+
+    for bs in args.batch_size:
+        start = time.perf_counter()
+        batched = list(analyze_many(texts, batch_size=bs, n_process=args.n_process))
+        elapsed = time.perf_counter() - start
+        assert batched == single, "バッチ解析の結果が1件ずつの結果と一致しません"
+        print(f"batch_size={bs:<5d}  {elapsed:6.2f}s  {len(texts) / elapsed:8.1f} msg/s  (x{base / elapsed:.2f})")
+
+
+if __name__ == "__main__":
+    main()
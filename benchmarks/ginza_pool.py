@@ -0,0 +1,44 @@
+"""
+GiNZAプロセスプールのスループット計測
+    python -m benchmarks.ginza_pool --workers 1 2 4 --repeat 20
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.sample_texts import FAMILY_CHAT
+from modules.ginza_pool import GinzaPool
+
+
+def run(workers, texts):
+    pool = GinzaPool(workers=workers, timeout=30.0)
+    start = time.perf_counter()
+    pool.start()
+    warmup = time.perf_counter() - start
+
+    # Webhookワーカーと同じく複数スレッドから同時に投げる
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers * 2) as ex:
+        list(ex.map(pool.analyze, texts))
+    elapsed = time.perf_counter() - start
+    pool.stop()
+    return warmup, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    texts = FAMILY_CHAT * args.repeat
+    print(f"{len(texts)}件 / CPU {os.cpu_count()}コア")
+    print("-" * 50)
+    for n in args.workers:
+        warmup, elapsed = run(n, texts)
+        print(f"workers={n:2d}  起動 {warmup:6.2f}s  処理 {elapsed:6.2f}s  {len(texts) / elapsed:8.1f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+GiNZAパイプラインのプロファイルごとの起動時間・1件あたりレイテンシ
+    python -m benchmarks.ginza_profiles --repeat 20
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.sample_texts import FAMILY_CHAT
+from modules.ginza_logic import PROFILES, get_nlp
+
+COLD_START = """
+import time
+import spacy
+from modules.ginza_logic import get_nlp
+start = time.perf_counter()
+get_nlp({profile!r})
+print(time.perf_counter() - start)
+"""
+
+
+def cold_start(profile):
+    """別プロセスでモデル読み込みだけを計測する（ファイルキャッシュ以外は毎回まっさら）"""
+    out = subprocess.run(
+        [sys.executable, "-c", COLD_START.format(profile=profile)],
+        capture_output=True, text=True, check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def per_message(profile, texts):
+    nlp = get_nlp(profile)
+    for t in texts[:20]:  # 初回呼び出しの遅さを除くための空回し
+        nlp(t)
+    times = []
+    for t in texts:
+        start = time.perf_counter()
+        nlp(t)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return statistics.mean(times), times[len(times) // 2], times[int(len(times) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES))
+    args = parser.parse_args()
+
+    texts = FAMILY_CHAT * args.repeat
+    print(f"{len(texts)}件")
+    print("-" * 70)
+    for profile in args.profiles:
+        cold = cold_start(profile)
+        mean, p50, p95 = per_message(profile, texts)
+        print(
+            f"{profile:12s} 起動 {cold:5.2f}s  "
+            f"avg {mean * 1000:6.2f}ms  p50 {p50 * 1000:6.2f}ms  p95 {p95 * 1000:6.2f}ms  "
+            f"{get_nlp(profile).pipe_names}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Gemini判定のマイクロバッチと1件ずつ送る方式の比較（Geminiはレイテンシを注入したフェイク）
+    python -m benchmarks.llm_batching --messages 200 --rate 50 --window-ms 100 --max-batch 8
+
+フェイクの応答時間 = base + プロンプト1文字あたりの時間 × 文字数 + 出力1件あたりの時間 × 件数
+コストはプロンプト文字数（≒入力トークン数）とリクエスト数で比べる
+（--context-cache を付けるとシステム指示はキャッシュ済みとみなして文字数に含めない）
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import statistics
+import time
+import types
+
+from benchmarks.sample_texts import FAMILY_CHAT
+from modules.extractor import BATCH_SYSTEM_INSTRUCTION, SYSTEM_INSTRUCTION, build_batch_prompt, build_prompt
+from modules.llm_batcher import GeminiBatcher
+
+
+class FakeGemini:
+    def __init__(self, base, per_char, per_item, instruction_chars=0):
+        self.base = base
+        self.instruction_chars = instruction_chars
+        self.per_char = per_char
+        self.per_item = per_item
+        self.requests = 0
+        self.prompt_chars = 0
+
+    async def generate(self, contents, timeout=None):
+        self.requests += 1
+        chars = self.instruction_chars + len(contents)
+        self.prompt_chars += chars
+        ids = [int(i) for i in re.findall(r"\(id: (\d+)\)", contents)]
+        await asyncio.sleep(self.base + self.per_char * chars + self.per_item * max(len(ids), 1))
+        result = {"category": None, "topic": "一般", "summary": "", "due_date": None, "assignee": "null"}
+        if ids:
+            return types.SimpleNamespace(text=json.dumps([{"id": i, **result} for i in ids]))
+        return types.SimpleNamespace(text=json.dumps(result))
+
+
+def make_requests(n):
+    rng = random.Random(0)
+    reqs = []
+    for i in range(n):
+        history = [{"role": "user", "content": rng.choice(FAMILY_CHAT)} for _ in range(5)]
+        reqs.append((FAMILY_CHAT[i % len(FAMILY_CHAT)], history, ["京都旅行", "お父さんの誕生日会"]))
+    return reqs
+
+
+async def drive(reqs, rate, classify):
+    """ポアソン到着で依頼を投げ、1件ごとの待ち時間を集める"""
+    rng = random.Random(1)
+    latencies = []
+
+    async def one(req):
+        start = time.perf_counter()
+        await classify(*req)
+        latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    for req in reqs:
+        tasks.append(asyncio.ensure_future(one(req)))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def report(name, fake, latencies, n):
+    latencies.sort()
+    print(
+        f"{name:10s} requests {fake.requests:5d}  prompt {fake.prompt_chars / n:8.0f} chars/msg  "
+        f"p50 {statistics.median(latencies) * 1000:7.1f}ms  p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.1f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50, help="1秒あたりの到着数")
+    parser.add_argument("--window-ms", type=float, default=100)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--base-ms", type=float, default=400)
+    parser.add_argument("--per-char-us", type=float, default=50)
+    parser.add_argument("--per-item-ms", type=float, default=60)
+    parser.add_argument("--context-cache", action="store_true")
+    args = parser.parse_args()
+
+    reqs = make_requests(args.messages)
+    today = "2026-01-01"
+    fake_args = (args.base_ms / 1000, args.per_char_us / 1e6, args.per_item_ms / 1000)
+
+    single = FakeGemini(*fake_args, 0 if args.context_cache else len(SYSTEM_INSTRUCTION))
+
+    async def classify_single(text, history, topics):
+        response = await single.generate(build_prompt(text, history, topics, today))
+        return json.loads(response.text)
+
+    report("1件ずつ", single, await drive(reqs, args.rate, classify_single), len(reqs))
+
+    batched = FakeGemini(*fake_args, 0 if args.context_cache else len(BATCH_SYSTEM_INSTRUCTION))
+    batcher = GeminiBatcher(
+        generate=batched.generate, build_prompt=build_batch_prompt,
+        window=args.window_ms / 1000, max_batch=args.max_batch,
+    )
+
+    async def classify_batched(text, history, topics):
+        return await batcher.classify(text, history, topics, today)
+
+    report("バッチ", batched, await drive(reqs, args.rate, classify_batched), len(reqs))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+"""
+プロンプト組み立ての計測：以前の毎回 f-string で全文を作る方式と、
+システム指示を事前に組み立てておき毎回変わる部分だけをテンプレートで作る方式の比較
+    python -m benchmarks.prompt_build --iterations 20000
+    python -m benchmarks.prompt_build --count-tokens   # GOOGLE_API_KEY があれば実際の入力トークン数も数える
+"""
+import argparse
+import time
+from datetime import datetime
+
+from modules.extractor import SYSTEM_INSTRUCTION, build_prompt, cacheable
+
+HISTORY = [
+    {"role": "user", "content": "週末どこか行く？"},
+    {"role": "user", "content": "京都とかどう？"},
+    {"role": "assistant", "content": "💡 メモ: 京都旅行の行き先を考える (案件: 京都旅行)"},
+    {"role": "user", "content": "いいね、宿はどうする？"},
+    {"role": "user", "content": "調べてみる"},
+]
+TOPICS = ["京都旅行", "お父さんの誕生日会", "買い物"]
+TEXT = "宿の候補を3つくらい探しておいて"
+
+
+def legacy_prompt(text, history, existing_topics):
+    """以前の analyze_message と同じ組み立て方（比較用）"""
+    history_text = ""
+    for h in history:
+        role_label = "家族" if h['role'] == "user" else "Bot"
+        history_text += f"- {role_label}: {h['content']}\n"
+
+    today_str = datetime.now().strftime("%Y-%m-%d")
+
+    system_prompt = f"""
+    あなたは家族のチャットから「やるべきこと(Task)」を抽出するAIです。
+    会話の流れを読んで、適切なカテゴリと具体的なタスク名を生成してください。
+    
+    ### 今日の日付
+    {today_str}
+
+    ### 📁 現在進行中のプロジェクト名（表記ゆれ防止用リスト）
+    {existing_topics}
+    
+    ### ⚠️ トピック名（プロジェクト名）の決定ルール
+    1. **最優先:** 上記のリストの中に、今回の会話に関連するものがあれば、**一字一句変えずにその名前を使用すること。**
+       （例：リストに「京都旅行」があり、会話が「宿どうする？」なら、トピックは「京都旅行」にする。「京都の宿」などと勝手に変えない）
+    2. 新規: リストに関連するものがない場合のみ、新しい具体的なイベント名を生成する。（例：「お父さんの誕生日会」「新潟旅行」）
+    3. 禁止: 「旅行」「食事」のような抽象的な大分類は禁止。
+
+    ### ⚠️ タスク名（summary）の生成ルール
+    1. **「〜を〜する」という命令形・行動ベースにすること。**
+       - ❌ 悪い例：「京都旅行の日程について話している」「宿をどうするか相談」
+       - ⭕️ 良い例：「京都旅行の日程を決める」「宿を予約する」「候補地をリストアップする」
+    2. 会話の状況説明ではなく、ユーザーが**次にアクションできる言葉**に変換すること。
+
+    ### 直近の会話ログ
+    {history_text}
+
+    ### 分類カテゴリー
+    - "task": 明確な行動、買い物、予約、調べること。（※担当者はここでは決めない）
+    - "accept": 直前のタスクや提案に対する「引き受け」「了解」「私がやる」という意思表示。
+    - "idea": 旅行の相談、提案、まだ決まっていないメモ。（※これも行動ベースの名前にする。「〜を考える」など）
+    - null: ただの相槌、完了報告、雑談、同意のみの場合。
+
+    ### 出力フォーマット (JSON)
+    {{
+        "category": "task" or "idea" or "accept" or null,
+        "topic": "プロジェクト名",
+        "summary": "タスクの内容（動詞で終わる短いフレーズ）",
+        "due_date": "YYYY-MM-DD(なければnull)",
+        "assignee": "null" 
+    }}
+    """
+    return f"{system_prompt}\n\nユーザーの最新メッセージ: {text}"
+
+
+def new_prompt(text, history, existing_topics):
+    return build_prompt(text, history, existing_topics, datetime.now().date().isoformat())
+
+
+def bench(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(TEXT, HISTORY, TOPICS)
+    return (time.perf_counter() - start) / iterations
+
+
+def count_tokens(contents):
+    """
+    入力トークン数。API キーのクライアントでは count_tokens に system_instruction を渡せないので、
+    システム指示込みの数はシステム指示を contents の先頭に並べて数える
+    """
+    from modules.extractor import GEMINI_MODEL, get_client
+
+    return get_client().models.count_tokens(model=GEMINI_MODEL, contents=contents).total_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--count-tokens", action="store_true")
+    args = parser.parse_args()
+
+    old = legacy_prompt(TEXT, HISTORY, TOPICS)
+    new = new_prompt(TEXT, HISTORY, TOPICS)
+
+    print(f"組み立て  以前 {bench(legacy_prompt, args.iterations) * 1e6:6.2f}us  今 {bench(new_prompt, args.iterations) * 1e6:6.2f}us")
+    cached = "コンテキストキャッシュ時は0" if cacheable(SYSTEM_INSTRUCTION) else "キャッシュの最小サイズ未満なので毎回"
+    print(f"毎回送る文字数  以前 {len(old)}  今 {len(new)}（+ システム指示 {len(SYSTEM_INSTRUCTION)}、{cached}）")
+
+    if args.count_tokens:
+        print(
+            f"入力トークン  以前 {count_tokens(old)}  "
+            f"今 {count_tokens(new)}（システム指示込み {count_tokens([SYSTEM_INSTRUCTION, new])}、"
+            f"システム指示だけ {count_tokens(SYSTEM_INSTRUCTION)}）"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+Webhook を端から端まで流すリプレイベンチマーク（LINE・Supabase・Gemini はすべてプロセス内の代役）
+    python -m benchmarks.replay --messages 500 --concurrency 16
+    python -m benchmarks.replay --save-baseline          # benchmarks/baselines/replay.json に保存
+    python -m benchmarks.replay --check                  # 保存済みの基準より遅くなっていたら終了コード 1
+
+  1. 家族チャット風のコーパス（--corpus でファイル指定も可）から LINE の Webhook ペイロードを作り、
+     チャネルシークレットで署名（HMAC-SHA256 → base64）して X-Line-Signature に付ける
+     （--events-per-body で1リクエストに複数イベント、--redeliver で同じ webhookEventId の再送も混ぜる）
+  2. httpx の ASGITransport で /callback に投げる（同時 --concurrency 本まで。--rate を付けるとポアソン到着、
+     0 なら一斉に投げてバースト時のキュー待ちを見る）
+  3. Supabase は FakeSupabase、Gemini は FakeGenai（遅延を注入）に差し替え、LINE の返信は
+     ローカルに立てた LineApiStub（LINE_API_HOST をここに向ける）で受ける
+handle_message の各段階（履歴・保存 / GiNZA / ローカル分類器 / Gemini / タスク書き込み / 返信の受け渡し / ボット発言の保存）と、
+受け付け（/callback の応答）・キュー待ち・受信から処理完了まで・受信から返信がLINEに届くまでの
+p50/p95/p99 とスループットを出す。
+DISPATCH_MODE や GEMINI_BATCH_WINDOW_MS などの環境変数は本番と同じように効く。
+基準の値はマシンによって変わるので、比べるときは同じマシンで取り直した基準を使う
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+# 鍵が無くても import できるようにダミーを入れる（外部には接続しない）
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "dummy")
+os.environ.setdefault("LINE_CHANNEL_SECRET", "replay-secret")
+
+from benchmarks.fakes import FakeGenai, FakeSupabase, LineApiStub  # noqa: E402
+
+# 返信はローカルの LINE スタブに送る（main の import 前に接続先を決める）
+line_stub = LineApiStub()
+os.environ["LINE_API_HOST"] = line_stub.start()
+
+import main as bot  # noqa: E402
+from benchmarks.sample_texts import FAMILY_CHAT  # noqa: E402
+from modules import database, extractor  # noqa: E402
+from modules.local_classifier import LocalClassifier  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "replay.json")
+
+# handle_message の中で呼ばれる関数 → 段階名
+STAGES = {
+    "ingest_message": "ingest",
+    "run_ginza": "ginza",
+    "analyze_message": "gemini",
+    "add_task": "write_task",
+    "assign_latest_task": "write_task",
+    "save_message": "save_reply",
+}
+# 返信の受け渡し（送信は待たない）は handle_message の中、実際に LINE に届くまでは reply_sent
+REPORT_ORDER = ["callback", "queue_wait", "ingest", "ginza", "local", "gemini", "write_task", "reply", "save_reply",
+                "handle_message", "end_to_end", "reply_sent"]
+# 基準と比べる段階（外部の代役の遅延だけで決まる段階は除く）
+CHECKED = ["callback", "ingest", "ginza", "handle_message", "end_to_end"]
+
+
+class Recorder:
+    """段階ごとの所要時間を生のまま集める（分位点は最後に並べ替えて出す）"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def timed(self, stage, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(stage, time.perf_counter() - start)
+        return wrapper
+
+    def summary(self):
+        result = {}
+        for stage, values in self.samples.items():
+            values = sorted(values)
+            result[stage] = {
+                "count": len(values),
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+            }
+        return result
+
+
+def percentile(values, q):
+    """並べ替え済みの values の分位点（nearest-rank）"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q * len(values))) - 1))]
+
+
+def load_corpus(path):
+    if not path:
+        return list(FAMILY_CHAT)
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def sign(events, secret):
+    """Webhook のリクエスト本文と X-Line-Signature（HMAC-SHA256 → base64）"""
+    body = json.dumps({"destination": "Ubot", "events": events}, ensure_ascii=False).encode("utf-8")
+    signature = base64.b64encode(hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()).decode("ascii")
+    return body, signature
+
+
+def make_payloads(corpus, n, groups, seed=0, events_per_body=1, redeliver=0.0):
+    """
+    Webhook で送るイベントのまとまり [[event, ...], ...] を作る（署名は送る直前に付ける）。
+    1リクエストに events_per_body 件ずつ入れ、redeliver の割合のリクエストは少し後でもう一度送る（LINE の再送）
+    """
+    rng = random.Random(seed)
+    events = []
+    for i in range(n):
+        group = rng.randrange(groups)
+        events.append({
+            "type": "message",
+            "mode": "active",
+            "timestamp": 0,
+            "source": {"type": "group", "groupId": f"Cbench{group:04d}", "userId": f"Ubench{group:04d}{rng.randrange(4)}"},
+            "webhookEventId": f"01BENCH{i:019d}",
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": uuid.UUID(int=rng.getrandbits(128)).hex,
+            "message": {"id": str(100000 + i), "type": "text", "quoteToken": f"q{i}", "text": rng.choice(corpus)},
+        })
+    payloads = []
+    for start in range(0, n, events_per_body):
+        chunk = events[start:start + events_per_body]
+        payloads.append(chunk)
+        if rng.random() < redeliver:
+            again = [{**e, "deliveryContext": {"isRedelivery": True}} for e in chunk]
+            payloads.insert(rng.randint(len(payloads), len(payloads) + 5), again)
+    return payloads
+
+
+def install_fakes(args, recorder):
+    """外部サービスを代役に差し替え、handle_message の各段階に計測を挟む"""
+    db = FakeSupabase(rtt=args.db_rtt_ms / 1000)
+    database.supabase = db
+    gemini = FakeGenai(latency=args.gemini_ms / 1000, jitter=args.gemini_jitter_ms / 1000, seed=args.seed)
+    extractor._client = gemini
+    line_stub.latency = args.line_rtt_ms / 1000
+    bot.messenger.reply = recorder.timed("reply", bot.messenger.reply)
+
+    if args.no_ginza:
+        bot.run_ginza = lambda text: None
+    # models/ に置いた成果物を勝手に拾わないよう、指定したときだけローカル分類器を挟む
+    bot.local_classifier = LocalClassifier.load(args.local_classifier) if args.local_classifier else None
+    if bot.local_classifier:
+        bot.local_classifier.decide = recorder.timed("local", bot.local_classifier.decide)
+    for name, stage in STAGES.items():
+        setattr(bot, name, recorder.timed(stage, getattr(bot, name)))
+    return db, gemini, line_stub
+
+
+def wrap_handler(recorder, posted, done):
+    """handle_message を包み、キュー待ちと受信から処理完了までの時間を取る"""
+    original = bot.handle_message
+
+    def handle_message(event):
+        start = time.perf_counter()
+        received = posted.get(event.reply_token, start)
+        recorder.observe("queue_wait", start - received)
+        try:
+            original(event)
+        finally:
+            end = time.perf_counter()
+            recorder.observe("handle_message", end - start)
+            recorder.observe("end_to_end", end - received)
+            done.release()
+
+    bot.handle_message = handle_message
+    # inline モードでは WebhookHandler に登録済みの関数が直接呼ばれる
+    for key, func in list(bot.handler._handlers.items()):
+        if func is original:
+            bot.handler._handlers[key] = handle_message
+
+
+async def drive(payloads, concurrency, rate, recorder, posted, seed=0):
+    rng = random.Random(seed)
+    statuses = Counter()
+    accepted = set()  # 受け付けられたイベント（再送分は重複しない）
+    slots = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=bot.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=60.0) as http:
+
+        async def post(events):
+            async with slots:
+                # 返信トークンの期限は受信時刻から数えるので、timestamp は送る時刻にする
+                now = int(time.time() * 1000)
+                body, signature = sign([{**e, "timestamp": now} for e in events], bot.CHANNEL_SECRET)
+                reply_tokens = [e["replyToken"] for e in events]
+                start = time.perf_counter()
+                for reply_token in reply_tokens:
+                    posted.setdefault(reply_token, start)
+                response = await http.post(
+                    "/callback", content=body,
+                    headers={"Content-Type": "application/json", "X-Line-Signature": signature},
+                )
+                recorder.observe("callback", time.perf_counter() - start)
+                statuses[response.status_code] += 1
+                if response.status_code == 200:
+                    accepted.update(reply_tokens)
+
+        tasks = []
+        for payload in payloads:
+            tasks.append(asyncio.ensure_future(post(payload)))
+            if rate:
+                await asyncio.sleep(rng.expovariate(rate))
+        await asyncio.gather(*tasks)
+    return statuses, len(accepted)
+
+
+def report(summary, statuses, elapsed, n, db, gemini, line):
+    print(f"{n}件 / {elapsed:.2f}s  スループット {n / elapsed:.1f}件/s  応答 {dict(statuses)}")
+    print(f"Supabase往復 {db.round_trips}回  Gemini呼び出し {gemini.requests}回  返信 {len(line.replies)}件  "
+          f"プッシュ {len(line.pushes)}件  再送の重複 {bot.seen_events.duplicates.value}件")
+    hits, misses = extractor.cache.hits.value, extractor.cache.misses.value
+    if hits + misses:
+        print(f"判定キャッシュ ヒット {hits}回 / ミス {misses}回（ヒット率 {hits / (hits + misses):.1%}）")
+    print("-" * 64)
+    print(f"{'段階':16s}{'件数':>8s}{'p50':>12s}{'p95':>12s}{'p99':>12s}")
+    for stage in REPORT_ORDER:
+        if stage in summary:
+            s = summary[stage]
+            print(f"{stage:16s}{s['count']:8d}{s['p50'] * 1000:10.1f}ms{s['p95'] * 1000:10.1f}ms{s['p99'] * 1000:10.1f}ms")
+
+
+def _settings(args):
+    """結果に効く設定だけ（基準と並べて違いを知らせる）"""
+    return {k: v for k, v in vars(args).items() if k not in ("save_baseline", "check", "name", "timeout", "tolerance")}
+
+
+def load_baselines():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(name, args, summary, throughput):
+    baselines = load_baselines()
+    baselines[name] = {
+        "settings": _settings(args),
+        "throughput": throughput,
+        "stages": summary,
+    }
+    os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+    with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"基準を保存しました: {BASELINE_PATH} [{name}]")
+
+
+def compare(baseline, args, summary, tolerance):
+    """基準より p50/p95 が tolerance（割合）以上遅くなった段階を返す"""
+    regressions = []
+    print("-" * 64)
+    print(f"基準との比較（許容 +{tolerance:.0%}）")
+    settings = _settings(args)
+    changed = [k for k, v in settings.items() if baseline["settings"].get(k) != v]
+    if changed:
+        print(f"  ※ 基準と設定が違います: {', '.join(changed)}")
+    for stage in CHECKED:
+        old, new = baseline["stages"].get(stage), summary.get(stage)
+        if not old or not new:
+            continue
+        for q in ("p50", "p95"):
+            # 1ms 未満の揺れは無視する
+            limit = max(old[q] * (1 + tolerance), old[q] + 0.001)
+            mark = "NG" if new[q] > limit else "ok"
+            if mark == "NG":
+                regressions.append(f"{stage} {q}")
+            print(f"  [{mark}] {stage:16s}{q}  {old[q] * 1000:8.1f}ms → {new[q] * 1000:8.1f}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=10.0, help="1秒あたりの到着数（0 なら一斉に投げる）")
+    parser.add_argument("--events-per-body", type=int, default=1, help="1リクエストに入れるイベント数")
+    parser.add_argument("--redeliver", type=float, default=0.0, help="再送するリクエストの割合")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--corpus", help="1行1メッセージのテキストファイル（省略時は benchmarks/sample_texts）")
+    parser.add_argument("--db-rtt-ms", type=float, default=20.0)
+    parser.add_argument("--gemini-ms", type=float, default=600.0)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--line-rtt-ms", type=float, default=50.0)
+    parser.add_argument("--no-ginza", action="store_true", help="GiNZA を読み込まず、すべて Gemini で判定する")
+    parser.add_argument("--local-classifier", help="GiNZA と Gemini の間に挟むローカル分類器の成果物")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300.0, help="全件の処理完了を待つ秒数")
+    parser.add_argument("--name", default="default", help="基準の名前（設定ごとに分けて保存する）")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="基準より遅くなっていたら終了コード 1")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    posted = {}
+    done = threading.Semaphore(0)
+    db, gemini, line = install_fakes(args, recorder)
+    wrap_handler(recorder, posted, done)
+
+    bot.startup()
+    if not args.no_ginza and not bot.warmup.wait("ginza", 120):
+        sys.exit("GiNZA の読み込みが終わりませんでした")
+
+    payloads = make_payloads(
+        load_corpus(args.corpus), args.messages, args.groups, args.seed, args.events_per_body, args.redeliver,
+    )
+    start = time.perf_counter()
+    statuses, accepted = asyncio.run(drive(payloads, args.concurrency, args.rate, recorder, posted, args.seed))
+    deadline = time.monotonic() + args.timeout
+    for _ in range(accepted):
+        if not done.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            sys.exit("時間内に処理が終わりませんでした")
+    elapsed = time.perf_counter() - start
+    bot.shutdown()
+    for reply_token, _, received in line_stub.replies:
+        if reply_token in posted:
+            recorder.observe("reply_sent", received - posted[reply_token])
+
+    summary = recorder.summary()
+    throughput = accepted / elapsed
+    report(summary, statuses, elapsed, accepted, db, gemini, line)
+
+    baseline = load_baselines().get(args.name)
+    if args.save_baseline:
+        save_baseline(args.name, args, summary, throughput)
+    elif baseline:
+        regressions = compare(baseline, args, summary, args.tolerance)
+        if regressions:
+            print(f"遅くなった段階: {', '.join(regressions)}")
+            if args.check:
+                sys.exit(1)
+    elif args.check:
+        sys.exit(f"基準 [{args.name}] がありません（--save-baseline で作ってください）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# ベンチマーク用の家族チャット風サンプル文
+# （タスク・相談・引き受け・雑談が混ざるようにしてある）
+FAMILY_CHAT = [
+    "卵を買う",
+    "卵買って",
+    "明日、温泉行く",
+    "洗剤をお願い",
+    "カラオケ行く？",
+    "牛乳を買ってきて",
+    "パパが明日、洗剤を買う",
+    "来週の日曜に駅前集合ね",
+    "洗剤がないよ",
+    "昨日のテレビ面白かったね",
+    "了解",
+    "ありがとう",
+    "OK",
+    "私がやるよ",
+    "京都旅行の宿を予約しておいて",
+    "ランチ代1000円払ったよ",
+    "実家からお米が届いた",
+    "プリン買ったよ",
+    "明日集合ね",
+    "今日の夕飯なにがいい？",
+    "歯医者の予約を調べる",
+    "お父さんの誕生日会どうしようか",
+    "トイレットペーパー切れそう",
+    "今から帰るね",
+    "おつかれさま",
+    "電気代を払っておいて",
+    "週末は雨らしいよ",
+    "ゴミ出しお願い",
+    "新潟旅行の候補地を調べておく",
+    "いいね！",
+]
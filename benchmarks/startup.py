@@ -0,0 +1,47 @@
+"""
+起動時間の計測：main の import にかかる時間と、バックグラウンドの初期化が終わって /ready になるまでの時間
+    python -m benchmarks.startup --runs 3
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+SCRIPT = """
+import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+main.startup()
+main.warmup.wait("ginza")
+main.warmup.wait("gemini")
+print(imported, time.perf_counter() - start, main.warmup.is_ready())
+main.shutdown()
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # 鍵が無くても起動だけは計測できるようにダミーを入れる（外部通信はしない）
+    env.setdefault("GOOGLE_API_KEY", "dummy")
+    env.setdefault("LINE_CHANNEL_SECRET", "dummy")
+    env.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "dummy")
+
+    imports, readies = [], []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", SCRIPT], capture_output=True, text=True, env=env, check=True)
+        imported, ready, ok = out.stdout.strip().splitlines()[-1].split()
+        imports.append(float(imported))
+        readies.append(float(ready))
+
+    print(f"import main     : median {statistics.median(imports) * 1000:7.1f}ms  (webhookを受け付け可能になるまで)")
+    print(f"ready           : median {statistics.median(readies) * 1000:7.1f}ms  (GiNZA・Geminiの初期化完了まで, ok={ok})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+共有リスト画面（templates/index.html）のデータ取得の比較。5000件の合成タスクで計測する
+    python -m benchmarks.web_list --tasks 5000 --rtt-ms 30
+    python -m benchmarks.web_list --dom-html /tmp/list_dom.html   # ブラウザで開いて DOM 構築の時間も測る
+
+  以前 : ブラウザから supabase-js で tasks を status=pending で全件 select し、1行ずつ innerHTML += で足す
+  現在 : FastAPI の GET /tasks から1ページずつ（キーセット方式）取り、1ページ分を DocumentFragment で一度に足す
+         最初の1ページが出るまでの時間と、「もっと見る」で最後まで読んだときの合計を測る
+（API 側は FakeSupabase に往復遅延を入れ、httpx の ASGITransport でアプリを直接呼ぶ）
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+
+import httpx
+
+# 鍵が無くても import できるようにダミーを入れる（LINE には接続しない）
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "dummy")
+os.environ.setdefault("LINE_CHANNEL_SECRET", "dummy")
+
+import main as bot  # noqa: E402
+from benchmarks.fakes import FakeSupabase  # noqa: E402
+from modules import database  # noqa: E402
+
+GROUP = "bench-group"
+
+
+def make_client(n, rtt, seed=0):
+    random.seed(seed)
+    client = FakeSupabase()
+    for i in range(n):
+        client.table("tasks").insert({
+            "family_group_id": GROUP,
+            "content": f"タスク{i} " + "あ" * random.randint(5, 30),
+            "type": random.choice(["task", "task", "idea"]),
+            "topic": random.choice(["買い物", "家事", "旅行"]),
+            "assignee_id": random.choice([None, "私", "母"]),
+            "status": "pending",
+        }).execute()
+    client.rtt = rtt
+    return client
+
+
+def legacy(client):
+    """以前の画面と同じ問い合わせ（全件・全列）。返り値は (件数, 転送量)"""
+    rows = client.table("tasks").select("*").eq("status", "pending").order("created_at", desc=True).execute().data
+    return len(rows), len(json.dumps(rows, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+async def paged(http, limit, first_only=False):
+    """GET /tasks を next_cursor が無くなるまで辿る。返り値は (件数, 転送量, 最初のページまでの秒数)"""
+    start = time.perf_counter()
+    count = size = 0
+    first = None
+    cursor = None
+    while True:
+        params = {"group": GROUP, "status": "pending", "limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = await http.get("/tasks", params=params)
+        response.raise_for_status()
+        page = response.json()
+        count += len(page["items"])
+        size += len(response.content)
+        if first is None:
+            first = time.perf_counter() - start
+        cursor = page["next_cursor"]
+        if first_only or not cursor:
+            return count, size, first
+
+
+def measure(func, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def write_dom_harness(path, n):
+    """以前（innerHTML +=）と現在（createElement + DocumentFragment）の DOM 構築をブラウザで比べる HTML"""
+    items = [
+        {"id": i, "content": f"タスク{i}", "type": "task" if i % 3 else "idea",
+         "assignee_id": None if i % 2 else "私", "created_at": "2026-10-17T09:00:00"}
+        for i in range(n, 0, -1)
+    ]
+    html = """<!DOCTYPE html>
+<html lang="ja"><head><meta charset="UTF-8"><title>list DOM benchmark</title></head>
+<body><pre id="out"></pre><div id="a"></div><div id="b"></div>
+<script>
+const ITEMS = %s;
+const out = document.getElementById('out');
+function legacy(box) {
+    box.innerHTML = '';
+    ITEMS.forEach(item => {
+        box.innerHTML += `<div class="card" id="card-${item.id}"><div class="content">
+            <span class="type-badge">${item.type === 'idea' ? 'メモ' : '買う/やる'}</span>
+            <div class="summary">${item.content}</div><div class="assignee">👤 ${item.assignee_id || "未定"}</div>
+            <div class="date">${item.created_at.slice(5, 10)}</div></div><button class="done-btn">完了！</button></div>`;
+    });
+}
+function current(box) {
+    box.textContent = '';
+    const fragment = document.createDocumentFragment();
+    for (const item of ITEMS) {
+        const card = document.createElement('div'); card.className = 'card';
+        const content = document.createElement('div'); content.className = 'content';
+        for (const [cls, text] of [['type-badge', item.type === 'idea' ? 'メモ' : '買う/やる'], ['summary', item.content],
+                                   ['assignee', `👤 ${item.assignee_id || "未定"}`], ['date', item.created_at.slice(5, 10)]]) {
+            const node = document.createElement(cls === 'type-badge' ? 'span' : 'div');
+            node.className = cls; node.textContent = text; content.appendChild(node);
+        }
+        const button = document.createElement('button'); button.className = 'done-btn'; button.textContent = '完了！';
+        card.append(content, button); fragment.appendChild(card);
+    }
+    box.appendChild(fragment);
+}
+function time(label, func, box) {
+    const start = performance.now();
+    func(box);
+    box.offsetHeight;  // レイアウトまで含める
+    out.textContent += `${label}: ${(performance.now() - start).toFixed(1)}ms\\n`;
+}
+out.textContent = `${ITEMS.length}件\\n`;
+time('以前 (innerHTML +=)', legacy, document.getElementById('a'));
+time('現在 (DocumentFragment)', current, document.getElementById('b'));
+</script></body></html>
+""" % json.dumps(items, ensure_ascii=False)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    print(f"{path} をブラウザで開くと DOM 構築の時間が表示されます")
+
+
+async def run(args):
+    client = make_client(args.tasks, args.rtt_ms / 1000)
+    database.supabase = client
+    transport = httpx.ASGITransport(app=bot.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        base, (base_count, base_size) = measure(lambda: legacy(client), args.repeat)
+
+        firsts, totals = [], []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            count, size, first = await paged(http, args.page_size)
+            totals.append(time.perf_counter() - start)
+            firsts.append(first)
+        _, first_size, _ = await paged(http, args.page_size, first_only=True)
+    assert count == base_count, "件数が一致しません"
+
+    print(f"{args.tasks}件, 往復 {args.rtt_ms}ms, 1ページ {args.page_size}件（中央値, {args.repeat}回）")
+    print("-" * 64)
+    print(f"以前 全件 select            {base * 1000:8.1f}ms  {base_size / 1024:8.1f}KB")
+    first = statistics.median(firsts)
+    print(f"現在 最初の1ページ          {first * 1000:8.1f}ms  {first_size / 1024:8.1f}KB  (x{base / first:.1f})")
+    print(f"現在 最後までページング     {statistics.median(totals) * 1000:8.1f}ms  {size / 1024:8.1f}KB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--rtt-ms", type=float, default=30.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dom-html", help="DOM 構築を比べる HTML を書き出す先")
+    args = parser.parse_args()
+    if args.dom_html:
+        write_dom_harness(args.dom_html, args.tasks)
+        return
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
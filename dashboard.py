@@ -1,6 +1,7 @@
+import os
 import streamlit as st
-import pandas as pd
-from modules.database import supabase
+from modules.database import supabase, update_task_status, delete_task
+from modules.dashboard_data import TaskStore
 
 # --- ページ設定 ---
 st.set_page_config(page_title="FamilyFlow Board", layout="wide")
@@ -42,18 +43,41 @@ if not supabase:
     st.error("Supabase設定エラー")
     st.stop()
 
-# --- DB操作関数 ---
+# --- データ ---
+# 表示する家族グループ（URLの ?group=... か DASHBOARD_GROUP_ID。どちらもなければ全グループ）
+group_id = st.query_params.get("group") or os.environ.get("DASHBOARD_GROUP_ID")
+
+@st.cache_resource
+def get_store(group_id):
+    # 再実行・セッションをまたいで使い回し、前回からの差分だけを取りに行く
+    return TaskStore(supabase, group_id)
+
+store = get_store(group_id)
+
+# ボットの変更フィード（例: http://localhost:8000/events）。設定があれば届いた差分をそのまま反映する
+# フィードに載るのはボット側の書き込みだけなので、ここでの書き込みや他所の変更は
+# 設定の有無にかかわらず DASHBOARD_REFRESH_SECONDS ごとの updated_at の差分で拾う
+EVENTS_URL = os.environ.get("DASHBOARD_EVENTS_URL")
+REFRESH_SECONDS = float(os.environ.get("DASHBOARD_REFRESH_SECONDS", "3"))
+if EVENTS_URL:
+    store.follow(EVENTS_URL)
+
+# --- DB操作関数（書き込んだら差分を取り直させる） ---
 def update_status(task_id, new_status):
-    supabase.table("tasks").update({"status": new_status}).eq("id", task_id).execute()
+    update_task_status(task_id, new_status)
+    store.invalidate()
 
 def hard_delete_task(task_id):
-    supabase.table("tasks").delete().eq("id", task_id).execute()
+    delete_task(task_id)
+    store.forget(task_id)
 
 def assign_task(task_id, user_name):
     supabase.table("tasks").update({"assignee_id": user_name}).eq("id", task_id).execute()
+    store.invalidate()
 
 def release_task(task_id):
     supabase.table("tasks").update({"assignee_id": None}).eq("id", task_id).execute()
+    store.invalidate()
 
 # --- サイドバー ---
 st.sidebar.title("ユーザー選択")
@@ -61,25 +85,29 @@ family_members = ["私", "母", "父", "妹"]
 current_user = st.sidebar.selectbox("あなたは誰ですか？", family_members)
 st.sidebar.markdown("---")
 if st.sidebar.button('再読み込み'):
+    store.invalidate()
     st.rerun()
 
 # --- データ取得 ---
-response = supabase.table("tasks").select("*").order("created_at", desc=True).limit(100).execute()
-if not response.data:
+# (区分, 状態, トピック) ごとの分割はデータが変わったときだけ作り直す
+part = store.partition()
+st.session_state["rendered_version"] = store.version
+
+@st.fragment(run_every=REFRESH_SECONDS)
+def watch_changes():
+    # 画面を描いた後にデータが変わっていたら、描き直す（「再読み込み」を押さなくても反映される）
+    store.frame()
+    if store.version != st.session_state.get("rendered_version"):
+        st.rerun()
+
+watch_changes()
+
+if not part.groups:
     st.info("データがありません")
     st.stop()
-df = pd.DataFrame(response.data)
-
-if 'topic' not in df.columns:
-    df['topic'] = "一般"
-df['topic'] = df['topic'].fillna("一般")
 
 st.title(f"FamilyFlow Board")
 
-ROUTINE_TOPICS = ["一般", "買い物", "家事", "雑多なタスク", "未分類", "アイデア"]
-df_routine = df[df['topic'].isin(ROUTINE_TOPICS)]
-df_project = df[~df['topic'].isin(ROUTINE_TOPICS)]
-
 # --- レイアウト比率 ---
 LAYOUT = [1, 10, 1]
 
@@ -88,60 +116,68 @@ def render_task_row(row, is_history=False):
     # ★ここが魔法の修正点！ vertical_alignment="center" で強制的に中央揃えにする
     c_icon, c_text, c_action = st.columns(LAYOUT, vertical_alignment="center")
     
-    assignee = row.get('assignee_id')
+    assignee = row.assignee_id
     
     # --- 1. 左アイコン ---
     if is_history:
         # 履歴モード: 戻すボタン
-        if c_icon.button(":material/undo:", key=f"rev_{row['id']}"):
-            update_status(row['id'], "pending")
+        if c_icon.button(":material/undo:", key=f"rev_{row.id}"):
+            update_status(row.id, "pending")
             st.rerun()
     else:
         # 通常モード
         if assignee is None or assignee == current_user:
             # 完了ボタン (○)
-            if c_icon.button(":material/radio_button_unchecked:", key=f"check_{row['id']}"):
-                update_status(row['id'], "done")
+            if c_icon.button(":material/radio_button_unchecked:", key=f"check_{row.id}"):
+                update_status(row.id, "done")
                 st.rerun()
         else:
             # 他人のタスク (Lock)
             # ★ポイント: Markdownではなく「無効化されたボタン」として表示することで、サイズ・位置が完全に一致します
-            c_icon.button(":material/lock:", key=f"lock_{row['id']}", disabled=True)
+            c_icon.button(":material/lock:", key=f"lock_{row.id}", disabled=True)
 
     # --- 2. テキスト ---
-    doer = row.get('assignee_id', 'ー')
-    date = row['created_at'][5:10].replace('-', '/')
+    doer = assignee or 'ー'
+    date = row.created_at[5:10].replace('-', '/')
     
     if is_history:
         style = "done-text"
-        c_text.markdown(f"<span class='{style}'>{row['content']}</span> <span class='meta'>{doer} ({date})</span>", unsafe_allow_html=True)
+        c_text.markdown(f"<span class='{style}'>{row.content}</span> <span class='meta'>{doer} ({date})</span>", unsafe_allow_html=True)
     else:
         if assignee == current_user:
-            c_text.markdown(f"<span class='my-task'>{row['content']}</span>", unsafe_allow_html=True)
+            c_text.markdown(f"<span class='my-task'>{row.content}</span>", unsafe_allow_html=True)
         elif assignee:
-            c_text.markdown(f"<span class='other-task'>{row['content']} ({assignee})</span>", unsafe_allow_html=True)
+            c_text.markdown(f"<span class='other-task'>{row.content} ({assignee})</span>", unsafe_allow_html=True)
         else:
-            c_text.write(f"{row['content']}")
+            c_text.write(f"{row.content}")
 
     # --- 3. 右アイコン ---
     if is_history:
         # 履歴モード: 抹消ボタン
-        if c_action.button(":material/close:", key=f"hard_{row['id']}"):
-            hard_delete_task(row['id'])
+        if c_action.button(":material/close:", key=f"hard_{row.id}"):
+            hard_delete_task(row.id)
             st.rerun()
     else:
         # 通常モード
         if assignee == current_user:
-            if c_action.button(":material/remove_circle_outline:", key=f"drop_{row['id']}"):
-                release_task(row['id'])
+            if c_action.button(":material/remove_circle_outline:", key=f"drop_{row.id}"):
+                release_task(row.id)
                 st.rerun()
         elif assignee:
             c_action.write("") 
         else:
-            if c_action.button(":material/person_add:", key=f"pick_{row['id']}"):
-                assign_task(row['id'], current_user)
+            if c_action.button(":material/person_add:", key=f"pick_{row.id}"):
+                assign_task(row.id, current_user)
                 st.rerun()
 
+def render_history(bucket):
+    # 開いたときだけ中身を描画する（on_change="rerun" で開閉状態が .open に入る）
+    for label, status in [("完了履歴", "done"), ("ゴミ箱", "deleted")]:
+        with st.expander(f"{label} ({part.count(bucket, status)})", key=f"{bucket}_{status}", on_change="rerun") as section:
+            if section.open:
+                for row in part.rows(bucket, status):
+                    render_task_row(row, is_history=True)
+
 # --- メインエリア ---
 col_task, col_idea = st.columns([1, 1])
 
@@ -151,55 +187,43 @@ col_task, col_idea = st.columns([1, 1])
 with col_task:
     st.subheader("日常リスト")
     with st.container(border=True):
-        active_routine = df_routine[df_routine['status'] == 'pending']
+        active_routine = part.rows("routine", "pending")
         if len(active_routine) == 0:
             st.caption("タスクなし")
         else:
-            for _, row in active_routine.iterrows():
+            for row in active_routine:
                 render_task_row(row, is_history=False)
                 st.markdown("<div style='margin-bottom: 5px;'></div>", unsafe_allow_html=True) # 少し余白
 
     st.markdown("---")
-    with st.expander("完了履歴"):
-        for _, row in df_routine[df_routine['status'] == 'done'].iterrows():
-            render_task_row(row, is_history=True)
-    with st.expander("ゴミ箱"):
-        for _, row in df_routine[df_routine['status'] == 'deleted'].iterrows():
-            render_task_row(row, is_history=True)
+    render_history("routine")
 
 # ==========================================
 # 右側：プロジェクト
 # ==========================================
 with col_idea:
     st.subheader("プロジェクト")
-    active_projects = df_project[df_project['status'] == 'pending']
+    active_projects = part.topics("project", "pending")
     
     if len(active_projects) == 0:
         st.info("プロジェクトなし")
     else:
-        topics = active_projects['topic'].unique()
-        for topic in topics:
-            topic_df = active_projects[active_projects['topic'] == topic]
-            with st.expander(f"{topic} ({len(topic_df)})", expanded=True):
-                for _, row in topic_df.iterrows():
+        for topic, topic_rows in active_projects:
+            with st.expander(f"{topic} ({len(topic_rows)})", expanded=True):
+                for row in topic_rows:
                     # プロジェクトも同じ関数を使う（ただしアサイン機能はボタンを表示しないだけ）
                     # ここではシンプルにするため直接書きますが、vertical_alignmentを使います
                     c_icon, c_text, c_del = st.columns(LAYOUT, vertical_alignment="center")
                     
-                    if c_icon.button(":material/radio_button_unchecked:", key=f"chk_proj_{row['id']}"):
-                        update_status(row['id'], "done")
+                    if c_icon.button(":material/radio_button_unchecked:", key=f"chk_proj_{row.id}"):
+                        update_status(row.id, "done")
                         st.rerun()
                     
-                    c_text.write(f"{row['content']}")
+                    c_text.write(f"{row.content}")
                     
-                    if c_del.button(":material/delete:", key=f"del_proj_{row['id']}"):
-                        update_status(row['id'], "deleted")
+                    if c_del.button(":material/delete:", key=f"del_proj_{row.id}"):
+                        update_status(row.id, "deleted")
                         st.rerun()
 
     st.markdown("---")
-    with st.expander("完了履歴"):
-        for _, row in df_project[df_project['status'] == 'done'].iterrows():
-            render_task_row(row, is_history=True)
-    with st.expander("ゴミ箱"):
-        for _, row in df_project[df_project['status'] == 'deleted'].iterrows():
-            render_task_row(row, is_history=True)
\ No newline at end of file
+    render_history("project")
@@ -1,8 +1,8 @@
-import spacy
-from spacy import displacy
+from modules.ginza_logic import get_nlp
 
 print("GiNZAモデルを読み込み中...")
-nlp = spacy.load('ja_ginza')
+# 金額・日付を doc.ents から拾うので NER 入りの "memo" プロファイルを使う
+nlp = get_nlp("memo")
 
 def analyze_fridge_memo(text):
     doc = nlp(text)
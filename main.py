@@ -1,87 +1,367 @@
 import os
 import sys
+import logging
 from fastapi import FastAPI, Request, HTTPException
-from linebot import LineBotApi, WebhookHandler
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from linebot import WebhookHandler
 from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
+from linebot.models import MessageEvent, TextMessage
 from dotenv import load_dotenv
 
-# モジュールの読み込み
-# assign_latest_task と get_active_topics があることを確認してください
-from modules.database import add_task, save_message, get_recent_messages, assign_latest_task, get_active_topics
-from modules.extractor import analyze_message
-from modules.ginza_logic import analyze_with_ginza
-
 load_dotenv()
 
+# ログは LOG_LEVEL=DEBUG で受信メッセージや判定経路まで出る（既定の INFO では警告・エラーと遅いリクエストだけ）
+# モジュールの import 時に出るログにも効くよう、読み込みより先に設定する
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+# Supabase・Gemini への1リクエストごとの INFO ログは多すぎるので出さない
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# モジュールの読み込み
+# assign_latest_task と ingest_message があることを確認してください
+from modules.database import (
+    add_task, ingest_message, assign_latest_task, save_message, save_label, list_tasks, update_task_status,
+    message_writer, label_writer, topic_index, history_buffer,
+)
+from modules.extractor import analyze_message, get_client
+from modules.ginza_logic import analyze_with_ginza, might_match, get_nlp
+from modules.ginza_pool import GinzaPool
+from modules.dispatcher import WebhookDispatcher, SeenEvents
+from modules.warmup import Warmup
+from modules.line_client import LineMessenger
+from modules.local_classifier import NONE_LABEL, LocalClassifier, latest_artifact, label_of
+from modules import metrics, supabase_pool, tracing
+from modules.change_feed import feed, format_sse
+
 CHANNEL_ACCESS_TOKEN = os.environ.get("LINE_CHANNEL_ACCESS_TOKEN")
 CHANNEL_SECRET = os.environ.get("LINE_CHANNEL_SECRET")
+# LINE Messaging API の接続先（ローカルのスタブで試すときに差し替える）
+LINE_API_HOST = os.environ.get("LINE_API_HOST", "https://api.line.me")
+# 返信トークンの有効期限（秒）。これを過ぎたら返信ではなくプッシュで送る
+LINE_REPLY_TOKEN_TTL = float(os.environ.get("LINE_REPLY_TOKEN_TTL", "50"))
+LINE_REPLY_TIMEOUT = float(os.environ.get("LINE_REPLY_TIMEOUT", "10"))
+LINE_MAX_CONNECTIONS = int(os.environ.get("LINE_MAX_CONNECTIONS", "10"))
+
+# "queue": 署名検証だけして即200を返し、ワーカーで処理する / "inline": 従来どおりその場で処理する
+DISPATCH_MODE = os.environ.get("DISPATCH_MODE", "queue")
+DISPATCH_WORKERS = int(os.environ.get("DISPATCH_WORKERS", "4"))
+DISPATCH_QUEUE_SIZE = int(os.environ.get("DISPATCH_QUEUE_SIZE", "1000"))
+# LINE の再送を見分けるため、引き受けた webhookEventId をこの件数・秒数だけ覚えておく
+WEBHOOK_DEDUP_SIZE = int(os.environ.get("WEBHOOK_DEDUP_SIZE", "10000"))
+WEBHOOK_DEDUP_TTL = float(os.environ.get("WEBHOOK_DEDUP_TTL", "3600"))
 
-line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
+# GiNZAをプロセスプールで動かす場合のワーカー数（0ならこのプロセス内で解析する）
+GINZA_WORKERS = int(os.environ.get("GINZA_WORKERS", "0"))
+GINZA_TIMEOUT = float(os.environ.get("GINZA_TIMEOUT", "5"))
+# タスク判定ルールが読むコンポーネントだけを載せたプロファイル（modules/ginza_logic.PROFILES）
+GINZA_PROFILE = os.environ.get("GINZA_PROFILE", "task-rules")
+# モデル読み込み中に届いたメッセージの扱い
+#   "llm":  GiNZAを飛ばしてGeminiで判定する
+#   "wait": 読み込み完了まで（最大 WARMUP_WAIT_TIMEOUT 秒）ワーカー上で待たせる
+WARMUP_POLICY = os.environ.get("WARMUP_POLICY", "llm")
+WARMUP_WAIT_TIMEOUT = float(os.environ.get("WARMUP_WAIT_TIMEOUT", "30"))
+# GiNZA と Gemini の間に挟むローカル分類器（python train_local_classifier.py で作る）
+#   LOCAL_CLASSIFIER_PATH を省くと models/ の一番新しい版を使う。無ければ今まで通り Gemini に回す
+LOCAL_CLASSIFIER = os.environ.get("LOCAL_CLASSIFIER", "1") == "1"
+LOCAL_CLASSIFIER_PATH = os.environ.get("LOCAL_CLASSIFIER_PATH") or latest_artifact(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+)
+# 成果物に入っている閾値（学習時に評価データで決めたもの）を上書きする
+LOCAL_CLASSIFIER_THRESHOLD = os.environ.get("LOCAL_CLASSIFIER_THRESHOLD")
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+TASK_STATUSES = ("pending", "done", "deleted", "all")
+
+messenger = LineMessenger(
+    CHANNEL_ACCESS_TOKEN, host=LINE_API_HOST, reply_token_ttl=LINE_REPLY_TOKEN_TTL,
+    reply_timeout=LINE_REPLY_TIMEOUT, max_connections=LINE_MAX_CONNECTIONS,
+)
 handler = WebhookHandler(CHANNEL_SECRET)
 
+local_classifier = None
+if LOCAL_CLASSIFIER and LOCAL_CLASSIFIER_PATH:
+    try:
+        local_classifier = LocalClassifier.load(LOCAL_CLASSIFIER_PATH)
+        if LOCAL_CLASSIFIER_THRESHOLD:
+            local_classifier.threshold = float(LOCAL_CLASSIFIER_THRESHOLD)
+        logger.info("ローカル分類器 v%s を読み込みました（閾値 %.2f, %s）", local_classifier.version,
+                    local_classifier.threshold, ",".join(sorted(local_classifier.categories)))
+    except Exception as e:
+        logger.error("ローカル分類器の読み込みに失敗しました（Gemini に回します）: %r", e)
+
 app = FastAPI()
 
+# GiNZA で判定できたか、ローカル分類器で決めたか、Gemini に回したか
+routed = {
+    "ginza": metrics.counter("pipeline_route_total", route="ginza"),
+    "local": metrics.counter("pipeline_route_total", route="local"),
+    "llm": metrics.counter("pipeline_route_total", route="llm"),
+}
+
+def dispatch_event(event):
+    """キューから取り出したイベントを該当ハンドラに渡す"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        handle_message(event)
+
+def event_group_id(event):
+    """イベントの家族グループ（個人チャットならユーザーID）"""
+    return getattr(event.source, "group_id", event.source.user_id)
+
+# 同じグループのイベントは届いた順に、違うグループは並行に処理する
+dispatcher = WebhookDispatcher(
+    dispatch_event, workers=DISPATCH_WORKERS, maxsize=DISPATCH_QUEUE_SIZE, key=event_group_id,
+)
+seen_events = SeenEvents(maxsize=WEBHOOK_DEDUP_SIZE, ttl=WEBHOOK_DEDUP_TTL)
+redeliveries = metrics.counter("webhook_redeliveries_total")
+
+def claim_event(event):
+    """このイベントを処理してよいか（同じ webhookEventId を引き受け済みなら False）"""
+    event_id = getattr(event, "webhook_event_id", None)
+    if not event_id:
+        return True
+    delivery = getattr(event, "delivery_context", None)
+    if delivery is not None and delivery.is_redelivery:
+        redeliveries.inc()
+    return seen_events.claim(event_id)
+
+
+ginza_pool = GinzaPool(workers=GINZA_WORKERS, timeout=GINZA_TIMEOUT, profile=GINZA_PROFILE) if GINZA_WORKERS > 0 else None
+
+def warm_up_ginza():
+    if ginza_pool:
+        ginza_pool.start()
+        get_nlp("tokenizer")  # 前段フィルタ用
+    else:
+        get_nlp(GINZA_PROFILE)
+
+# 起動直後からWebhookを受け付けられるよう、重い初期化はバックグラウンドで行う
+warmup = Warmup({"ginza": warm_up_ginza, "gemini": get_client})
+
+def run_ginza(text):
+    """GiNZA解析（プールがあればワーカープロセスで、なければこのプロセスで）"""
+    if not warmup.is_ready("ginza"):
+        if WARMUP_POLICY != "wait" or not warmup.wait("ginza", WARMUP_WAIT_TIMEOUT):
+            logger.debug("GiNZA読み込み中のためスキップ")
+            return None
+    if ginza_pool:
+        # ターゲット動詞が無い雑談はワーカーに送る前にここで落とす
+        if not might_match(text):
+            return None
+        return ginza_pool.analyze(text)
+    return analyze_with_ginza(text, profile=GINZA_PROFILE)
+
+@app.on_event("startup")
+def startup():
+    warmup.start()
+    if DISPATCH_MODE == "queue":
+        dispatcher.start()
+
+@app.on_event("shutdown")
+def shutdown():
+    if DISPATCH_MODE == "queue":
+        dispatcher.stop()
+    if ginza_pool:
+        ginza_pool.stop()
+    if message_writer:
+        message_writer.stop()  # ためているチャットログを書き切る
+    if label_writer:
+        label_writer.stop()
+    messenger.close()  # プッシュに回した返信を送り切る
+
 @app.get("/")
 def root():
     return {"message": "FamilyFlow Bot is running!"}
 
+@app.get("/ready")
+def ready():
+    # "/" は生存確認、こちらはモデル等の読み込みが終わってトラフィックを受けられるかの確認
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/stats")
+def stats():
+    return {
+        "dispatcher": dispatcher.stats(),
+        "seen_events": seen_events.stats(),
+        "warmup": warmup.status(),
+        "message_writer": message_writer.stats() if message_writer else None,
+        "local_classifier": {"version": local_classifier.version, "threshold": local_classifier.threshold}
+        if local_classifier else None,
+        "topic_index": topic_index.stats() if topic_index else None,
+        "history_buffer": history_buffer.stats() if history_buffer else None,
+        "supabase_pool": supabase_pool.stats(),
+        "change_feed": feed.stats(),
+        "line": messenger.stats(),
+        "metrics": metrics.snapshot(),
+    }
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """/stats と同じメトリクスを Prometheus のテキスト形式で返す"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/list")
+def task_list_page():
+    """共有リストの画面（データは /tasks と /events から取る）"""
+    return FileResponse(os.path.join(TEMPLATE_DIR, "index.html"))
+
+@app.get("/tasks")
+def tasks(group: str | None = None, status: str = "pending", cursor: str | None = None, limit: int = 50):
+    """タスク一覧を新しい順に1ページずつ返す（続きは next_cursor を cursor に渡す）"""
+    if status not in TASK_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(TASK_STATUSES)}")
+    try:
+        rows, next_cursor = list_tasks(group, None if status == "all" else status, cursor, max(1, min(limit, 200)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if rows is None:
+        raise HTTPException(status_code=502, detail="Database error")
+    return {"items": rows, "next_cursor": next_cursor}
+
+class CompleteTaskRequest(BaseModel):
+    id: int
+
+@app.post("/complete_task")
+def complete_task(req: CompleteTaskRequest):
+    response = update_task_status(req.id, "done")
+    if response is None:
+        raise HTTPException(status_code=502, detail="Database error")
+    if not response.data:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return {"task": response.data[0]}
+
+@app.get("/events")
+async def events(request: Request, group: str | None = None):
+    """
+    タスクの変更（ボットが書き込んだ行）を Server-Sent Events で流す。
+    画面側は最初に一覧を取ったあと、ここから届く差分で表示を書き換える
+    """
+    last_id = request.headers.get("Last-Event-ID") or request.query_params.get("last_id")
+    last_id = int(last_id) if last_id and last_id.isdigit() else None
+
+    async def stream():
+        async for event in feed.subscribe(last_id=last_id, group_id=group):
+            yield format_sse(event)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/callback")
 async def callback(request: Request):
     signature = request.headers.get("X-Line-Signature", "")
     body = await request.body()
     body_decode = body.decode("utf-8")
+
     try:
-        handler.handle(body_decode, signature)
+        events = handler.parser.parse(body_decode, signature)
     except InvalidSignatureError:
         raise HTTPException(status_code=400, detail="Invalid signature")
+
+    if DISPATCH_MODE != "queue":
+        # 従来どおりその場で、届いた順に処理する
+        for event in events:
+            if claim_event(event):
+                dispatch_event(event)
+        return "OK"
+
+    # 署名検証とパースだけここで行い、処理本体はワーカーに任せる
+    for event in events:
+        if not claim_event(event):
+            continue  # 再送。引き受け済みなので二重に処理しない
+        if not dispatcher.submit(event):
+            # キューが溢れている → LINE側に再送してもらう（このイベントは再送時に処理する）
+            seen_events.release(event.webhook_event_id)
+            raise HTTPException(status_code=503, detail="Busy")
     return "OK"
 
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
+    group_id = event_group_id(event)
+    # 各段階の所要時間は pipeline_stage_seconds{stage=...}、遅いときは内訳がログに出る
+    with tracing.trace("handle_message", group_id):
+        _handle_message(event, group_id)
+
+
+# ラベルに使うカテゴリ（Gemini の出力をそのままラベルにすると値が際限なく増えるので、これ以外は other にまとめる）
+OUTCOME_CATEGORIES = {"task", "idea", "accept"}
+
+
+def _count_outcome(category, outcome):
+    label = "none" if category is None else category if category in OUTCOME_CATEGORIES else "other"
+    metrics.counter("pipeline_outcomes_total", category=label, outcome=outcome).inc()
+
+
+def _handle_message(event, group_id):
     user_msg = event.message.text
     user_id = event.source.user_id
-    group_id = getattr(event.source, "group_id", user_id)
 
-    print(f"📩 受信: {user_msg}")
+    logger.debug("📩 受信: %s", user_msg)
 
     # 1. 履歴取得 & 保存
-    history = get_recent_messages(group_id, limit=5)
-    save_message(group_id, user_id, user_msg, role="user")
-    
-    # ★DBから現在進行中のプロジェクト名リストを取得（カンニングペーパー）
-    current_topics = get_active_topics(group_id)
-    print(f"📂 現在のプロジェクト: {current_topics}")
+    # ★DBから現在進行中のプロジェクト名リストも一緒に取得（カンニングペーパー）
+    with tracing.span("ingest"):
+        # LINE のメッセージIDを識別子にする（DB関数の呼び直しや再送で同じ発言が二重に残らない）
+        history, current_topics = ingest_message(group_id, user_id, user_msg, role="user", request_id=event.message.id)
+    logger.debug("📂 現在のプロジェクト: %s", current_topics)
 
     # 2. 解析 (GiNZA -> Gemini)
-    ginza_result = analyze_with_ginza(user_msg)
+    with tracing.span("ginza"):
+        ginza_result = run_ginza(user_msg)
     
+    local_label = None
+    if not ginza_result and local_classifier:
+        with tracing.span("local_classifier"):
+            local_label = local_classifier.decide(user_msg)
+
     if ginza_result:
-        print("⚡️ GiNZA判定")
+        logger.debug("⚡️ GiNZA判定")
         category = ginza_result.get("category")
         summary = ginza_result.get("summary")
         source_type = "ginza"
         llm_result = {}
+        save_label(group_id, user_msg, category, source="ginza")
+    elif local_label:
+        logger.debug("🪶 ローカル分類器判定: %s", local_label)
+        # カテゴリしか分からないので、要約は発言そのまま・トピックは GiNZA と同じ既定値にする
+        category = None if local_label == NONE_LABEL else local_label
+        summary = user_msg
+        source_type = "local"
+        llm_result = {}
     else:
-        print("🤔 Gemini判定")
+        logger.debug("🤔 Gemini判定")
         # ★ここで current_topics を渡して表記ゆれを防ぐ
-        llm_result = analyze_message(user_msg, history=history, existing_topics=current_topics)
+        with tracing.span("gemini"):
+            llm_result = analyze_message(user_msg, history=history, existing_topics=current_topics)
         category = llm_result.get("category")
         summary = llm_result.get("summary")
         source_type = "llm"
+        if not llm_result.get("fallback") and label_of(category):
+            save_label(group_id, user_msg, category, llm_result.get("topic"), source="llm")
+    routed[source_type].inc()
 
     # 3. 処理分岐
     if category == "task":
         # 新規タスクは「担当者なし」で登録
         topic = llm_result.get("topic", "一般") if source_type == "llm" else "一般"
-        add_task(group_id, summary, task_type="task", topic=topic, assignee=None)
+        with tracing.span("write_task"):
+            add_task(group_id, summary, task_type="task", topic=topic, assignee=None)
+        _count_outcome(category, "registered")
         
         # 修正1：説明文を削除し、登録報告だけにする
         reply_text = f"✅ 登録: {summary}\n(案件: {topic})"
         
     elif category == "idea":
         topic = llm_result.get("topic", "アイデア") if source_type == "llm" else "アイデア"
-        add_task(group_id, summary, task_type="idea", topic=topic)
+        with tracing.span("write_task"):
+            add_task(group_id, summary, task_type="idea", topic=topic)
+        _count_outcome(category, "registered")
         reply_text = f"💡 メモ: {summary} (案件: {topic})"
         
     elif category == "accept":
@@ -89,27 +369,34 @@ def handle_message(event):
         user_name = "私" 
         
         # 直近のタスクを更新しに行く
-        task_content, assigned_name = assign_latest_task(group_id, user_name)
+        with tracing.span("write_task"):
+            task_content, assigned_name = assign_latest_task(group_id, user_name)
         
         if task_content:
             # 成功した場合（日常タスク）のみ返信する
+            _count_outcome(category, "assigned")
             reply_text = f"🙆‍♀️ {assigned_name}さんにアサインしました！\n担当: {task_content}"
         
         elif assigned_name == "project_locked":
             # 修正2：プロジェクト案件の場合は、何も言わずに終了する（return）
-            print("プロジェクト案件のためアサインスキップ（返信なし）")
+            _count_outcome(category, "project_locked")
+            logger.debug("プロジェクト案件のためアサインスキップ（返信なし）")
             return
             
         else:
-            print("割り当て対象なし")
+            _count_outcome(category, "no_target")
+            logger.debug("割り当て対象なし")
             return
 
     else:
-        print("雑談/その他 スルー")
+        _count_outcome(category, "ignored")
+        logger.debug("雑談/その他 スルー")
         return
 
-    # 4. 返信
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextSendMessage(text=reply_text)
-    )
\ No newline at end of file
+    # 4. 返信（送信は共有ループに任せて待たない。間に合わなければプッシュで送られる）
+    with tracing.span("reply"):
+        messenger.reply(event, reply_text)
+
+    # Botの返信も会話ログに残す（次の判定で「Bot」の発言として文脈に入る）
+    with tracing.span("save_reply"):
+        save_message(group_id, "bot", reply_text, role="bot")
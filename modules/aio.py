@@ -0,0 +1,34 @@
+import asyncio
+import threading
+
+# 同期コード（Webhookワーカースレッド）から非同期クライアントを使うための共有イベントループ。
+# ループを1つに固定することで、HTTPの接続プールもプロセス全体で使い回せる
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop():
+    """バックグラウンドスレッドで回している共有イベントループを返す（初回に起動）"""
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="aio-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run(coro, timeout=None):
+    """共有ループ上でコルーチンを実行し、結果を同期で受け取る"""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+
+def submit(coro):
+    """共有ループ上でコルーチンを実行する（結果を待たない）。concurrent.futures.Future を返す"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import httpx
+
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    """
+    タスクの変更（insert / update / delete）を購読者に配る。
+    ボット自身の書き込みから publish され、/events（SSE）で画面に流す。
+    プロセス内だけの仕組みなので、ダッシュボード（別プロセス）や SQL で直接書いた変更は載らない。
+    直近 maxlen 件を取っておき、再接続してきた購読者には Last-Event-ID 以降の分を送り直す
+    """
+
+    def __init__(self, maxlen=1000, subscriber_queue=100):
+        self.maxlen = maxlen
+        self.subscriber_queue = subscriber_queue
+        self._seq = 0
+        self._recent = deque(maxlen=maxlen)
+        self._subscribers = set()  # (loop, asyncio.Queue)
+        self._lock = threading.Lock()
+        self.published = metrics.counter("change_feed_published_total")
+        self.dropped = metrics.counter("change_feed_dropped_subscribers_total")
+        self.subscribers = metrics.gauge("change_feed_subscribers")
+
+    def publish(self, change_type, row, table="tasks"):
+        """どのスレッドから呼んでもよい。row は変わった列だけでもよい（id は必須）"""
+        with self._lock:
+            self._seq += 1
+            event = {"id": self._seq, "type": change_type, "table": table, "row": row, "at": time.time()}
+            self._recent.append(event)
+            subscribers = list(self._subscribers)
+        self.published.inc()
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, loop, queue, event)
+            except RuntimeError:
+                # ループが閉じている（接続が切れた後）
+                self._unsubscribe((loop, queue))
+
+    def _deliver(self, loop, queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # 追いつけない購読者は切る（再接続時に Last-Event-ID から送り直す）
+            self.dropped.inc()
+            self._unsubscribe((loop, queue))
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    def _unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            self.subscribers.set(len(self._subscribers))
+
+    def since(self, last_id):
+        """
+        last_id より後のイベント。取っておいた範囲より古ければ None（全件取り直してもらう）
+        """
+        with self._lock:
+            if last_id > self._seq:
+                return None  # サーバーが再起動して番号が振り直された
+            if last_id == self._seq:
+                return []
+            if not self._recent or self._recent[0]["id"] > last_id + 1:
+                return None
+            return [e for e in self._recent if e["id"] > last_id]
+
+    async def subscribe(self, last_id=None, group_id=None, heartbeat=15.0):
+        """
+        イベントを順に返す async ジェネレータ（SSE のハンドラから使う）。
+        最初に "hello"（初回）か、取りこぼした分（再接続時。古すぎれば "reset"）を返す。
+        heartbeat 秒ごとに何も無ければ None を返す（接続維持のコメント送信用）
+        """
+        queue = asyncio.Queue(maxsize=self.subscriber_queue)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            self.subscribers.set(len(self._subscribers))
+            head = self._seq  # これより後のイベントはキューに届く
+        sent = 0  # 送り直しとキューの両方に入ったイベントを二重に送らないため
+        try:
+            if last_id is None:
+                # 初回接続は今の番号だけ知らせる（再接続時の Last-Event-ID になる）
+                sent = head
+                yield {"id": head, "type": "hello", "table": "tasks", "row": None}
+            else:
+                missed = self.since(last_id)
+                if missed is None:
+                    sent = head
+                    yield {"id": head, "type": "reset", "table": "tasks", "row": None}
+                    missed = []
+                for event in missed:
+                    sent = event["id"]
+                    if _visible(event, group_id):
+                        yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    # 詰まって切られた。クライアントに再接続してもらう
+                    return
+                if event["id"] > sent and _visible(event, group_id):
+                    yield event
+        finally:
+            self._unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {"last_id": self._seq, "buffered": len(self._recent), "subscribers": len(self._subscribers)}
+
+
+def _visible(event, group_id):
+    if not group_id or event["row"] is None:
+        return True
+    return event["row"].get("family_group_id") in (None, group_id)
+
+
+def format_sse(event):
+    """イベントを SSE の1メッセージにする（None は接続維持のコメント）"""
+    if event is None:
+        return ": keep-alive\n\n"
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+
+def follow(url, on_event, last_id=None, stop=None, retry=3.0):
+    """
+    /events を購読し続け、イベントごとに on_event(event) を呼ぶ（別プロセスのダッシュボード用）。
+    切れたら retry 秒待って Last-Event-ID 付きで再接続する。stop（threading.Event）がセットされたら終わる
+    """
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        headers = {"Accept": "text/event-stream"}
+        if last_id is not None:
+            headers["Last-Event-ID"] = str(last_id)
+        try:
+            with httpx.stream("GET", url, headers=headers, timeout=httpx.Timeout(10.0, read=60.0)) as response:
+                response.raise_for_status()
+                data = []
+                for line in response.iter_lines():
+                    if stop.is_set():
+                        return
+                    if line.startswith("data:"):
+                        data.append(line[5:].strip())
+                    elif line == "" and data:
+                        event = json.loads("\n".join(data))
+                        data = []
+                        last_id = event["id"]
+                        on_event(event)
+        except Exception as e:
+            logger.error("Change Feed Error: %s", e)
+        stop.wait(retry)
+
+
+# ボット全体で共有するフィード
+feed = ChangeFeed()
+
+
+def publish(change_type, row, table="tasks"):
+    feed.publish(change_type, row, table)
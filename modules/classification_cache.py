@@ -0,0 +1,112 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from modules import metrics
+
+_TRAILING = re.compile(r"[!！。.、,〜~ーw笑]+$")
+
+
+def normalize(text):
+    """キャッシュキー用に表記ゆれを揃える（全角半角・大文字小文字・空白・文末の！や〜）"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = "".join(text.split())
+    return _TRAILING.sub("", text) or text
+
+
+def make_key(text, history=None, existing_topics=None, today=""):
+    """
+    正規化したメッセージ＋判定を左右する文脈だけの指紋をキーにする。
+    文脈は「直前のボットの返信の種類」（登録・メモ・アサイン。立候補かどうかが変わる）、
+    進行中のトピック一覧（トピック名の揺れ防止に使われる）、日付（期日の解釈が変わる）。
+    履歴の本文まで含めると同じキーが二度と出てこないので入れない
+    """
+    norm = normalize(text)
+    context = json.dumps([sorted(existing_topics or []), last_bot_turn(history), today], ensure_ascii=False)
+    return f"{norm}:{hashlib.sha1(context.encode('utf-8')).hexdigest()}"
+
+
+def last_bot_turn(history):
+    """履歴の中で一番新しいボットの返信の種類（「✅ 登録」など、最初の「:」より前）。なければ None"""
+    for h in reversed(history or []):
+        if h.get("role") == "bot":
+            head = (h.get("content") or "").split("\n", 1)[0]
+            return head.split(":", 1)[0].strip()
+    return None
+
+
+class ClassificationCache:
+    """
+    Geminiの判定結果キャッシュ（LRU + TTL）。
+    db_path を渡すと SQLite にも書き、再起動後も使い回せる
+    """
+
+    def __init__(self, maxsize=1000, ttl=3600, db_path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> (期限, 結果)
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS classification_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM classification_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+        self.hits = metrics.counter("gemini_cache_hits_total")
+        self.misses = metrics.counter("gemini_cache_misses_total")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item and item[0] > now:
+                self._items.move_to_end(key)
+                self.hits.inc()
+                return item[1]
+            if item:
+                del self._items[key]
+            if self._db:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM classification_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0])
+                    self._store(key, row[1], value)
+                    self.hits.inc()
+                    return value
+        self.misses.inc()
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, expires_at, value)
+            if self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO classification_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at),
+                )
+                self._db.commit()
+
+    def _store(self, key, expires_at, value):
+        self._items[key] = (expires_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def stats(self):
+        total = self.hits.value + self.misses.value
+        return {
+            "size": len(self._items),
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "hit_rate": self.hits.value / total if total else 0.0,
+        }
@@ -0,0 +1,248 @@
+import heapq
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from modules import change_feed, metrics
+
+COLUMNS = ["id", "family_group_id", "content", "type", "topic", "assignee_id", "status", "created_at", "updated_at"]
+
+# 描画で使う1行（itertuples と同じ namedtuple）
+TaskRow = namedtuple("TaskRow", COLUMNS)
+
+# 「日常リスト」に出すトピック（それ以外はプロジェクト扱い）
+ROUTINE_TOPICS = ["一般", "買い物", "家事", "雑多なタスク", "未分類", "アイデア"]
+
+
+class TaskStore:
+    """
+    ダッシュボード用のタスク一覧（1グループ分）を DataFrame で持つ。
+    初回はページングで全件を読み、以降は updated_at が前回より新しい行だけを取ってきてマージする。
+    Streamlit の再実行ごとに全件を取り直さないよう、st.cache_resource で1つを使い回す前提
+    """
+
+    def __init__(self, client, group_id=None, page_size=1000, min_interval=5.0, full_reload_interval=300.0,
+                 overlap=5.0):
+        self.client = client
+        self.group_id = group_id  # None なら全グループ
+        self.page_size = page_size
+        self.min_interval = min_interval  # この秒数以内の再実行では問い合わせない（invalidate されたときを除く）
+        self.full_reload_interval = full_reload_interval  # 他所での削除を拾うため、たまに全件を読み直す
+        self.overlap = overlap  # コミットが遅れた行を取りこぼさないよう、前回の時刻より少し前から取る
+        self.version = 0  # 中身が変わるたびに増える（描画側のキャッシュキーに使う）
+        self.sync_time = metrics.latency("dashboard_sync_seconds")
+        self.synced_rows = metrics.counter("dashboard_synced_rows_total")
+        self._df = self._to_frame([])
+        self._partition = (None, None)  # (version, TaskPartition)
+        self._last_seen = None  # 取得済みの updated_at の最大値
+        self._synced_at = 0.0
+        self._loaded_at = 0.0
+        self._dirty = True
+        self._following = None  # 変更フィードを購読しているスレッド
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def frame(self):
+        """最新のタスク一覧（created_at の新しい順）を返す"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._loaded_at > self.full_reload_interval:
+                self._full_load()
+            elif self._dirty or now - self._synced_at > self.min_interval:
+                # 変更フィードに載るのはボット側の書き込みだけ。ダッシュボードや他所からの変更は
+                # 購読中でもこの差分取得で拾う（フィードは反映を早めるだけ）
+                self._sync()
+            return self._df
+
+    @property
+    def following(self):
+        return self._following is not None and self._following.is_alive()
+
+    def follow(self, url):
+        """
+        ボットの /events を購読し、届いた変更をそのまま手元の DataFrame に反映する。
+        /events に流れるのはボットのプロセスで書いた変更だけなので、frame() の差分取得は止めない
+        """
+        if self.following:
+            return
+        if self.group_id:
+            url += ("&" if "?" in url else "?") + f"group={self.group_id}"
+        self._stop.clear()
+        self._following = threading.Thread(
+            target=change_feed.follow, args=(url, self.apply), kwargs={"stop": self._stop},
+            name="dashboard-change-feed", daemon=True,
+        )
+        self._following.start()
+
+    def unfollow(self):
+        self._stop.set()
+
+    def apply(self, event):
+        """変更フィードのイベント1件を反映する（row は変わった列だけのこともある）"""
+        if event["type"] == "reset":
+            # 取りこぼしがあるので次回は全件読み直す
+            self._loaded_at = 0.0
+            return
+        row = event.get("row")
+        if event.get("table") != "tasks" or not row:
+            return
+        if self.group_id and row.get("family_group_id") not in (None, self.group_id):
+            return
+        task_id = row["id"]
+        with self._lock:
+            if event["type"] == "delete":
+                if task_id in self._df.index:
+                    self._df = self._df.drop(index=task_id)
+                    self.version += 1
+                return
+            if task_id in self._df.index:
+                merged = {**self._df.loc[task_id].to_dict(), **row}
+            elif event["type"] == "insert":
+                merged = row
+            else:
+                # 手元に無い行の一部だけ届いた。次の差分取得で丸ごと取る
+                self._dirty = True
+                return
+            changed = self._to_frame([merged])
+            df = pd.concat([self._df.drop(index=task_id, errors="ignore"), changed])
+            self._replace(df.sort_values(["created_at", "id"], ascending=False))
+
+    def partition(self):
+        """frame() を TaskPartition に分けたもの（データが変わっていなければ前回のものを返す）"""
+        df = self.frame()
+        version, part = self._partition
+        if version != self.version:
+            part = TaskPartition(df)
+            self._partition = (self.version, part)
+        return part
+
+    def invalidate(self):
+        """自分で書き込んだ直後に呼ぶ。次の frame() で差分を取り直す"""
+        self._dirty = True
+
+    def forget(self, task_id):
+        """削除した行を手元からも消す（削除は updated_at の差分には出てこないため）"""
+        with self._lock:
+            if task_id in self._df.index:
+                self._df = self._df.drop(index=task_id)
+                self.version += 1
+
+    def _query(self):
+        query = self.client.table("tasks").select("*")
+        if self.group_id:
+            query = query.eq("family_group_id", self.group_id)
+        return query
+
+    def _fetch_pages(self, build, column, desc=False):
+        """
+        (column, id) の順にキーセット方式でページを進めながら全部取る。
+        OFFSET だと読んでいる間に行が足されたとき同じ行が2回出るので、前のページの最後の値から続きを取り、
+        境目で同じ値の行は id で重ねて1つにする（後から取れた方＝新しい内容を残す）
+        """
+        rows = {}
+        boundary = None
+        size = self.page_size
+        while True:
+            query = build()
+            if boundary is not None:
+                query = query.lte(column, boundary) if desc else query.gte(column, boundary)
+            page = query.order(column, desc=desc).order("id", desc=desc).limit(size).execute().data
+            for row in page:
+                rows[row["id"]] = row
+            if len(page) < size:
+                return list(rows.values())
+            last = page[-1][column]
+            # 境目と同じ値の行だけでページが埋まった。先に進めないので多めに取り直す
+            size = size * 2 if last == boundary else self.page_size
+            boundary = last
+
+    def _full_load(self):
+        with self.sync_time.time():
+            rows = self._fetch_pages(self._query, "created_at", desc=True)
+        self._replace(self._to_frame(rows))
+        self._loaded_at = self._synced_at = time.monotonic()
+        self._dirty = False
+
+    def _sync(self):
+        if self._last_seen is None:
+            self._full_load()
+            return
+        since = (datetime.fromisoformat(self._last_seen) - timedelta(seconds=self.overlap)).isoformat()
+        with self.sync_time.time():
+            rows = self._fetch_pages(lambda: self._query().gt("updated_at", since), "updated_at")
+        self._synced_at = time.monotonic()
+        self._dirty = False
+        if not rows:
+            return
+        changed = self._to_frame(rows)
+        # 取り直した行だけ差し替える（重なり分で同じ行が来ても内容が同じなら version は変えない）
+        current = self._df.reindex(changed.index)
+        if current.astype(str).equals(changed.reindex(columns=current.columns).astype(str)):
+            self._last_seen = max(self._last_seen, changed["updated_at"].max())
+            return
+        merged = pd.concat([self._df.drop(index=changed.index, errors="ignore"), changed])
+        self._replace(merged.sort_values(["created_at", "id"], ascending=False))
+
+    def _to_frame(self, rows):
+        """行のリストを id を索引にした DataFrame にする（id 列も残す）"""
+        self.synced_rows.inc(len(rows))
+        df = pd.DataFrame(rows, columns=COLUMNS if not rows else None)
+        for column in COLUMNS:
+            if column not in df.columns:
+                df[column] = None
+        df["topic"] = df["topic"].fillna("一般")
+        df["assignee_id"] = df["assignee_id"].astype(object).where(df["assignee_id"].notna(), None)
+        return df.set_index("id", drop=False).rename_axis(None)
+
+    def _replace(self, df):
+        self._df = df
+        if len(df):
+            latest = df["updated_at"].dropna().max()
+            if isinstance(latest, str):
+                self._last_seen = latest if self._last_seen is None else max(self._last_seen, latest)
+        self.version += 1
+
+    def stats(self):
+        return {
+            "group_id": self.group_id,
+            "rows": len(self._df),
+            "version": self.version,
+            "last_seen": self._last_seen,
+            "following": self.following,
+            "sync": self.sync_time.snapshot(),
+        }
+
+
+class TaskPartition:
+    """
+    タスク一覧を (区分, 状態, トピック) ごとに一度だけ分けておく。
+    区分は "routine"（日常リスト）か "project"。各グループの行は TaskRow で、created_at の新しい順
+    """
+
+    def __init__(self, df):
+        bucket = df["topic"].isin(ROUTINE_TOPICS).map({True: "routine", False: "project"})
+        # itertuples と同じものを列ごとの tolist から作る（pandas の文字列型だと itertuples より数倍速い）
+        rows = list(map(TaskRow._make, zip(*[df[column].tolist() for column in COLUMNS])))
+        self.groups = {}
+        if rows:
+            positions = df.groupby([bucket.values, df["status"].values, df["topic"].values], sort=False, dropna=False).indices
+            # 先頭の行が新しいグループから並べる（df は created_at の新しい順）
+            for key, idx in sorted(positions.items(), key=lambda item: item[1][0]):
+                self.groups[key] = [rows[i] for i in idx]
+
+    def rows(self, bucket, status):
+        """区分・状態に当てはまる行（トピックをまたいで created_at の新しい順）"""
+        groups = [rows for (b, s, _), rows in self.groups.items() if b == bucket and s == status]
+        if len(groups) == 1:
+            return groups[0]
+        return list(heapq.merge(*groups, key=lambda r: (r.created_at, r.id), reverse=True))
+
+    def topics(self, bucket, status):
+        """トピックごとの行 [(トピック名, 行のリスト), ...]（新しいタスクがあるトピックから順）"""
+        return [(t, rows) for (b, s, t), rows in self.groups.items() if b == bucket and s == status]
+
+    def count(self, bucket, status):
+        return sum(len(rows) for (b, s, _), rows in self.groups.items() if b == bucket and s == status)
@@ -1,7 +1,21 @@
 import os
-from supabase import create_client, Client
+import atexit
+import base64
+import json
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
 
+from modules import change_feed, supabase_pool, tracing
+from modules.history_buffer import HistoryBuffer, RedisHistoryBuffer
+from modules.topic_index import TopicIndex
+from modules.write_behind import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
 # .envファイルを読み込む
 load_dotenv()
 
@@ -9,12 +23,121 @@ load_dotenv()
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 
+# PostgREST への接続プールの設定
+# HTTP/2 なら1本の接続に複数リクエストを多重化するので、同時に来たWebhookが接続確立（TLS）を待たずに済む
+POOL_OPTIONS = {
+    "max_connections": int(os.environ.get("SUPABASE_MAX_CONNECTIONS", "10")),
+    "keepalive": int(os.environ.get("SUPABASE_KEEPALIVE", "10")),
+    "keepalive_expiry": float(os.environ.get("SUPABASE_KEEPALIVE_EXPIRY", "60")),
+    "timeout": float(os.environ.get("SUPABASE_TIMEOUT", "10")),
+    "http2": os.environ.get("SUPABASE_HTTP2", "1") == "1",
+    "max_concurrency": int(os.environ.get("SUPABASE_MAX_CONCURRENCY", "0")) or None,
+}
+
 # キーがない場合の安全策
 if not url or not key:
-    print("Warning: SupabaseのURLまたはKEYが設定されていません")
+    logger.warning("SupabaseのURLまたはKEYが設定されていません")
     supabase = None
 else:
-    supabase: Client = create_client(url, key)
+    # クライアントは1つを全スレッドで共有する（中の httpx.Client はスレッドセーフで、接続プールもここで共有される）
+    supabase: Client = create_client(
+        url, key, options=ClientOptions(httpx_client=supabase_pool.make_http_client(**POOL_OPTIONS))
+    )
+
+# 1にすると、履歴取得＋保存＋トピック取得やアサインをDB関数（supabase/migrations）1回の呼び出しで行う
+USE_RPC = os.environ.get("SUPABASE_RPC", "0") == "1"
+
+# アサインを許可するトピック（これ以外はプロジェクトとみなしてアサインしない）
+ASSIGNABLE_TOPICS = ["一般", "買い物", "家事", "雑多なタスク", "未分類"]
+
+# 独立したクエリを並行に投げるためのスレッド
+_io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="supabase")
+
+
+def _insert_messages(rows):
+    # request_id が既にある行（RPC がコミット済みだった発言の保存し直しなど）は入れずに飛ばす
+    supabase.table("messages").upsert(rows, on_conflict="request_id", ignore_duplicates=True).execute()
+
+
+# チャットログは返信に関係ないので、ためてまとめて insert する（0にすると1件ずつその場で保存）
+# Supabaseに届かないときは MESSAGE_SPILL_PATH に追記しておき、復旧後に入れ直す
+message_writer = None
+if os.environ.get("MESSAGE_WRITE_BEHIND", "1") == "1":
+    message_writer = WriteBehindBuffer(
+        "messages",
+        _insert_messages,
+        max_batch=int(os.environ.get("MESSAGE_FLUSH_SIZE", "100")),
+        interval=float(os.environ.get("MESSAGE_FLUSH_INTERVAL", "1.0")),
+        spill_path=os.environ.get("MESSAGE_SPILL_PATH", "spill/messages.jsonl"),
+    )
+    atexit.register(message_writer.stop)
+
+
+def _insert_labels(rows):
+    supabase.table("message_labels").insert(rows).execute()
+
+
+# 判定結果（GiNZA / Gemini）はローカル分類器の学習データとして残す（0にすると残さない）
+label_writer = None
+if os.environ.get("MESSAGE_LABELS", "1") == "1":
+    label_writer = WriteBehindBuffer(
+        "message_labels",
+        _insert_labels,
+        max_batch=int(os.environ.get("MESSAGE_FLUSH_SIZE", "100")),
+        interval=float(os.environ.get("MESSAGE_FLUSH_INTERVAL", "1.0")),
+        spill_path=os.environ.get("LABEL_SPILL_PATH", "spill/message_labels.jsonl"),
+    )
+    atexit.register(label_writer.stop)
+
+
+
+def _load_topic_counts(group_id):
+    """未完了タスクをトピックごとに数える（索引の初回読み込み・数え直し用）"""
+    response = supabase.table("tasks")\
+        .select("topic")\
+        .eq("family_group_id", group_id)\
+        .eq("status", "pending")\
+        .execute()
+    counts = {}
+    for row in response.data:
+        if row.get("topic"):
+            counts[row["topic"]] = counts.get(row["topic"], 0) + 1
+    return counts
+
+
+# 進行中トピックはメモリ上の索引から引く（TOPIC_INDEX_TTL 秒ごとにDBと突き合わせる。0なら毎回DBに問い合わせる）
+TOPIC_INDEX_TTL = float(os.environ.get("TOPIC_INDEX_TTL", "60"))
+topic_index = TopicIndex(_load_topic_counts, ttl=TOPIC_INDEX_TTL, executor=_io_pool) if TOPIC_INDEX_TTL > 0 else None
+
+
+
+def _load_recent_messages(group_id, limit):
+    """直近の会話を古い順で取得する（履歴バッファの初回読み込み用）"""
+    response = supabase.table("messages")\
+        .select("content, role, created_at")\
+        .eq("group_id", group_id)\
+        .order("created_at", desc=True)\
+        .limit(limit)\
+        .execute()
+    return response.data[::-1]  # 新しい順で取ってくるので反転するだけ
+
+
+# 直近の会話はグループごとにメモリに持つ（HISTORY_BUFFER_SIZE=0 なら毎回DBに問い合わせる）
+# HISTORY_REDIS_URL を設定すると Redis に置き、複数ワーカープロセスで共有する
+HISTORY_BUFFER_SIZE = int(os.environ.get("HISTORY_BUFFER_SIZE", "10"))
+HISTORY_REDIS_URL = os.environ.get("HISTORY_REDIS_URL")
+history_buffer = None
+if HISTORY_BUFFER_SIZE > 0 and HISTORY_REDIS_URL:
+    try:
+        history_buffer = RedisHistoryBuffer(_load_recent_messages, HISTORY_REDIS_URL, maxlen=HISTORY_BUFFER_SIZE)
+    except ImportError:
+        logger.warning("redis パッケージがないため、履歴はプロセス内に持ちます")
+if HISTORY_BUFFER_SIZE > 0 and history_buffer is None:
+    history_buffer = HistoryBuffer(
+        _load_recent_messages,
+        maxlen=HISTORY_BUFFER_SIZE,
+        max_messages=int(os.environ.get("HISTORY_MAX_MESSAGES", "20000")),
+    )
 
 # modules/database.py の add_task を修正
 
@@ -36,16 +159,21 @@ def add_task(family_id, content, task_type="task", topic="雑多なタスク", a
     
     try:
         response = supabase.table("tasks").insert(data).execute()
+        if topic_index:
+            topic_index.add(family_id, topic)
+        for row in response.data:
+            change_feed.publish("insert", row)
         return response
     except Exception as e:
-        print(f"Supabase Error: {e}")
+        logger.error("Supabase Error: %s", e)
         return None
     
 # --- modules/database.py の既存コードの下に追加 ---
 
-def save_message(group_id, user_id, content, role="user"):
+def save_message(group_id, user_id, content, role="user", request_id=None):
     """
     LINEのメッセージをログとして保存する
+    request_id: 同じ発言を二度保存しないための識別子（LINE のメッセージID など。ボットの返信は None）
     """
     if not supabase:
         return None
@@ -54,34 +182,61 @@ def save_message(group_id, user_id, content, role="user"):
         "group_id": group_id,
         "user_id": user_id,
         "content": content,
-        "role": role
+        "role": role,
+        "request_id": request_id,
+        # まとめて insert すると created_at が同じになるので、受け取った時刻をここで入れておく
+        "created_at": datetime.now(timezone.utc).isoformat(),
     }
+    _remember(group_id, data)
+    if message_writer:
+        message_writer.put(data)
+        return
+
     try:
-        supabase.table("messages").insert(data).execute()
+        _insert_messages([data])
     except Exception as e:
-        print(f"Save Message Error: {e}")
+        logger.error("Save Message Error: %s", e)
 
+def save_label(group_id, content, category, topic=None, source="llm"):
+    """
+    メッセージの判定結果を学習データとして残す（返信には関係ないので溜めてまとめて insert する）
+    """
+    if not supabase or not label_writer:
+        return
+    label_writer.put({
+        "group_id": group_id,
+        "content": content,
+        "category": category,
+        "topic": topic,
+        "source": source,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    })
+
+@tracing.spanned("history")
 def get_recent_messages(group_id, limit=5):
     """
     直近の会話ログを取得する（コンテキスト用）
     """
     if not supabase:
         return []
-    
+
     try:
-        # 最新のものから順に取得
-        response = supabase.table("messages")\
-            .select("content, role, created_at")\
-            .eq("group_id", group_id)\
-            .order("created_at", desc=True)\
-            .limit(limit)\
-            .execute()
-        
-        # 古い順（時系列）に並べ直して返す
-        return sorted(response.data, key=lambda x: x['created_at'])
+        if history_buffer:
+            return history_buffer.recent(group_id, limit)
+        return _load_recent_messages(group_id, limit)
     except Exception as e:
-        print(f"Get History Error: {e}")
+        logger.error("Get History Error: %s", e)
         return []
+
+
+def _remember(group_id, data):
+    """保存したメッセージを履歴バッファにも追記する"""
+    if not history_buffer:
+        return
+    try:
+        history_buffer.append(group_id, {k: data[k] for k in ("content", "role", "created_at")})
+    except Exception as e:
+        logger.error("History Buffer Error: %s", e)
     
 def assign_latest_task(group_id, assignee_name):
     """
@@ -91,8 +246,8 @@ def assign_latest_task(group_id, assignee_name):
     if not supabase:
         return None, None
 
-    # アサインを許可するトピック（これ以外はプロジェクトとみなしてアサインしない）
-    ASSIGNABLE_TOPICS = ["一般", "買い物", "家事", "雑多なタスク", "未分類"]
+    if USE_RPC:
+        return _assign_latest_task_rpc(group_id, assignee_name)
 
     try:
         # 1. 直近の未完了タスクを取得
@@ -115,29 +270,39 @@ def assign_latest_task(group_id, assignee_name):
         # ★ここが重要！
         # トピックが「日常系」に含まれていないなら、アサインせずに終了
         if topic not in ASSIGNABLE_TOPICS:
-            print(f"Skipped assignment for project topic: {topic}")
+            logger.info("Skipped assignment for project topic: %s", topic)
             return None, "project_locked" # プロジェクト案件なのでアサインしない
 
         # 2. 担当者を更新
-        supabase.table("tasks")\
+        updated = supabase.table("tasks")\
             .update({"assignee_id": assignee_name})\
             .eq("id", target_task['id'])\
             .execute()
-            
+        for row in updated.data:
+            change_feed.publish("update", row)
+
         return target_task['content'], assignee_name
 
     except Exception as e:
-        print(f"Assign Error: {e}")
+        logger.error("Assign Error: %s", e)
         return None, None
     
     
+@tracing.spanned("topics")
 def get_active_topics(group_id):
     """
     現在進行中のプロジェクト（トピック）名のリストを取得する
     """
     if not supabase:
         return []
-    
+
+    if topic_index:
+        try:
+            return topic_index.topics(group_id)
+        except Exception as e:
+            logger.error("Get Topics Error: %s", e)
+            return []
+
     try:
         # pending（未完了）のタスクから topic を取得
         response = supabase.table("tasks")\
@@ -150,5 +315,201 @@ def get_active_topics(group_id):
         topics = list(set([row['topic'] for row in response.data if row.get('topic')]))
         return topics
     except Exception as e:
-        print(f"Get Topics Error: {e}")
-        return []
\ No newline at end of file
+        logger.error("Get Topics Error: %s", e)
+        return []
+
+
+def _encode_cursor(row):
+    raw = json.dumps([row["created_at"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    """_encode_cursor の逆。形が違うもの（手で書き換えられたものなど）はすべて ValueError にする"""
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"invalid cursor: {e}") from e
+    if not (isinstance(value, list) and len(value) == 2
+            and isinstance(value[0], str) and isinstance(value[1], int) and not isinstance(value[1], bool)):
+        raise ValueError("invalid cursor")
+    return value[0], value[1]
+
+
+def list_tasks(group_id=None, status="pending", cursor=None, limit=50):
+    """
+    タスクを新しい順に1ページ分返す（キーセット方式のページング）。
+    cursor は前のページの next_cursor。OFFSET と違い、何ページ目でもインデックスを辿るだけで済む
+    Returns:
+        (rows, next_cursor)  最後のページなら next_cursor は None。DBエラー時は (None, None)
+    """
+    if not supabase:
+        return [], None
+
+    seen_at, seen_id = _decode_cursor(cursor) if cursor else (None, None)
+
+    def fetch(n):
+        query = supabase.table("tasks")\
+            .select("id, family_group_id, content, type, topic, assignee_id, status, created_at, updated_at")
+        if group_id:
+            query = query.eq("family_group_id", group_id)
+        if status:
+            query = query.eq("status", status)
+        if cursor:
+            # 同じ created_at の行がページの境目にまたがることがあるので「以下」で取り、取得済みの分を読み飛ばす
+            query = query.lte("created_at", seen_at)
+        return query.order("created_at", desc=True).order("id", desc=True).limit(n).execute().data
+
+    try:
+        extra = 1 if cursor else 0
+        while True:
+            raw = fetch(limit + 1 + extra)
+            rows = [r for r in raw if not cursor or r["created_at"] < seen_at or r["id"] < seen_id]
+            if len(rows) > limit or len(raw) < limit + 1 + extra:
+                break
+            extra *= 2  # 境目に同じ時刻の取得済みの行が多かったので、多めに取り直す
+    except Exception as e:
+        logger.error("List Tasks Error: %s", e)
+        return None, None
+    page = rows[:limit]
+    next_cursor = _encode_cursor(page[-1]) if len(rows) > limit else None
+    return page, next_cursor
+
+
+def update_task_status(task_id, new_status):
+    """
+    タスクの状態（pending / done / deleted）を変更し、トピック索引にも反映する
+    """
+    if not supabase:
+        return None
+
+    try:
+        before = supabase.table("tasks")\
+            .select("family_group_id, topic, status")\
+            .eq("id", task_id)\
+            .limit(1)\
+            .execute().data
+        response = supabase.table("tasks").update({"status": new_status}).eq("id", task_id).execute()
+        for row in response.data:
+            change_feed.publish("update", row)
+        if topic_index and before and before[0]["status"] != new_status:
+            row = before[0]
+            if row["status"] == "pending":
+                topic_index.remove(row["family_group_id"], row["topic"])
+            elif new_status == "pending":
+                topic_index.add(row["family_group_id"], row["topic"])
+        return response
+    except Exception as e:
+        logger.error("Update Status Error: %s", e)
+        return None
+
+
+def delete_task(task_id):
+    """
+    タスクを完全に削除する（未完了だった場合はトピック索引からも外す）
+    """
+    if not supabase:
+        return None
+
+    try:
+        response = supabase.table("tasks").delete().eq("id", task_id).execute()
+        for row in response.data:
+            change_feed.publish("delete", {"id": row["id"], "family_group_id": row.get("family_group_id")})
+        if topic_index:
+            for row in response.data:
+                if row.get("status") == "pending":
+                    topic_index.remove(row["family_group_id"], row.get("topic"))
+        return response
+    except Exception as e:
+        logger.error("Delete Task Error: %s", e)
+        return None
+
+def _assign_latest_task_rpc(group_id, assignee_name):
+    """assign_latest_task のDB関数版（取得と更新を1文・1往復で行う）"""
+    try:
+        result = supabase.rpc("assign_latest_task", {
+            "p_group_id": group_id,
+            "p_assignee": assignee_name,
+            "p_assignable_topics": ASSIGNABLE_TOPICS,
+        }).execute().data
+
+        if not result:
+            return None, None # タスクがない
+        if not result["assigned"]:
+            logger.info("Skipped assignment for project topic: %s", result['topic'])
+            return None, "project_locked"
+        if result.get("id") is not None:
+            change_feed.publish("update", {"id": result["id"], "family_group_id": group_id, "assignee_id": assignee_name})
+        return result["content"], assignee_name
+
+    except Exception as e:
+        logger.error("Assign Error: %s", e)
+        return None, None
+
+
+def ingest_message(group_id, user_id, content, role="user", history_limit=5, request_id=None):
+    """
+    受信メッセージの保存と、判定に使う文脈（直近の会話ログ・進行中のトピック）の取得をまとめて行う。
+    RPCモードならDB関数1回、そうでなければ履歴とトピックを並行に取ってから保存する。
+    （履歴には今回のメッセージを含めない）
+    request_id は呼び出し側が発言ごとに決める識別子（LINE のメッセージID）。省略時はここで振る
+    Returns:
+        (history, topics)
+    """
+    if not supabase:
+        return [], []
+
+    request_id = request_id or uuid.uuid4().hex
+    if USE_RPC:
+        try:
+            data = supabase.rpc("ingest_message", {
+                "p_group_id": group_id,
+                "p_user_id": user_id,
+                "p_content": content,
+                "p_role": role,
+                "p_history_limit": history_limit,
+                "p_request_id": request_id,
+            }).execute().data
+            _remember(group_id, {"content": content, "role": role, "created_at": datetime.now(timezone.utc).isoformat()})
+            return data["history"], data["topics"]
+        except Exception as e:
+            logger.error("Ingest RPC Error: %s", e)
+            return _ingest_after_rpc_error(group_id, user_id, content, role, history_limit, request_id)
+
+    if topic_index:
+        # トピックは索引から引けるので並行にする必要はない（履歴もバッファに載っていればDBに行かない）
+        topics = get_active_topics(group_id)
+        history = get_recent_messages(group_id, history_limit)
+        save_message(group_id, user_id, content, role=role, request_id=request_id)
+        return history, topics
+
+    history_future = _io_pool.submit(get_recent_messages, group_id, history_limit)
+    topics_future = _io_pool.submit(get_active_topics, group_id)
+    history = history_future.result()
+    save_message(group_id, user_id, content, role=role, request_id=request_id)
+    return history, topics_future.result()
+
+
+def _ingest_after_rpc_error(group_id, user_id, content, role, history_limit, request_id):
+    """
+    ingest_message の RPC が失敗したときの続き。タイムアウトなどでは DB 関数がコミット済みのことがあるので、
+    保存は request_id 付きで行い（既にあれば DB 側で弾かれる）、読んだ履歴からは同じ request_id の行を外す
+    """
+    topics = get_active_topics(group_id)
+    try:
+        rows = supabase.table("messages")\
+            .select("content, role, created_at, request_id")\
+            .eq("group_id", group_id)\
+            .order("created_at", desc=True)\
+            .limit(history_limit + 1)\
+            .execute().data
+    except Exception as e:
+        # DB に届かないならコミットもされていない。保存は write-behind に任せる（復旧後に入る）
+        logger.error("Get History Error: %s", e)
+        save_message(group_id, user_id, content, role=role, request_id=request_id)
+        return [], topics
+
+    rows = [row for row in rows if row.get("request_id") != request_id][:history_limit]
+    save_message(group_id, user_id, content, role=role, request_id=request_id)
+    history = [{k: row[k] for k in ("content", "role", "created_at")} for row in reversed(rows)]
+    return history, topics
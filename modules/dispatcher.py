@@ -0,0 +1,150 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookDispatcher:
+    """
+    Webhookイベントを受け付けキューに積み、ワーカースレッドで処理する。
+    /callback は署名検証とキュー投入だけを行い、重い処理（GiNZA・Gemini・DB）はここで実行する。
+    key（イベント → グループIDなど）を渡すと、同じキーのイベントは届いた順に1つずつ、
+    違うキーのイベントは並行に処理する（同じグループの「引き受け」が直前のタスク登録を追い越さないように）
+    """
+
+    def __init__(self, handle_event, workers=4, maxsize=1000, key=None):
+        self.handle_event = handle_event
+        self.workers = workers
+        self.maxsize = maxsize
+        self.key = key
+        self._pending = {}  # キー → deque[(event, enqueued_at)]。処理中のキーは空でも残す
+        self._ready = queue.Queue()  # 次に処理できるキー（1つのキーは同時に1回しか入らない）
+        self._size = 0
+        self._threads = []
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self.wait_time = metrics.latency("dispatcher_wait_seconds")
+        self.process_time = metrics.latency("dispatcher_process_seconds")
+        self.rejected = metrics.counter("dispatcher_rejected_total")
+        self.failed = metrics.counter("dispatcher_failed_total")
+        self.active_keys = metrics.gauge("dispatcher_active_keys")
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=10.0):
+        """キューに残っているイベントを処理しきってからワーカーを止める"""
+        deadline = time.monotonic() + timeout
+        with self._drained:
+            self._drained.wait_for(lambda: self._size == 0, timeout)
+        for _ in self._threads:
+            self._ready.put(None)
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, event):
+        """
+        イベントをキューに積む。
+        キューが満杯なら False を返す（呼び出し側で 503 を返し、LINEに再送してもらう）
+        """
+        # キーが無ければ順序の制約なし（イベントごとに別キー）
+        key = self.key(event) if self.key else object()
+        with self._lock:
+            if self._size >= self.maxsize:
+                self.rejected.inc()
+                return False
+            self._size += 1
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = deque()
+                self._ready.put(key)
+                self.active_keys.set(len(self._pending))
+            pending.append((event, time.perf_counter()))
+        return True
+
+    def _run(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                break
+            with self._lock:
+                event, enqueued_at = self._pending[key].popleft()
+                self._busy += 1
+            self.wait_time.observe(time.perf_counter() - enqueued_at)
+            try:
+                with self.process_time.time():
+                    self.handle_event(event)
+            except Exception as e:
+                self.failed.inc()
+                logger.exception("Dispatcher Error: %s", e)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._size -= 1
+                    if self._pending[key]:
+                        # 同じキーの続きは後ろに並べ直す（1つのグループがワーカーを占有しないように）
+                        self._ready.put(key)
+                    else:
+                        del self._pending[key]
+                        self.active_keys.set(len(self._pending))
+                    if self._size == 0:
+                        self._drained.notify_all()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "busy": self._busy,
+            "queue_depth": self._size,
+            "queue_max": self.maxsize,
+            "active_keys": len(self._pending),
+            "rejected": self.rejected.value,
+            "failed": self.failed.value,
+            "wait": self.wait_time.snapshot(),
+            "process": self.process_time.snapshot(),
+        }
+
+
+class SeenEvents:
+    """
+    処理を引き受けた webhookEventId を覚えておく（LRU + TTL）。
+    LINE の再送（応答が遅い・5xx のとき）で同じイベントが2回届いても、Gemini 呼び出しやタスク登録を二重にしない
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._seen = OrderedDict()  # event_id → 引き受けた時刻
+        self._lock = threading.Lock()
+        self.duplicates = metrics.counter("dispatcher_duplicates_total")
+
+    def claim(self, event_id):
+        """初めて見る ID なら記録して True、TTL 内に引き受け済みなら False"""
+        now = time.monotonic()
+        with self._lock:
+            seen_at = self._seen.get(event_id)
+            if seen_at is not None and now - seen_at < self.ttl:
+                self.duplicates.inc()
+                return False
+            self._seen[event_id] = now
+            self._seen.move_to_end(event_id)
+            while len(self._seen) > self.maxsize:
+                self._seen.popitem(last=False)
+            return True
+
+    def release(self, event_id):
+        """引き受けられなかった（キューが満杯だった）ので、再送されたら処理できるように忘れる"""
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+    def stats(self):
+        return {"size": len(self._seen), "duplicates": self.duplicates.value}
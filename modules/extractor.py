@@ -1,91 +1,395 @@
 import os
 import json
-from google import genai
-from google.genai import types
+import asyncio
+import functools
+import threading
+import time
+import logging
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import date
+
+from modules import aio, metrics
+from modules.classification_cache import ClassificationCache, make_key
+from modules.llm_batcher import GeminiBatcher
+from modules.resilience import CircuitBreaker
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-api_key = os.environ.get("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError("GOOGLE_API_KEYが設定されていません")
+GEMINI_MODEL = "gemini-2.5-flash"
+# 1回の判定にかける締め切り（秒）。これを過ぎたら諦めてフォールバックする
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", "10"))
+# 共有コネクションプールの上限
+GEMINI_MAX_CONNECTIONS = int(os.environ.get("GEMINI_MAX_CONNECTIONS", "20"))
+# ヘッジ：p95 を過ぎても返ってこなければ同じリクエストをもう1本投げて早い方を使う
+GEMINI_HEDGE = os.environ.get("GEMINI_HEDGE", "0") == "1"
+GEMINI_HEDGE_MIN_SAMPLES = 20  # p95 を信用するのに必要な件数
+# マイクロバッチ：この時間窓（ミリ秒）か件数に達するまで判定依頼をためて1リクエストで送る（0なら1件ずつ）
+GEMINI_BATCH_WINDOW_MS = float(os.environ.get("GEMINI_BATCH_WINDOW_MS", "0"))
+GEMINI_BATCH_MAX = int(os.environ.get("GEMINI_BATCH_MAX", "8"))
+
+# コンテキストキャッシュ：毎回変わらないシステム指示をGemini側に一度だけ登録し、以降は名前で参照する
+# （登録できなければ system_instruction として送る）
+GEMINI_CONTEXT_CACHE = os.environ.get("GEMINI_CONTEXT_CACHE", "0") == "1"
+GEMINI_CONTEXT_CACHE_TTL = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+# 明示キャッシュに登録できる最小トークン数（gemini-2.5-flash は 1024）。
+# 今のシステム指示はこれに届かないので、指示が大きくなるまでは GEMINI_CONTEXT_CACHE=1 でも登録を試さない
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = 1024
+
+# --- プロンプト：毎回変わらない部分（システム指示）は import 時に一度だけ組み立てる ---
+_INTRO = """あなたは家族のチャットから「やるべきこと(Task)」を抽出するAIです。
+会話の流れを読んで、適切なカテゴリと具体的なタスク名を生成してください。
+"""
+
+RULES_PROMPT = """### ⚠️ トピック名（プロジェクト名）の決定ルール
+1. **最優先:** 「現在進行中のプロジェクト名」のリストの中に、今回の会話に関連するものがあれば、**一字一句変えずにその名前を使用すること。**
+   （例：リストに「京都旅行」があり、会話が「宿どうする？」なら、トピックは「京都旅行」にする。「京都の宿」などと勝手に変えない）
+2. 新規: リストに関連するものがない場合のみ、新しい具体的なイベント名を生成する。（例：「お父さんの誕生日会」「新潟旅行」）
+3. 禁止: 「旅行」「食事」のような抽象的な大分類は禁止。
+
+### ⚠️ タスク名（summary）の生成ルール
+1. **「〜を〜する」という命令形・行動ベースにすること。**
+   - ❌ 悪い例：「京都旅行の日程について話している」「宿をどうするか相談」
+   - ⭕️ 良い例：「京都旅行の日程を決める」「宿を予約する」「候補地をリストアップする」
+2. 会話の状況説明ではなく、ユーザーが**次にアクションできる言葉**に変換すること。
+"""
+
+CATEGORIES_PROMPT = """### 分類カテゴリー
+- "task": 明確な行動、買い物、予約、調べること。（※担当者はここでは決めない）
+- "accept": 直前のタスクや提案に対する「引き受け」「了解」「私がやる」という意思表示。
+- "idea": 旅行の相談、提案、まだ決まっていないメモ。（※これも行動ベースの名前にする。「〜を考える」など）
+- null: ただの相槌、完了報告、雑談、同意のみの場合。
+"""
+
+_RESULT_FIELDS = '''"category": "task" or "idea" or "accept" or null,
+    "topic": "プロジェクト名",
+    "summary": "タスクの内容（動詞で終わる短いフレーズ）",
+    "due_date": "YYYY-MM-DD(なければnull)",
+    "assignee": "null"'''
+
+SYSTEM_INSTRUCTION = f"""{_INTRO}
+{RULES_PROMPT}
+{CATEGORIES_PROMPT}
+### 出力フォーマット (JSON)
+{{
+    {_RESULT_FIELDS}
+}}
+"""
+
+BATCH_SYSTEM_INSTRUCTION = f"""{_INTRO}複数のメッセージが届くので、それぞれ独立に（別々の家族の会話として）判定してください。
+
+{RULES_PROMPT}
+{CATEGORIES_PROMPT}
+### 出力フォーマット (JSON配列・メッセージと同じ順番で全件)
+[
+  {{
+    "id": メッセージのid（数値）,
+    {_RESULT_FIELDS}
+  }}
+]
+"""
+
+# --- 毎回変わる部分（日付・トピック・履歴・メッセージ）のテンプレート ---
+_MESSAGE_TEMPLATE = """### 今日の日付
+{today}
+
+### 📁 現在進行中のプロジェクト名（表記ゆれ防止用リスト）
+{topics}
+
+### 直近の会話ログ
+{history}
+ユーザーの最新メッセージ: {text}"""
+
+_BATCH_ITEM_TEMPLATE = """## メッセージ{id} (id: {id})
+今日の日付: {today}
+現在進行中のプロジェクト名: {topics}
+直近の会話ログ:
+{history}最新メッセージ: {text}
+"""
+
+# Geminiを呼ばない／呼べなかったときの結果（雑談扱いでスルー）
+SKIP_RESULT = {"category": None}
+
+# 判定結果のキャッシュ（「了解」「ありがとう」などの定型文でGeminiを呼ばないため）
+# GEMINI_CACHE_DB にパスを入れると SQLite に保存して再起動後も使い回す
+cache = ClassificationCache(
+    maxsize=int(os.environ.get("GEMINI_CACHE_SIZE", "1000")),
+    ttl=float(os.environ.get("GEMINI_CACHE_TTL", "3600")),
+    db_path=os.environ.get("GEMINI_CACHE_DB") or None,
+)
+
+# エラー率が跳ねたら一定時間Geminiを呼ばずに即フォールバックする
+breaker = CircuitBreaker(
+    "gemini",
+    failure_rate=float(os.environ.get("GEMINI_BREAKER_FAILURE_RATE", "0.5")),
+    reset_timeout=float(os.environ.get("GEMINI_BREAKER_RESET", "30")),
+)
 
-client = genai.Client(api_key=api_key)
+latency = metrics.latency("gemini_seconds")
+errors = metrics.counter("gemini_errors_total")
+hedged = metrics.counter("gemini_hedged_total")
+prompt_tokens = metrics.counter("gemini_prompt_tokens_total")
+output_tokens = metrics.counter("gemini_output_tokens_total")
+
+# google-genai の import とクライアント生成は重いので、初回の get_client() まで遅らせる
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Geminiクライアントを返す（初回だけ生成する）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import httpx
+                from google import genai
+                from google.genai import types
+
+                api_key = os.environ.get("GOOGLE_API_KEY")
+                if not api_key:
+                    raise ValueError("GOOGLE_API_KEYが設定されていません")
+                # 非同期呼び出しは全部この1つの接続プールを通す（keep-aliveで使い回す）
+                async_http = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=GEMINI_MAX_CONNECTIONS,
+                        max_keepalive_connections=GEMINI_MAX_CONNECTIONS,
+                    ),
+                    timeout=GEMINI_TIMEOUT,
+                )
+                _client = genai.Client(
+                    api_key=api_key,
+                    http_options=types.HttpOptions(httpx_async_client=async_http),
+                )
+    return _client
 
 def analyze_message(text: str, history: list = None, existing_topics: list = None):
     """
-    Geminiを使ってメッセージを解析する
+    Geminiを使ってメッセージを解析する（同期版）
+    Webhookワーカースレッドから呼ばれ、中身は共有イベントループ上の analyze_message_async
     Args:
         text: 今回のユーザー発言
         history: 直近の会話ログ
         existing_topics: 現在進行中のプロジェクト名リスト（カンニングペーパー）
     """
+    # ループ側の締め切りで必ず返ってくるが、念のため少し余裕を持たせて待つ
+    return aio.run(analyze_message_async(text, history, existing_topics), timeout=GEMINI_TIMEOUT * 2)
+
+
+async def analyze_message_async(text: str, history: list = None, existing_topics: list = None,
+                                fallback: dict = None, timeout: float = None):
+    """
+    Geminiを使ってメッセージを解析する（非同期版）
+    Args:
+        fallback: サーキットが開いている・タイムアウト・エラーのときに返す結果（省略時は SKIP_RESULT）。
+            Gemini の判定と区別できるよう "fallback": True を付けて返す（学習データに混ぜないため）
+        timeout: 締め切り（秒）。省略時は GEMINI_TIMEOUT
+    """
     if history is None:
         history = []
     if existing_topics is None:
         existing_topics = []
+    fallback = {**(fallback or SKIP_RESULT), "fallback": True}
+
+    today_str = date.today().isoformat()
+
+    cache_key = make_key(text, history, existing_topics, today_str)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+
+    if not breaker.allow():
+        return fallback
+
+    try:
+        if batcher:
+            result = await asyncio.wait_for(
+                batcher.classify(text, history, existing_topics, today_str),
+                (timeout or GEMINI_TIMEOUT) + batcher.window,
+            )
+        else:
+            contents = build_prompt(text, history, existing_topics, today_str)
+            response = await _generate_with_deadline(contents, timeout or GEMINI_TIMEOUT)
+            _record_usage(response)
+            result = json.loads(response.text)
+    except Exception as e:
+        breaker.record(False)
+        errors.inc()
+        logger.error("Gemini Error: %r", e)
+        # 万が一 2.5 がまだAPIで通らない場合のフォールバックなどを検討する場合はここ
+        return fallback
+
+    breaker.record(True)
+    cache.set(cache_key, result)
+    return dict(result)
 
-    history_text = ""
-    for h in history:
-        role_label = "家族" if h['role'] == "user" else "Bot"
-        history_text += f"- {role_label}: {h['content']}\n"
-
-    today_str = datetime.now().strftime("%Y-%m-%d")
-
-    system_prompt = f"""
-    あなたは家族のチャットから「やるべきこと(Task)」を抽出するAIです。
-    会話の流れを読んで、適切なカテゴリと具体的なタスク名を生成してください。
-    
-    ### 今日の日付
-    {today_str}
-
-    ### 📁 現在進行中のプロジェクト名（表記ゆれ防止用リスト）
-    {existing_topics}
-    
-    ### ⚠️ トピック名（プロジェクト名）の決定ルール
-    1. **最優先:** 上記のリストの中に、今回の会話に関連するものがあれば、**一字一句変えずにその名前を使用すること。**
-       （例：リストに「京都旅行」があり、会話が「宿どうする？」なら、トピックは「京都旅行」にする。「京都の宿」などと勝手に変えない）
-    2. 新規: リストに関連するものがない場合のみ、新しい具体的なイベント名を生成する。（例：「お父さんの誕生日会」「新潟旅行」）
-    3. 禁止: 「旅行」「食事」のような抽象的な大分類は禁止。
-
-    ### ⚠️ タスク名（summary）の生成ルール
-    1. **「〜を〜する」という命令形・行動ベースにすること。**
-       - ❌ 悪い例：「京都旅行の日程について話している」「宿をどうするか相談」
-       - ⭕️ 良い例：「京都旅行の日程を決める」「宿を予約する」「候補地をリストアップする」
-    2. 会話の状況説明ではなく、ユーザーが**次にアクションできる言葉**に変換すること。
-
-    ### 直近の会話ログ
-    {history_text}
-
-    ### 分類カテゴリー
-    - "task": 明確な行動、買い物、予約、調べること。（※担当者はここでは決めない）
-    - "accept": 直前のタスクや提案に対する「引き受け」「了解」「私がやる」という意思表示。
-    - "idea": 旅行の相談、提案、まだ決まっていないメモ。（※これも行動ベースの名前にする。「〜を考える」など）
-    - null: ただの相槌、完了報告、雑談、同意のみの場合。
-
-    ### 出力フォーマット (JSON)
-    {{
-        "category": "task" or "idea" or "accept" or null,
-        "topic": "プロジェクト名",
-        "summary": "タスクの内容（動詞で終わる短いフレーズ）",
-        "due_date": "YYYY-MM-DD(なければnull)",
-        "assignee": "null" 
-    }}
+
+def _record_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        prompt_tokens.inc(usage.prompt_token_count or 0)
+        output_tokens.inc(usage.candidates_token_count or 0)
+
+
+def _format_history(history):
+    return "".join([f"- {'家族' if h['role'] == 'user' else 'Bot'}: {h['content']}\n" for h in history]) or "(なし)\n"
+
+
+def _format_topics(existing_topics):
+    return "、".join(existing_topics) if existing_topics else "(なし)"
+
+
+def build_prompt(text, history, existing_topics, today_str):
+    """Geminiに送る毎回変わる部分を組み立てる（ルール等は SYSTEM_INSTRUCTION 側）"""
+    return _MESSAGE_TEMPLATE.format(
+        today=today_str,
+        topics=_format_topics(existing_topics),
+        history=_format_history(history),
+        text=text,
+    )
+
+
+def build_batch_prompt(items):
+    """複数メッセージをまとめて判定させる部分を組み立てる（ルール等は BATCH_SYSTEM_INSTRUCTION 側）"""
+    return "\n".join([
+        _BATCH_ITEM_TEMPLATE.format(
+            id=i,
+            today=item["today"],
+            topics=_format_topics(item["existing_topics"]),
+            history=_format_history(item["history"]),
+            text=item["text"],
+        )
+        for i, item in enumerate(items, start=1)
+    ])
+
+
+# システム指示 → (キャッシュ名 or None, 次に作り直す時刻)
+_context_caches = {}
+_context_cache_lock = asyncio.Lock()
+
+
+def cacheable(system_instruction):
     """
+    明示キャッシュの最小トークン数に届きそうか。日本語の指示はおおむね1文字1トークン以下なので、
+    文字数で足りなければ登録は必ず断られる（その往復とエラーログを毎回払うだけになる）
+    """
+    return len(system_instruction) >= GEMINI_CONTEXT_CACHE_MIN_TOKENS
+
+
+if GEMINI_CONTEXT_CACHE and not cacheable(SYSTEM_INSTRUCTION):
+    logger.info(
+        "GEMINI_CONTEXT_CACHE: システム指示が %d 文字で最小 %d トークンに届かないため、キャッシュは使いません",
+        len(SYSTEM_INSTRUCTION), GEMINI_CONTEXT_CACHE_MIN_TOKENS,
+    )
+
 
+async def _instruction_config(system_instruction):
+    """システム指示の渡し方（登録済みキャッシュの名前か、system_instruction そのもの）"""
+    if GEMINI_CONTEXT_CACHE and cacheable(system_instruction):
+        name = await _cached_content(system_instruction)
+        if name:
+            return {"cached_content": name}
+    return {"system_instruction": system_instruction}
+
+
+async def _cached_content(system_instruction):
+    entry = _context_caches.get(system_instruction)
+    if entry and entry[1] > time.time():
+        return entry[0]
+    async with _context_cache_lock:
+        entry = _context_caches.get(system_instruction)
+        if entry and entry[1] > time.time():
+            return entry[0]
+        from google.genai import types
+
+        try:
+            cached = await get_client().aio.caches.create(
+                model=GEMINI_MODEL,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    ttl=f"{GEMINI_CONTEXT_CACHE_TTL}s",
+                    display_name="familyflow-system-instruction",
+                ),
+            )
+            # 期限切れ直前に使わないよう、TTLの9割で作り直す
+            _context_caches[system_instruction] = (cached.name, time.time() + GEMINI_CONTEXT_CACHE_TTL * 0.9)
+            return cached.name
+        except Exception as e:
+            logger.error("Gemini Context Cache Error: %r", e)
+            # 登録できないときはしばらく system_instruction で送る
+            _context_caches[system_instruction] = (None, time.time() + 600)
+            return None
+
+
+async def _generate(contents, system_instruction):
+    from google.genai import types
+
+    instruction = await _instruction_config(system_instruction)
+    start = time.perf_counter()
     try:
         # ご指定の gemini-2.5-flash を使用
-        response = client.models.generate_content(
-            model='gemini-2.5-flash', 
-            contents=f"{system_prompt}\n\nユーザーの最新メッセージ: {text}",
+        response = await get_client().aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=contents,
             config=types.GenerateContentConfig(
-                response_mime_type='application/json'
+                response_mime_type='application/json',
+                **instruction,
             )
         )
-        return json.loads(response.text)
+    except Exception:
+        # キャッシュがGemini側で消えている可能性があるので、次回は作り直す
+        if "cached_content" in instruction:
+            _context_caches.pop(system_instruction, None)
+        raise
+    latency.observe(time.perf_counter() - start)
+    return response
 
-    except Exception as e:
-        print(f"Gemini Error: {e}")
-        # 万が一 2.5 がまだAPIで通らない場合のフォールバックなどを検討する場合はここ
-        return {"category": None}
\ No newline at end of file
+
+async def _generate_with_deadline(contents, timeout, system_instruction=SYSTEM_INSTRUCTION):
+    """
+    締め切り付きで generate_content を呼ぶ。
+    GEMINI_HEDGE=1 なら、これまでの p95 を過ぎても返ってこないときに同じリクエストをもう1本投げ、先に成功した方を使う
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + timeout
+    hedge_at = None
+    if GEMINI_HEDGE and latency.snapshot()["count"] >= GEMINI_HEDGE_MIN_SAMPLES:
+        hedge_at = start + latency.quantile(0.95)
+
+    pending = {asyncio.ensure_future(_generate(contents, system_instruction))}
+    try:
+        while True:
+            wait_until = min(deadline, hedge_at) if hedge_at else deadline
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0.0, wait_until - loop.time()), return_when=asyncio.FIRST_COMPLETED
+            )
+            error = None
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if error and not pending:
+                raise error
+            if loop.time() >= deadline:
+                raise asyncio.TimeoutError(f"Gemini did not respond within {timeout}s")
+            if hedge_at and not done:
+                hedge_at = None
+                hedged.inc()
+                pending.add(asyncio.ensure_future(_generate(contents, system_instruction)))
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+batcher = None
+if GEMINI_BATCH_WINDOW_MS > 0:
+    batcher = GeminiBatcher(
+        generate=functools.partial(_generate_with_deadline, system_instruction=BATCH_SYSTEM_INSTRUCTION),
+        build_prompt=build_batch_prompt,
+        on_response=_record_usage,
+        window=GEMINI_BATCH_WINDOW_MS / 1000,
+        max_batch=GEMINI_BATCH_MAX,
+        timeout=GEMINI_TIMEOUT,
+    )
@@ -1,30 +1,140 @@
-import spacy
+import os
+import re
+import threading
+from collections import deque
 
-# 日本語モデルの読み込み
-try:
-    nlp = spacy.load("ja_ginza")
-except Exception:
-    import ja_ginza
-    nlp = ja_ginza.load()
+from modules import metrics
 
-def analyze_with_ginza(text):
+# パイプラインのプロファイル：名前 → 読み込まないコンポーネント
+# ※ bunsetu_recognizer は dep_ のラベル（obj_bunsetu → obj）を整えているので外せない
+PROFILES = {
+    "full": [],
+    # analyze_with_ginza は lemma_ / pos_ / dep_ / children しか見ないので NER は不要
+    "task-rules": ["ner"],
+    # 冷蔵庫メモ（ginza_limit_test.py）は doc.ents で金額・日付を拾うので NER が必要
+    "memo": [],
+    # 前段フィルタ用：トークナイザ（SudachiPy）だけ
+    "tokenizer": ["tok2vec", "parser", "ner", "morphologizer", "compound_splitter", "bunsetu_recognizer"],
+}
+DEFAULT_PROFILE = "task-rules"
+
+
+def load_target_verbs(path=os.path.join(os.path.dirname(__file__), "target_verbs.txt")):
+    """ターゲット動詞リスト（「頼む」「お願い」なども含む）をファイルから読み込む"""
+    with open(path, encoding="utf-8") as f:
+        lines = (line.split("#", 1)[0].strip() for line in f)
+        return frozenset(line for line in lines if line)
+
+
+TARGET_VERBS = load_target_verbs()
+# lemma を空白でつないだ文字列に対して一発で探す（複合語の lemma に含まれる場合も拾う）
+_TARGET_RE = re.compile("|".join(map(re.escape, sorted(TARGET_VERBS, key=len, reverse=True))))
+
+prefilter_checked = metrics.counter("ginza_prefilter_checked_total")
+prefilter_skipped = metrics.counter("ginza_prefilter_skipped_total")
+
+# 日本語モデル（プロファイルごとに、初回の get_nlp() で読み込む）
+_nlps = {}
+_nlp_lock = threading.Lock()
+# SudachiPy のトークナイザはスレッドセーフでない（同時に使うと "Already borrowed" になる）ので、
+# 同じプロセス内の複数スレッドから使うときはモデルごとに1つずつ通す
+_use_locks = {}
+
+
+def get_nlp(profile=DEFAULT_PROFILE):
+    """
+    指定プロファイルのGiNZAモデルを返す。読み込みはプロセス・プロファイルごとに一度だけ。
+    （ワーカープロセスでは起動時にここが呼ばれる）
+    """
+    nlp = _nlps.get(profile)
+    if nlp is None:
+        import spacy  # import だけで0.5秒ほどかかるので、ここまで遅らせる
+
+        exclude = PROFILES[profile]
+        with _nlp_lock:
+            nlp = _nlps.get(profile)
+            if nlp is None:
+                try:
+                    nlp = spacy.load("ja_ginza", exclude=exclude)
+                except Exception:
+                    import ja_ginza
+                    nlp = ja_ginza.load(exclude=exclude)
+                _use_locks[profile] = threading.Lock()
+                _nlps[profile] = nlp
+    return nlp
+
+
+def analyze_with_ginza(text, profile=DEFAULT_PROFILE):
     """
     GiNZAを使って構文解析を行う（強化版）。
     1. 「名詞＋を/に＋動詞」の正式な形
     2. 「名詞＋動詞」の省略形（例：卵買って、温泉行く）
     の両方を検出する。
     """
-    doc = nlp(text)
-    
-    # ターゲット動詞リスト（「頼む」「お願い」なども追加）
-    target_verbs = ["買う", "購入", "行く", "予約", "申込む", "調べる", "払う", "頼む", "お願い"]
-    
+    nlp = get_nlp(profile)
+    with _use_locks[profile]:
+        # まずトークナイズだけして、ターゲット動詞が無ければ構文解析せずに終わる
+        doc = nlp.make_doc(text)
+        if not _has_target_lemma(doc):
+            return None
+        return classify_doc(nlp(doc))
+
+
+def might_match(text):
+    """
+    構文解析の前段フィルタ（トークナイザだけのモデルを使う）。
+    False なら analyze_with_ginza は必ず None を返すので、パースを丸ごと省略できる
+    """
+    nlp = get_nlp("tokenizer")
+    with _use_locks["tokenizer"]:
+        return _has_target_lemma(nlp.make_doc(text))
+
+
+def _has_target_lemma(doc):
+    prefilter_checked.inc()
+    if _TARGET_RE.search(" ".join(token.lemma_ for token in doc)):
+        return True
+    prefilter_skipped.inc()
+    return False
+
+
+def analyze_many(texts, batch_size=64, n_process=1, profile=DEFAULT_PROFILE):
+    """
+    複数のメッセージを nlp.pipe でまとめて解析する（一括再分類・バックフィル用）。
+    結果は入力と同じ順番で、ジェネレータとして1件ずつ返す。
+    ターゲット動詞を含まないメッセージは構文解析に回さず None を返す。
+    """
+    nlp = get_nlp(profile)
+    order = deque()  # まだ結果を返していない入力の番号（入力順）
+
+    def candidates():
+        for i, text in enumerate(texts):
+            doc = nlp.make_doc(text)
+            matched = _has_target_lemma(doc)
+            order.append(i)
+            if matched:
+                yield doc, i
+
+    for doc, i in nlp.pipe(candidates(), batch_size=batch_size, n_process=n_process, as_tuples=True):
+        # 解析に回さなかった分を先に返して順番を揃える
+        while order[0] != i:
+            order.popleft()
+            yield None
+        order.popleft()
+        yield classify_doc(doc)
+    while order:
+        order.popleft()
+        yield None
+
+
+def classify_doc(doc):
+    """解析済みの Doc にルールを当ててタスク判定する"""
     for token in doc:
         # デバッグ用：どんな単語・品詞・基本形で認識されたか確認したいときに有効
         # print(f"{token.text} -> pos:{token.pos_} lemma:{token.lemma_} dep:{token.dep_}")
 
         # 動詞の基本形(lemma)がターゲットに含まれているかチェック
-        if token.lemma_ in target_verbs:
+        if token.lemma_ in TARGET_VERBS:
             
             objective = ""
             
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker(profile):
+    """ワーカープロセス起動時にモデルを読み込んでおく"""
+    from modules.ginza_logic import get_nlp
+    get_nlp(profile)
+
+
+def _analyze(text, profile):
+    from modules.ginza_logic import analyze_with_ginza
+    return analyze_with_ginza(text, profile)
+
+
+def _ping():
+    return os.getpid()
+
+
+class GinzaPool:
+    """
+    GiNZA解析用のプロセスプール。
+    各プロセスが起動時に一度だけモデルを読み込むので、構文解析がGILを取り合わずコア数に応じて並列化される。
+    """
+
+    def __init__(self, workers=None, timeout=5.0, profile="task-rules"):
+        self.workers = workers or os.cpu_count() or 1
+        self.profile = profile
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self.latency = metrics.latency("ginza_pool_seconds")
+        self.timeouts = metrics.counter("ginza_pool_timeouts_total")
+        self.restarts = metrics.counter("ginza_pool_restarts_total")
+
+    def _create_executor(self):
+        # fork だとWebサーバー側のスレッド状態を引き継いでしまうので spawn で起動する
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.profile,),
+        )
+
+    def start(self, wait=True):
+        """プールを起動する。wait=True なら全ワーカーのモデル読み込み完了まで待つ"""
+        executor = self._current()
+        futures = [executor.submit(_ping) for _ in range(self.workers)]
+        if wait:
+            for f in futures:
+                f.result()
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _restart(self, broken):
+        """ワーカーが落ちてプールが壊れたら作り直す"""
+        with self._lock:
+            # 別スレッドがすでに作り直していれば何もしない
+            if self._executor is not broken:
+                return
+            self._executor = self._create_executor()
+        self.restarts.inc()
+        logger.warning("GiNZA Pool: ワーカーが異常終了したためプールを再起動しました")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _current(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            return self._executor
+
+    def _submit(self, text):
+        executor = self._current()
+        try:
+            return executor, executor.submit(_analyze, text, self.profile)
+        except BrokenProcessPool:
+            # 投入時点で壊れていた場合は作り直して一度だけ再投入する
+            self._restart(executor)
+            executor = self._current()
+            return executor, executor.submit(_analyze, text, self.profile)
+
+    def analyze(self, text, timeout=None):
+        """
+        解析結果を同期で受け取る（ワーカースレッドから呼ぶ用）。
+        タイムアウト・ワーカー異常時は None を返し、呼び出し側で Gemini に回す
+        """
+        timeout = self.timeout if timeout is None else timeout
+        executor, future = self._submit(text)
+        with self.latency.time():
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                self.timeouts.inc()
+                logger.warning("GiNZA Pool: タイムアウト (%ss)", timeout)
+                return None
+            except BrokenProcessPool:
+                self._restart(executor)
+                return None
+
+    async def analyze_async(self, text, timeout=None):
+        """analyze の await 版"""
+        timeout = self.timeout if timeout is None else timeout
+        executor, future = self._submit(text)
+        with self.latency.time():
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            except asyncio.TimeoutError:
+                self.timeouts.inc()
+                logger.warning("GiNZA Pool: タイムアウト (%ss)", timeout)
+                return None
+            except BrokenProcessPool:
+                self._restart(executor)
+                return None
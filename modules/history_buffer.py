@@ -0,0 +1,149 @@
+import json
+import threading
+from collections import OrderedDict, deque
+
+from modules import metrics
+
+
+class HistoryBuffer:
+    """
+    グループごとの直近の会話（最大 maxlen 件）をメモリに持つリングバッファ。
+    初めて参照したグループだけDBから読み込み、以降は保存のたびに追記する。
+    全グループ合計が max_messages 件を超えたら、しばらく使われていないグループから捨てる
+    """
+
+    def __init__(self, load_recent, maxlen=10, max_messages=20000):
+        self.load_recent = load_recent  # (group_id, limit) -> 古い順のメッセージ dict のリスト。失敗時は例外を投げる
+        self.maxlen = maxlen
+        self.max_messages = max_messages
+        self._groups = OrderedDict()  # group_id -> deque（LRU順）
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = metrics.counter("history_buffer_hits_total")
+        self.misses = metrics.counter("history_buffer_misses_total")
+        self.evictions = metrics.counter("history_buffer_evictions_total")
+        self.size_gauge = metrics.gauge("history_buffer_messages")
+
+    def recent(self, group_id, limit=5):
+        """直近 limit 件を古い順で返す"""
+        with self._lock:
+            buf = self._groups.get(group_id)
+            if buf is not None:
+                self._groups.move_to_end(group_id)
+                self.hits.inc()
+                return list(buf)[-limit:]
+        self.misses.inc()
+        rows = self.load_recent(group_id, self.maxlen)
+        with self._lock:
+            # 読み込み中に別スレッドが先に入れていればそちらを使う
+            buf = self._groups.get(group_id)
+            if buf is None:
+                buf = deque(rows, maxlen=self.maxlen)
+                self._groups[group_id] = buf
+                self._size += len(buf)
+                self._evict()
+            return list(buf)[-limit:]
+
+    def append(self, group_id, message):
+        """
+        保存したメッセージを追記する。
+        まだ読み込んでいないグループは次回参照時にDBから読むので何もしない
+        """
+        with self._lock:
+            buf = self._groups.get(group_id)
+            if buf is None:
+                return
+            if len(buf) < buf.maxlen:
+                self._size += 1
+            buf.append(message)
+            self._groups.move_to_end(group_id)
+            self._evict()
+
+    def invalidate(self, group_id=None):
+        with self._lock:
+            if group_id is None:
+                self._groups.clear()
+                self._size = 0
+            elif group_id in self._groups:
+                self._size -= len(self._groups.pop(group_id))
+            self.size_gauge.set(self._size)
+
+    def _evict(self):
+        while self._size > self.max_messages and len(self._groups) > 1:
+            _, buf = self._groups.popitem(last=False)
+            self._size -= len(buf)
+            self.evictions.inc()
+        self.size_gauge.set(self._size)
+
+    def stats(self):
+        with self._lock:
+            groups, size = len(self._groups), self._size
+        return {
+            "backend": "memory",
+            "groups": groups,
+            "messages": size,
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "evictions": self.evictions.value,
+        }
+
+
+class RedisHistoryBuffer:
+    """
+    HistoryBuffer の Redis 版（uvicorn のワーカーを複数立てるときに、プロセス間で同じ履歴を共有する）。
+    グループごとにリストを1本持ち、LTRIM で maxlen 件に保つ。メモリ上限は Redis 側の maxmemory/TTL に任せる
+    """
+
+    def __init__(self, load_recent, url, maxlen=10, ttl=86400, prefix="history:"):
+        import redis  # 使うときだけ必要（requirements には入れていない）
+
+        self.load_recent = load_recent
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self.hits = metrics.counter("history_buffer_hits_total")
+        self.misses = metrics.counter("history_buffer_misses_total")
+
+    def _keys(self, group_id):
+        # 空のグループでも毎回DBに行かないよう、読み込み済みの印を別キーで持つ
+        key = f"{self.prefix}{group_id}"
+        return key, key + ":loaded"
+
+    def recent(self, group_id, limit=5):
+        key, loaded = self._keys(group_id)
+        if self._redis.exists(loaded):
+            self.hits.inc()
+            return [json.loads(v) for v in self._redis.lrange(key, -limit, -1)]
+        self.misses.inc()
+        rows = self.load_recent(group_id, self.maxlen)
+        pipe = self._redis.pipeline()
+        pipe.delete(key)
+        if rows:
+            pipe.rpush(key, *[json.dumps(r, ensure_ascii=False) for r in rows])
+        pipe.set(loaded, 1, ex=self.ttl)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+        return rows[-limit:]
+
+    def append(self, group_id, message):
+        key, loaded = self._keys(group_id)
+        if not self._redis.exists(loaded):
+            return
+        pipe = self._redis.pipeline()
+        pipe.rpush(key, json.dumps(message, ensure_ascii=False))
+        pipe.ltrim(key, -self.maxlen, -1)
+        pipe.expire(key, self.ttl)
+        pipe.expire(loaded, self.ttl)
+        pipe.execute()
+
+    def invalidate(self, group_id=None):
+        if group_id is None:
+            keys = list(self._redis.scan_iter(f"{self.prefix}*"))
+        else:
+            keys = list(self._keys(group_id))
+        if keys:
+            self._redis.delete(*keys)
+
+    def stats(self):
+        return {"backend": "redis", "hits": self.hits.value, "misses": self.misses.value}
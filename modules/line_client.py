@@ -0,0 +1,202 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import time
+import uuid
+
+from modules import aio, metrics
+
+logger = logging.getLogger(__name__)
+
+reply_time = metrics.latency("line_reply_seconds")
+push_time = metrics.latency("line_push_seconds")
+replies = metrics.counter("line_replies_total")
+fallbacks = metrics.counter("line_reply_fallback_pushes_total")
+pushes = metrics.counter("line_pushes_total")
+push_failures = metrics.counter("line_push_failures_total")
+push_depth = metrics.gauge("line_push_queue_depth")
+
+
+def _reply_failure(reason):
+    metrics.counter("line_reply_failures_total", reason=reason).inc()
+
+
+def _invalid_reply_token(body):
+    """400 の本文が返信トークンの期限切れ・使用済み（{"message": "Invalid reply token"}）かどうか"""
+    try:
+        message = json.loads(body or "{}").get("message", "")
+    except (ValueError, AttributeError):
+        return False
+    return "reply token" in message.lower()
+
+
+class LineMessenger:
+    """
+    LINE への返信を v3 の非同期クライアント（AsyncMessagingApi）で送る。
+    クライアントは共有イベントループ（modules.aio）上に1つだけ作り、接続を keep-alive で使い回す。
+    返信トークンは受信から reply_token_ttl 秒で使えなくなるので、それまでに送れなかったとき・
+    トークンが無効と断られたときは、同じ内容をプッシュメッセージとしてキューに積んで送り直す
+    """
+
+    def __init__(self, access_token, host=None, reply_token_ttl=50.0, reply_timeout=10.0, max_connections=10,
+                 push_retries=3, push_backoff=1.0, push_queue_size=1000):
+        self.access_token = access_token
+        self.host = host
+        self.reply_token_ttl = reply_token_ttl
+        self.reply_timeout = reply_timeout
+        self.max_connections = max_connections
+        self.push_retries = push_retries
+        self.push_backoff = push_backoff
+        self.push_queue_size = push_queue_size
+        self._client = None
+        self._api = None
+        self._push_queue = None
+        self._push_worker = None
+        self._inflight = set()  # 送信中の返信（終了時に待つ）
+
+    def reply(self, event, text):
+        """
+        event への返信を送る（結果を待たない）。ワーカースレッドはHTTPの往復を待たずに次へ進める。
+        concurrent.futures.Future を返し、結果は "reply"（返信できた）/ "push"（プッシュに回した）/ None
+        """
+        future = aio.submit(self.send(event.reply_token, _push_target(event.source), text, event.timestamp / 1000))
+        self._inflight.add(future)
+        future.add_done_callback(self._inflight.discard)
+        return future
+
+    async def send(self, reply_token, to, text, received_at):
+        from linebot.v3.messaging import ReplyMessageRequest, TextMessage
+        from linebot.v3.messaging.exceptions import ApiException
+
+        messages = [TextMessage(text=text)]
+        remaining = received_at + self.reply_token_ttl - time.time()
+        if remaining <= 0:
+            # 処理が遅れてトークンが切れている。返信は諦めてプッシュで送る
+            _reply_failure("expired")
+            return await self._fallback(to, messages)
+
+        api = await self._ensure_started()
+        try:
+            with reply_time.time():
+                await asyncio.wait_for(
+                    api.reply_message(ReplyMessageRequest(reply_token=reply_token, messages=messages)),
+                    min(remaining, self.reply_timeout),
+                )
+            replies.inc()
+            return "reply"
+        except ApiException as e:
+            _reply_failure(f"http_{e.status}")
+            if (e.status == 400 and _invalid_reply_token(e.body)) or e.status == 429 or e.status >= 500:
+                # トークン切れ・使用済み・混雑。いずれも返信は届いていないのでプッシュで送り直す
+                logger.warning("LINE Reply Error (%s): %s", e.status, e.body)
+                return await self._fallback(to, messages)
+            # それ以外の 400（メッセージの中身が不正など）はプッシュでも同じく断られる
+            logger.error("LINE Reply Error (%s): %s", e.status, e.body)
+        except asyncio.TimeoutError:
+            # 届いたかどうか分からないので、二重に送らないようプッシュはしない
+            _reply_failure("timeout")
+            logger.warning("LINE Reply Timeout (%.1fs)", min(remaining, self.reply_timeout))
+        except Exception as e:
+            _reply_failure("network")
+            logger.warning("LINE Reply Error: %r", e)
+            return await self._fallback(to, messages)
+        return None
+
+    async def _fallback(self, to, messages):
+        if not to:
+            return None
+        fallbacks.inc()
+        await self._ensure_started()
+        try:
+            # 再送しても二重に届かないよう、リトライキーはキューに積む時点で決めておく
+            self._push_queue.put_nowait((to, messages, str(uuid.uuid4())))
+        except asyncio.QueueFull:
+            push_failures.inc()
+            logger.error("LINE Push Queue is full; message to %s dropped", to)
+            return None
+        push_depth.set(self._push_queue.qsize())
+        return "push"
+
+    async def _ensure_started(self):
+        """共有ループの中で初めて呼ばれたときにクライアントとプッシュ用のワーカーを作る"""
+        if self._api is None:
+            from linebot.v3.messaging import AsyncApiClient, AsyncMessagingApi, Configuration
+
+            configuration = Configuration(access_token=self.access_token, host=self.host)
+            configuration.connection_pool_maxsize = self.max_connections
+            self._client = AsyncApiClient(configuration)
+            self._api = AsyncMessagingApi(self._client)
+            self._push_queue = asyncio.Queue(maxsize=self.push_queue_size)
+            self._push_worker = asyncio.ensure_future(self._run_pushes())
+        return self._api
+
+    async def _run_pushes(self):
+        while True:
+            to, messages, retry_key = await self._push_queue.get()
+            try:
+                await self._push(to, messages, retry_key)
+            finally:
+                self._push_queue.task_done()
+                push_depth.set(self._push_queue.qsize())
+
+    async def _push(self, to, messages, retry_key):
+        from linebot.v3.messaging import PushMessageRequest
+        from linebot.v3.messaging.exceptions import ApiException
+
+        for attempt in range(self.push_retries + 1):
+            try:
+                with push_time.time():
+                    await asyncio.wait_for(
+                        self._api.push_message(PushMessageRequest(to=to, messages=messages), x_line_retry_key=retry_key),
+                        self.reply_timeout,
+                    )
+                pushes.inc()
+                return
+            except ApiException as e:
+                if e.status == 409:
+                    # 同じリトライキーで受け付け済み（前回の試行が実は届いていた）
+                    pushes.inc()
+                    return
+                if e.status != 429 and e.status < 500:
+                    logger.error("LINE Push Error (%s): %s", e.status, e.body)
+                    break
+                logger.warning("LINE Push Error (%s, %s回目): %s", e.status, attempt + 1, e.body)
+            except Exception as e:
+                logger.warning("LINE Push Error (%s回目): %r", attempt + 1, e)
+            if attempt < self.push_retries:
+                await asyncio.sleep(self.push_backoff * (2 ** attempt))
+        push_failures.inc()
+
+    def close(self, timeout=10.0):
+        """送信中の返信とキューに残っているプッシュを送り切ってから接続を閉じる"""
+        concurrent.futures.wait(list(self._inflight), timeout)
+        if self._api is None:
+            return
+        try:
+            aio.run(self._close(), timeout=timeout)
+        except Exception as e:
+            logger.warning("LINE Client Close Error: %r", e)
+
+    async def _close(self):
+        try:
+            await asyncio.wait_for(self._push_queue.join(), self.reply_timeout)
+        finally:
+            self._push_worker.cancel()
+            await self._client.close()
+            self._api = None
+
+    def stats(self):
+        return {
+            "replies": replies.value,
+            "fallback_pushes": fallbacks.value,
+            "pushes": pushes.value,
+            "push_failures": push_failures.value,
+            "push_queue_depth": self._push_queue.qsize() if self._push_queue else 0,
+            "reply": reply_time.snapshot(),
+        }
+
+
+def _push_target(source):
+    """プッシュの宛先（グループ・トークルーム・個人チャットのID）"""
+    return getattr(source, "group_id", None) or getattr(source, "room_id", None) or getattr(source, "user_id", None)
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+from modules import metrics
+
+# 1回にまとめた件数の分布（秒ではなく件数のバケット）
+BATCH_SIZE_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+
+
+class GeminiBatcher:
+    """
+    短い時間窓（または件数上限）の間に来た判定依頼を1回のリクエストにまとめて送り、
+    返ってきた JSON 配列を待っている呼び出し元それぞれに配る。
+    共有イベントループ（modules/aio.py）上で使う前提
+    """
+
+    def __init__(self, generate, build_prompt, on_response=None, window=0.1, max_batch=8, timeout=10.0):
+        self.generate = generate          # async (contents, timeout) -> response
+        self.build_prompt = build_prompt  # (items) -> contents
+        self.on_response = on_response    # トークン数の記録など
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._items = []
+        self._timer = None
+        self.batch_size = metrics.histogram("gemini_batch_size", BATCH_SIZE_BUCKETS)
+        self.batches = metrics.counter("gemini_batches_total")
+
+    async def classify(self, text, history, existing_topics, today_str):
+        """1件分の判定を依頼し、まとめて送られた結果のうち自分の分を受け取る"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._items.append({
+            "text": text,
+            "history": history,
+            "existing_topics": existing_topics,
+            "today": today_str,
+            "future": future,
+        })
+        if len(self._items) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        items, self._items = self._items, []
+        if items:
+            asyncio.ensure_future(self._send(items))
+
+    async def _send(self, items):
+        self.batches.inc()
+        self.batch_size.observe(len(items))
+        try:
+            response = await self.generate(self.build_prompt(items), self.timeout)
+            if self.on_response:
+                self.on_response(response)
+            results = json.loads(response.text)
+            if isinstance(results, dict):
+                results = [results]
+            by_id = {r.get("id"): r for r in results if isinstance(r, dict)}
+        except Exception as e:
+            for item in items:
+                if not item["future"].done():
+                    item["future"].set_exception(e)
+            return
+
+        for i, item in enumerate(items, start=1):
+            if item["future"].done():
+                continue
+            result = by_id.get(i)
+            if result is None:
+                item["future"].set_exception(ValueError(f"バッチ応答にメッセージ{i}の結果がありません"))
+            else:
+                result = {k: v for k, v in result.items() if k != "id"}
+                item["future"].set_result(result)
@@ -0,0 +1,250 @@
+import json
+import math
+import os
+import random
+import re
+import time
+import unicodedata
+from collections import Counter
+
+from modules import metrics
+
+# Gemini の category: null（雑談・その他）を表すラベル
+NONE_LABEL = "none"
+LABELS = ["task", "idea", "accept", NONE_LABEL]
+
+# models/local_classifier-v3.json のように版番号付きで保存する
+ARTIFACT_PREFIX = "local_classifier"
+_ARTIFACT = re.compile(rf"^{ARTIFACT_PREFIX}-v(\d+)\.json$")
+
+decisions = metrics.counter("local_classifier_decisions_total")
+abstained = metrics.counter("local_classifier_abstained_total")
+predict_time = metrics.latency("local_classifier_seconds")
+
+
+def label_of(category):
+    """判定結果の category をラベル名にする（None は NONE_LABEL）。知らない値なら None"""
+    label = NONE_LABEL if category is None else category
+    return label if label in LABELS else None
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(text.split())
+
+
+def ngrams(text, n_min=1, n_max=3):
+    """文字 n-gram の集合（前後に空白を足して文頭・文末も特徴にする）"""
+    padded = f" {normalize(text)} "
+    grams = set()
+    for n in range(n_min, n_max + 1):
+        for i in range(len(padded) - n + 1):
+            gram = padded[i:i + n]
+            if gram.strip():
+                grams.add(gram)
+    return grams
+
+
+class LocalClassifier:
+    """
+    文字 n-gram + 多クラスのロジスティック回帰で category だけを当てる小さな分類器。
+    GiNZA のルールに掛からなかったメッセージのうち、確信度が threshold 以上で
+    categories に入るラベルだけをここで決め、残りを Gemini に回す
+    """
+
+    def __init__(self, labels, weights, bias, threshold=1.0, categories=(NONE_LABEL,), ngram=(1, 3),
+                 version=0, meta=None):
+        self.labels = list(labels)
+        self.weights = weights  # n-gram -> ラベルごとの重み
+        self.bias = list(bias)
+        self.threshold = threshold
+        self.categories = set(categories)
+        self.ngram = tuple(ngram)
+        self.version = version
+        self.meta = meta or {}
+
+    def predict_proba(self, text):
+        grams = [g for g in ngrams(text, *self.ngram) if g in self.weights]
+        scale = 1 / math.sqrt(len(grams)) if grams else 0.0
+        scores = list(self.bias)
+        for gram in grams:
+            for k, w in enumerate(self.weights[gram]):
+                scores[k] += w * scale
+        top = max(scores)
+        exps = [math.exp(s - top) for s in scores]
+        total = sum(exps)
+        return [e / total for e in exps]
+
+    def predict(self, text):
+        """(ラベル, 確信度)"""
+        proba = self.predict_proba(text)
+        best = max(range(len(proba)), key=proba.__getitem__)
+        return self.labels[best], proba[best]
+
+    def decide(self, text):
+        """ここで決めてよければラベル（NONE_LABEL を含む）、Gemini に回すべきなら None"""
+        with predict_time.time():
+            label, confidence = self.predict(text)
+        if confidence >= self.threshold and label in self.categories:
+            decisions.inc()
+            return label
+        abstained.inc()
+        return None
+
+    def to_dict(self):
+        return {
+            "version": self.version,
+            "labels": self.labels,
+            "ngram": list(self.ngram),
+            "threshold": self.threshold,
+            "categories": sorted(self.categories),
+            **self.meta,
+            "bias": self.bias,
+            "weights": self.weights,
+        }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        keys = ("labels", "weights", "bias", "threshold", "categories", "ngram", "version")
+        return cls(**{k: data[k] for k in keys}, meta={k: v for k, v in data.items() if k not in keys})
+
+
+def train(samples, epochs=10, lr=0.5, l2=1e-6, min_count=2, ngram=(1, 3), seed=0):
+    """
+    samples は (テキスト, ラベル) のリスト。確率的勾配降下で学習する（numpy を使うのは学習時だけ）。
+    返す LocalClassifier の threshold / categories は呼び出し側で決める
+    """
+    import numpy as np
+
+    docs = [(sorted(ngrams(text, *ngram)), label) for text, label in samples]
+    counts = Counter(g for grams, _ in docs for g in grams)
+    vocab = {g: i for i, g in enumerate(sorted(g for g, c in counts.items() if c >= min_count))}
+    index = {label: k for k, label in enumerate(LABELS)}
+    rows = []
+    for grams, label in docs:
+        idx = np.array([vocab[g] for g in grams if g in vocab], dtype=np.int64)
+        rows.append((idx, index[label]))
+
+    W = np.zeros((len(vocab), len(LABELS)))
+    b = np.zeros(len(LABELS))
+    order = list(range(len(rows)))
+    rng = random.Random(seed)
+    for epoch in range(epochs):
+        rng.shuffle(order)
+        step = lr / (1 + epoch)
+        for i in order:
+            idx, y = rows[i]
+            scale = 1 / math.sqrt(len(idx)) if len(idx) else 0.0
+            z = W[idx].sum(axis=0) * scale + b
+            p = np.exp(z - z.max())
+            p /= p.sum()
+            p[y] -= 1
+            if len(idx):
+                W[idx] -= step * (scale * p + l2 * W[idx])
+            b -= step * p
+
+    # 効いていない重みは捨てて成果物を小さくする
+    weights = {
+        g: [round(float(w), 4) for w in W[i]]
+        for g, i in vocab.items()
+        if np.abs(W[i]).max() >= 1e-3
+    }
+    return LocalClassifier(LABELS, weights, [round(float(x), 4) for x in b], ngram=ngram)
+
+
+def choose_threshold(model, samples, categories, target_precision=0.95, min_support=20):
+    """
+    確信度の高い順に並べ、ローカルで決める分の正解率が target_precision を保てる一番低い閾値を返す。
+    届かなければ 1.0 より大きい値（＝ローカルでは何も決めない）
+    """
+    scored = []
+    for text, label in samples:
+        predicted, confidence = model.predict(text)
+        if predicted in categories:
+            scored.append((confidence, predicted == label))
+    scored.sort(reverse=True)
+    threshold = 1.01
+    correct = 0
+    for n, (confidence, ok) in enumerate(scored, 1):
+        correct += ok
+        if n >= min_support and correct / n >= target_precision:
+            threshold = confidence
+    return threshold
+
+
+def evaluate(model, samples, sources=None):
+    """
+    学習に使っていないサンプルでの評価。sources はサンプルごとの判定元（"llm" / "ginza"）で、
+    「Gemini 呼び出しを減らせた割合」は llm のサンプルのうちローカルで決められた割合として数える
+    """
+    sources = sources or ["llm"] * len(samples)
+    confusion = Counter()
+    decided = decided_ok = llm_total = llm_decided = 0
+    start = time.perf_counter()
+    for (text, label), source in zip(samples, sources):
+        predicted, confidence = model.predict(text)
+        confusion[(label, predicted)] += 1
+        local = confidence >= model.threshold and predicted in model.categories
+        decided += local
+        decided_ok += local and predicted == label
+        if source == "llm":
+            llm_total += 1
+            llm_decided += local
+    elapsed = time.perf_counter() - start
+
+    n = len(samples)
+    per_class = {}
+    for label in model.labels:
+        tp = confusion[(label, label)]
+        predicted = sum(c for (_, p), c in confusion.items() if p == label)
+        actual = sum(c for (a, _), c in confusion.items() if a == label)
+        per_class[label] = {
+            "support": actual,
+            "precision": round(tp / predicted, 4) if predicted else None,
+            "recall": round(tp / actual, 4) if actual else None,
+        }
+    return {
+        "samples": n,
+        "accuracy": round(sum(c for (a, p), c in confusion.items() if a == p) / n, 4) if n else None,
+        "per_class": per_class,
+        "threshold": model.threshold,
+        "categories": sorted(model.categories),
+        "coverage": round(decided / n, 4) if n else None,
+        "accuracy_when_decided": round(decided_ok / decided, 4) if decided else None,
+        "llm_samples": llm_total,
+        "llm_calls_avoided": round(llm_decided / llm_total, 4) if llm_total else None,
+        "mean_predict_ms": round(elapsed / n * 1000, 3) if n else None,
+    }
+
+
+def artifact_paths(directory):
+    """directory にある成果物を (版番号, パス) の昇順で返す"""
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for name in os.listdir(directory):
+        match = _ARTIFACT.match(name)
+        if match:
+            found.append((int(match.group(1)), os.path.join(directory, name)))
+    return sorted(found)
+
+
+def latest_artifact(directory):
+    paths = artifact_paths(directory)
+    return paths[-1][1] if paths else None
+
+
+def next_version(directory):
+    paths = artifact_paths(directory)
+    return paths[-1][0] + 1 if paths else 1
+
+
+def artifact_path(directory, version):
+    return os.path.join(directory, f"{ARTIFACT_PREFIX}-v{version}.json")
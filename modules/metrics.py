@@ -0,0 +1,213 @@
+import threading
+import time
+
+# レイテンシ集計のバケット境界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyStats:
+    """
+    処理時間を集計する（件数・合計・最大・バケット）
+    ロックは observe の一瞬だけなのでホットパスで使っても軽い
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # 最後は +Inf
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        idx = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                idx = i
+                break
+        with self._lock:
+            self._counts[idx] += 1
+            self._count += 1
+            self._sum += seconds
+            if seconds > self._max:
+                self._max = seconds
+
+    def time(self):
+        """with 文で囲んだ区間を計測する"""
+        return _Timer(self)
+
+    def quantile(self, q):
+        """バケットから分位点をざっくり推定する（バケット上限を返す）"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            max_seen = self._max
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else max_seen
+        return max_seen
+
+    def histogram(self):
+        """Prometheus の histogram 形式（累積のバケット件数, 合計, 件数）"""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative = []
+        seen = 0
+        for c in counts:
+            seen += c
+            cumulative.append(seen)
+        return cumulative, total, count
+
+    def snapshot(self):
+        with self._lock:
+            count, total, max_seen = self._count, self._sum, self._max
+            counts = list(self._counts)
+        return {
+            "count": count,
+            "avg": total / count if count else 0.0,
+            "max": max_seen,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], counts)),
+        }
+
+
+class _Timer:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.stats.observe(self.elapsed)
+        return False
+
+
+class Counter:
+    """単純な加算カウンタ（スレッドセーフ）"""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+class Gauge:
+    """現在値を持つメトリクス（キューの深さ・サーキットの状態など）"""
+
+    def __init__(self):
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self._value
+
+
+# --- 名前付きで共有するためのレジストリ ---
+# キーは 'name' か、ラベル付きなら 'name{key="value",...}'（Prometheus の書き方そのまま）
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    """ラベルの値を Prometheus のテキスト形式でエスケープする（\\ と " と改行）"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _key(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+def _get(name, labels, factory):
+    key = _key(name, labels)
+    metric = _registry.get(key)
+    if metric is None:
+        with _registry_lock:
+            metric = _registry.get(key)
+            if metric is None:
+                metric = _registry[key] = factory()
+    return metric
+
+
+def latency(name, **labels):
+    """名前（とラベル）に対応する LatencyStats を返す（なければ作る）"""
+    return _get(name, labels, LatencyStats)
+
+
+def histogram(name, buckets, **labels):
+    """バケット境界を指定した LatencyStats（件数など秒でない値の分布用）。境界は最初に作ったときのもの"""
+    return _get(name, labels, lambda: LatencyStats(buckets))
+
+
+def counter(name, **labels):
+    """名前（とラベル）に対応する Counter を返す（なければ作る）"""
+    return _get(name, labels, Counter)
+
+
+def gauge(name, **labels):
+    """名前（とラベル）に対応する Gauge を返す（なければ作る）"""
+    return _get(name, labels, Gauge)
+
+
+def snapshot():
+    """登録済みの全メトリクスを dict で返す（/stats 用）"""
+    with _registry_lock:
+        items = list(_registry.items())
+    result = {}
+    for name, metric in items:
+        if isinstance(metric, LatencyStats):
+            result[name] = metric.snapshot()
+        else:
+            result[name] = metric.value
+    return result
+
+
+_TYPES = ((LatencyStats, "histogram"), (Counter, "counter"), (Gauge, "gauge"))
+
+
+def render_prometheus():
+    """登録済みの全メトリクスを Prometheus のテキスト形式にする（/metrics 用）"""
+    with _registry_lock:
+        items = sorted(_registry.items())
+    families = {}
+    for key, metric in items:
+        name, _, labels = key.partition("{")
+        families.setdefault(name, []).append((labels[:-1], metric))
+
+    lines = []
+    for name, members in families.items():
+        kind = next(t for cls, t in _TYPES if isinstance(members[0][1], cls))
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, metric in members:
+            if kind != "histogram":
+                lines.append(f"{name}{{{labels}}} {metric.value}" if labels else f"{name} {metric.value}")
+                continue
+            cumulative, total, count = metric.histogram()
+            prefix = labels + "," if labels else ""
+            for bound, c in zip([*map(str, metric.buckets), "+Inf"], cumulative):
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {c}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {total}")
+            lines.append(f"{name}_count{suffix} {count}")
+    return "\n".join(lines) + "\n"
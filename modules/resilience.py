@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    直近の呼び出しの失敗率が閾値を超えたら一定時間「開」にして、外部APIを呼ばずに即座に諦める。
+    開いてから reset_timeout 秒たつと1件だけ試し（半開）、成功すれば閉じる
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self._results = deque(maxlen=window)  # True=成功
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self.state_gauge = metrics.gauge(f"{name}_circuit_state")
+        self.rejected = metrics.counter(f"{name}_circuit_rejected_total")
+
+    @property
+    def state(self):
+        return self._state
+
+    def _set_state(self, state):
+        self._state = state
+        self.state_gauge.set(self._STATE_VALUES[state])
+
+    def allow(self):
+        """呼び出してよいか。False のときは呼ばずにフォールバックする"""
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected.inc()
+                    return False
+                self._set_state(self.HALF_OPEN)
+                self._trial_running = False
+            if self._state == self.HALF_OPEN:
+                if self._trial_running:
+                    self.rejected.inc()
+                    return False
+                self._trial_running = True
+            return True
+
+    def record(self, success):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._trial_running = False
+                if success:
+                    self._results.clear()
+                    self._set_state(self.CLOSED)
+                else:
+                    self._open()
+                return
+            self._results.append(success)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._set_state(self.OPEN)
+        logger.warning("CircuitBreaker(%s): open（%s秒間は呼び出しを止めます）", self.name, self.reset_timeout)
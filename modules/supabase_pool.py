@@ -0,0 +1,93 @@
+import threading
+
+import httpx
+
+from modules import metrics
+
+# 接続プールの使われ方（/stats で見る）
+acquire_wait = metrics.latency("supabase_acquire_wait_seconds")
+request_time = metrics.latency("supabase_request_seconds")
+opened = metrics.counter("supabase_connections_opened_total")
+reused = metrics.counter("supabase_connections_reused_total")
+in_flight = metrics.gauge("supabase_in_flight")
+
+
+class _ConnectionTrace:
+    """httpcore の trace で、新しく TCP 接続を張ったか（＝使い回せなかったか）を記録する"""
+
+    def __init__(self):
+        self.connected = False
+
+    def __call__(self, event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            self.connected = True
+
+    def record(self):
+        (opened if self.connected else reused).inc()
+
+
+class PooledTransport(httpx.HTTPTransport):
+    """
+    同時リクエスト数を max_concurrency に絞る HTTPTransport。
+    空きを待った時間・接続を使い回せたかをメトリクスに出す（httpx.Client 自体はスレッドセーフ）
+    """
+
+    def __init__(self, max_concurrency, **kwargs):
+        super().__init__(**kwargs)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def handle_request(self, request):
+        trace = _ConnectionTrace()
+        request.extensions["trace"] = trace
+        with acquire_wait.time():
+            self._slots.acquire()
+        self._enter(1)
+        try:
+            with request_time.time():
+                response = super().handle_request(request)
+                # 本文まで読み切ってから枠を返す（PostgREST の応答はどのみち全部読む）
+                response.read()
+            trace.record()
+            return response
+        finally:
+            self._enter(-1)
+            self._slots.release()
+
+    def _enter(self, delta):
+        with self._lock:
+            self._in_flight += delta
+            in_flight.set(self._in_flight)
+
+
+def _options(max_connections, keepalive, keepalive_expiry, timeout, http2):
+    return {
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        "http2": http2,
+    }, httpx.Timeout(timeout, connect=min(timeout, 5.0))
+
+
+def make_http_client(max_connections=10, keepalive=10, keepalive_expiry=60.0, timeout=10.0,
+                     http2=True, max_concurrency=None):
+    """
+    PostgREST 用の httpx.Client を作る。
+    HTTP/2 なら1本の接続に複数リクエストを多重化できるので、同時実行数は接続数より多めにとれる
+    """
+    transport_options, client_timeout = _options(max_connections, keepalive, keepalive_expiry, timeout, http2)
+    transport = PooledTransport(max_concurrency or max_connections * (10 if http2 else 1), **transport_options)
+    return httpx.Client(transport=transport, timeout=client_timeout)
+
+
+def stats():
+    return {
+        "in_flight": in_flight.value,
+        "opened": opened.value,
+        "reused": reused.value,
+        "acquire_wait": acquire_wait.snapshot(),
+        "request": request_time.snapshot(),
+    }
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TopicIndex:
+    """
+    グループごとの「進行中トピック → 未完了タスク数」をメモリに持つ索引。
+    タスクの追加・状態変更のたびに差分で更新し、ttl 秒ごとにDBから数え直して食い違いを直す
+    （ダッシュボードなど別プロセスからの変更もここで拾う）。
+    期限切れでも古い値をすぐ返し、数え直しは裏で行うので、メッセージ処理中にDBへ問い合わせるのは初回だけ
+    """
+
+    def __init__(self, load_counts, ttl=60.0, executor=None):
+        self.load_counts = load_counts  # (group_id) -> {topic: 件数}。失敗時は例外を投げる
+        self.ttl = ttl
+        self.executor = executor  # 裏での数え直しに使う（None なら専用スレッドを立てる）
+        self._groups = {}  # group_id -> {"counts": Counter, "loaded_at": float}
+        self._versions = {}  # group_id -> 差分更新の回数（数え直し中の更新を検出する）
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = metrics.counter("topic_index_hits_total")
+        self.loads = metrics.counter("topic_index_loads_total")
+        self.drift = metrics.counter("topic_index_drift_total")
+
+    def topics(self, group_id):
+        """未完了タスクが1件以上あるトピック名のリスト"""
+        with self._lock:
+            entry = self._groups.get(group_id)
+            if entry is not None:
+                self.hits.inc()
+                stale = time.monotonic() - entry["loaded_at"] > self.ttl
+                result = [t for t, n in entry["counts"].items() if n > 0]
+        if entry is None:
+            return self.refresh(group_id)
+        if stale:
+            self._refresh_later(group_id)
+        return result
+
+    def refresh(self, group_id):
+        """DBから数え直して置き換える"""
+        with self._lock:
+            version = self._versions.get(group_id, 0)
+        self.loads.inc()
+        counts = Counter({t: n for t, n in self.load_counts(group_id).items() if t and n > 0})
+        with self._lock:
+            entry = self._groups.get(group_id)
+            if self._versions.get(group_id, 0) != version:
+                # 読み込み中に差分更新が入り、その分が結果から抜けているかもしれない。
+                # 手元の値があればそちらを優先し、なければ今回の結果を「期限切れ」として入れて次回すぐ数え直す
+                if entry is None:
+                    self._groups[group_id] = {"counts": counts, "loaded_at": float("-inf")}
+                    return list(counts)
+                return [t for t, n in entry["counts"].items() if n > 0]
+            if entry is not None and +entry["counts"] != counts:
+                self.drift.inc()
+            self._groups[group_id] = {"counts": counts, "loaded_at": time.monotonic()}
+        return list(counts)
+
+    def _refresh_later(self, group_id):
+        with self._lock:
+            if group_id in self._refreshing:
+                return
+            self._refreshing.add(group_id)
+
+        def run():
+            try:
+                self.refresh(group_id)
+            except Exception as e:
+                logger.error("Topic Index Refresh Error: %s", e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(group_id)
+
+        if self.executor:
+            self.executor.submit(run)
+        else:
+            threading.Thread(target=run, daemon=True).start()
+
+    def add(self, group_id, topic, amount=1):
+        """未完了タスクの増減を反映する（まだ読み込んでいないグループは初回参照時に数えるので無視）"""
+        if not topic:
+            return
+        with self._lock:
+            self._versions[group_id] = self._versions.get(group_id, 0) + 1
+            entry = self._groups.get(group_id)
+            if entry is None:
+                return
+            entry["counts"][topic] += amount
+            if entry["counts"][topic] <= 0:
+                del entry["counts"][topic]
+
+    def remove(self, group_id, topic):
+        self.add(group_id, topic, -1)
+
+    def invalidate(self, group_id=None):
+        """次回参照時にDBから読み直させる"""
+        with self._lock:
+            if group_id is None:
+                self._groups.clear()
+            else:
+                self._groups.pop(group_id, None)
+
+    def stats(self):
+        with self._lock:
+            groups = len(self._groups)
+        return {
+            "groups": groups,
+            "hits": self.hits.value,
+            "loads": self.loads.value,
+            "drift": self.drift.value,
+        }
@@ -0,0 +1,148 @@
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+# この秒数を超えたリクエストは段階ごとの内訳を WARNING で出す
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", "3"))
+# プロファイラを掛けるリクエストの割合（0 なら掛けない）。掛けたもののうち遅かったものだけ残す
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+# "cprofile" か "pyinstrument"（pyinstrument は入っていれば使う。requirements には入れていない）
+PROFILER = os.environ.get("PROFILER", "cprofile")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+_local = threading.local()
+# プロファイラは同時に1つだけ（Python 3.12 以降の cProfile はプロセスで1つしか有効にできない）
+_profile_lock = threading.Lock()
+slow_requests = metrics.counter("pipeline_slow_requests_total")
+
+
+class _Span:
+    """with で囲んだ区間を pipeline_stage_seconds{stage=...} に記録し、実行中のトレースにも積む"""
+
+    __slots__ = ("name", "stats", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.stats = metrics.latency("pipeline_stage_seconds", stage=name)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.stats.observe(elapsed)
+        spans = getattr(_local, "spans", None)
+        if spans is not None:
+            spans.append((self.name, elapsed))
+        return False
+
+
+def span(name):
+    return _Span(name)
+
+
+def spanned(name):
+    """関数の呼び出し全体を span(name) で囲むデコレータ"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _Trace:
+    """1リクエスト分のトレース。遅ければ内訳をログに出し、サンプリング対象ならプロファイルも保存する"""
+
+    def __init__(self, name, label):
+        self.name = name
+        self.label = label
+        self.stats = metrics.latency("pipeline_request_seconds", pipeline=name)
+        self.profiler = None
+
+    def __enter__(self):
+        _local.spans = []
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE and _profile_lock.acquire(blocking=False):
+            try:
+                self.profiler = _start_profiler()
+            except Exception:
+                _profile_lock.release()
+                raise
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        spans, _local.spans = _local.spans, None
+        if self.profiler:
+            try:
+                _stop_profiler(self.profiler)
+            finally:
+                _profile_lock.release()
+        self.stats.observe(elapsed)
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            slow_requests.inc()
+            breakdown = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in spans)
+            logger.warning("slow %s %.0fms (%s) %s", self.name, elapsed * 1000, self.label, breakdown)
+            if self.profiler:
+                _save_profile(self.name, _profile_text(self.profiler))
+        return False
+
+
+def trace(name, label=""):
+    """
+    1リクエスト（handle_message 1回など）を囲む。中の span() がこのトレースの内訳になる。
+    label はログに出す識別子（グループIDなど）
+    """
+    return _Trace(name, label)
+
+
+def _start_profiler():
+    if PROFILER == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument が入っていないため cProfile を使います")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler):
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+    else:
+        profiler.stop()
+
+
+def _profile_text(profiler):
+    """保存用のテキスト（遅かったときだけ作る）"""
+    if isinstance(profiler, cProfile.Profile):
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+        return out.getvalue()
+    return profiler.output_text(unicode=True)
+
+
+def _save_profile(name, report):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{threading.get_ident()}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(report)
+    logger.warning("slow %s のプロファイルを %s に保存しました", name, path)
@@ -0,0 +1,52 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """
+    起動後にバックグラウンドで重い初期化（モデル読み込み等）を順番に実行する。
+    Webサーバーはこれを待たずにリクエストを受け付け、/ready で完了を確認できる
+    """
+
+    def __init__(self, steps):
+        self.steps = steps  # {名前: 引数なしの関数}
+        self.durations = {}
+        self.errors = {}
+        self.started = False
+        self._events = {name: threading.Event() for name in steps}
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        threading.Thread(target=self._run, name="warmup", daemon=True).start()
+
+    def _run(self):
+        for name, step in self.steps.items():
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                self.errors[name] = str(e)
+                logger.error("Warmup Error (%s): %s", name, e)
+            self.durations[name] = time.perf_counter() - start
+            self._events[name].set()
+
+    def is_ready(self, name=None):
+        """name を省略すると全ステップの完了（エラーなし）を確認する"""
+        names = [name] if name else list(self.steps)
+        return all(self._events[n].is_set() and n not in self.errors for n in names)
+
+    def wait(self, name, timeout=None):
+        """指定ステップの完了まで待つ。タイムアウト・失敗なら False"""
+        return self._events[name].wait(timeout) and name not in self.errors
+
+    def status(self):
+        return {
+            "ready": self.is_ready(),
+            "durations": self.durations,
+            "errors": self.errors,
+        }
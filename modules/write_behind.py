@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    返信に関係ない書き込み（チャットログ等）をためておき、件数か時間の区切りでまとめて insert する。
+    失敗したらバックオフ付きで再試行し、それでもダメならローカルファイルに追記して後で入れ直す（ログを失わない）
+    """
+
+    def __init__(self, name, write_rows, max_batch=100, interval=1.0, spill_path=None,
+                 max_retries=4, backoff=0.5):
+        self.name = name
+        self.write_rows = write_rows  # (rows) -> None。失敗時は例外を投げる
+        self.max_batch = max_batch
+        self.interval = interval
+        self.spill_path = spill_path
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.depth = metrics.gauge(f"{name}_buffer_depth")
+        self.flush_time = metrics.latency(f"{name}_flush_seconds")
+        self.flushed = metrics.counter(f"{name}_flushed_rows_total")
+        self.retries = metrics.counter(f"{name}_flush_retries_total")
+        self.spilled = metrics.counter(f"{name}_spilled_rows_total")
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+                self._thread.start()
+
+    def put(self, row):
+        self.start()
+        self._queue.put(row)
+        self.depth.set(self._queue.qsize())
+
+    def stop(self, timeout=10.0):
+        """残っている行を書き切ってから止める（シャットダウン時に呼ぶ）"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread:
+            self._stopping.set()
+            thread.join(timeout)
+
+    def _run(self):
+        self._replay_spill()
+        while True:
+            rows = self._collect()
+            if rows:
+                # 書き込めたならDBは復旧しているので、退避分も入れ直す
+                if self._flush(rows) and self.spilled.value:
+                    self._replay_spill()
+            elif self._stopping.is_set():
+                break
+
+    def _collect(self):
+        """max_batch 件たまるか interval 秒たつまで待って、たまった分を返す"""
+        rows = []
+        deadline = time.monotonic() + self.interval
+        while len(rows) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or (self._stopping.is_set() and self._queue.empty()):
+                break
+            try:
+                rows.append(self._queue.get(timeout=min(timeout, 0.1)))
+            except queue.Empty:
+                continue
+        self.depth.set(self._queue.qsize())
+        return rows
+
+    def _flush(self, rows):
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.write_rows(rows)
+                self.flushed.inc(len(rows))
+                self.flush_time.observe(time.perf_counter() - start)
+                return True
+            except Exception as e:
+                logger.warning("WriteBehind Error (%s, %s回目): %s", self.name, attempt + 1, e)
+                if attempt < self.max_retries and not self._stopping.is_set():
+                    self.retries.inc()
+                    time.sleep(self.backoff * (2 ** attempt))
+        self._spill(rows)
+        return False
+
+    def _spill(self, rows):
+        if not self.spill_path:
+            logger.warning("WriteBehind (%s): %s件を書き込めず破棄しました", self.name, len(rows))
+            return
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.spilled.inc(len(rows))
+        logger.warning("WriteBehind (%s): %s件を %s に退避しました", self.name, len(rows), self.spill_path)
+
+    def _replay_spill(self):
+        """
+        退避ファイルに残っている行を入れ直す（書き込みスレッドからだけ呼ぶ）。
+        途中で落ちても .replaying が残るので、次回起動時に続きから入れ直す（重複はあり得るが欠損はしない）
+        """
+        if not self.spill_path:
+            return
+        replaying = self.spill_path + ".replaying"
+        if not os.path.exists(replaying):
+            if not os.path.exists(self.spill_path):
+                return
+            os.replace(self.spill_path, replaying)
+        with open(replaying, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        for i in range(0, len(rows), self.max_batch):
+            # 失敗した分は _flush の中で再び退避ファイルに戻る
+            self._flush(rows[i:i + self.max_batch])
+        os.remove(replaying)
+
+    def stats(self):
+        return {
+            "depth": self._queue.qsize(),
+            "flushed": self.flushed.value,
+            "retries": self.retries.value,
+            "spilled": self.spilled.value,
+            "flush": self.flush_time.snapshot(),
+        }
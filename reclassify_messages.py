@@ -0,0 +1,77 @@
+"""
+messagesテーブル全体をGiNZAルールで再分類する（ルール変更後の確認・バックフィル用）
+    python reclassify_messages.py > reclassified.jsonl
+"""
+import argparse
+import json
+import sys
+import time
+from collections import Counter, deque
+
+from modules.database import supabase
+from modules.ginza_logic import analyze_many
+
+
+def iter_user_messages(page_size):
+    """
+    ユーザー発言を古い順に (created_at, id) のキーセット方式でページングして取得する。
+    OFFSET だと読んでいる間に発言が足されたとき同じ行が2回出るので、前のページの最後の created_at から続きを取り、
+    境目で同じ created_at の行はもう返した id を飛ばす（dashboard_data.TaskStore._fetch_pages と同じやり方）
+    """
+    boundary = None
+    seen = set()  # created_at が boundary と同じで、もう返した行の id
+    size = page_size
+    while True:
+        query = supabase.table("messages")\
+            .select("id, group_id, content, created_at")\
+            .eq("role", "user")
+        if boundary is not None:
+            query = query.gte("created_at", boundary)
+        rows = query.order("created_at").order("id").limit(size).execute().data
+        for row in rows:
+            if row["created_at"] == boundary and row["id"] in seen:
+                continue
+            yield row
+        if len(rows) < size:
+            break
+        last = rows[-1]["created_at"]
+        # 境目と同じ値の行だけでページが埋まった。先に進めないので多めに取り直す
+        size = size * 2 if last == boundary else page_size
+        seen = {row["id"] for row in rows if row["created_at"] == last} | (seen if last == boundary else set())
+        boundary = last
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--n-process", type=int, default=1)
+    args = parser.parse_args()
+
+    if not supabase:
+        sys.exit("Supabase設定エラー")
+
+    # 全件をメモリに載せず、ページを読みながら analyze_many に流す。
+    # analyze_many は入力順に結果を返すので、流した行を順に取り出して結果と組にする
+    pending = deque()
+
+    def texts():
+        for row in iter_user_messages(args.page_size):
+            pending.append(row)
+            yield row["content"]
+
+    counts = Counter()
+    total = 0
+    start = time.perf_counter()
+    for result in analyze_many(texts(), batch_size=args.batch_size, n_process=args.n_process):
+        row = pending.popleft()
+        counts[result["category"] if result else None] += 1
+        total += 1
+        print(json.dumps({**row, "ginza": result}, ensure_ascii=False))
+    elapsed = time.perf_counter() - start
+
+    print(f"{total}件 {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f} msg/s) {dict(counts)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
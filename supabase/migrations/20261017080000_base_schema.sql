@@ -0,0 +1,41 @@
+-- ボットとダッシュボードが使うテーブル（これまでSupabaseの管理画面で作っていたものを移行として記録する）
+-- 既存のプロジェクトに流しても壊さないよう、すべて if not exists で書く
+
+create table if not exists public.messages (
+    id bigint generated by default as identity primary key,
+    group_id text not null,
+    user_id text,
+    content text not null,
+    role text not null default 'user',  -- 'user'（家族の発言）/ 'bot'（ボットの返信）
+    created_at timestamptz not null default now()
+);
+
+create table if not exists public.tasks (
+    id bigint generated by default as identity primary key,
+    family_group_id text not null,
+    content text not null,
+    type text not null default 'task',  -- 'task' / 'idea'
+    topic text,
+    assignee_id text,
+    status text not null default 'pending',  -- 'pending' / 'done' / 'deleted'
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+-- 既存のテーブルに updated_at が無ければ足す（ダッシュボードの差分取得に使う）
+alter table public.tasks add column if not exists updated_at timestamptz not null default now();
+
+create or replace function public.touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+drop trigger if exists tasks_touch_updated_at on public.tasks;
+create trigger tasks_touch_updated_at
+    before update on public.tasks
+    for each row execute function public.touch_updated_at();
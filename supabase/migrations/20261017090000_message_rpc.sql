@@ -0,0 +1,83 @@
+-- handle_message の往復回数を減らすためのRPC関数
+--   ingest_message     : 直近履歴の取得 + メッセージ保存 + 進行中トピックの取得 を1回で行う
+--   assign_latest_task : 直近の未完了タスクへの担当者設定を1文でアトミックに行う
+
+create or replace function public.ingest_message(
+    p_group_id text,
+    p_user_id text,
+    p_content text,
+    p_role text default 'user',
+    p_history_limit integer default 5
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_history jsonb;
+    v_topics jsonb;
+begin
+    -- 保存する前の直近履歴（古い順）
+    select coalesce(jsonb_agg(to_jsonb(h) order by h.created_at), '[]'::jsonb)
+      into v_history
+      from (
+          select content, role, created_at
+            from public.messages
+           where group_id = p_group_id
+           order by created_at desc
+           limit p_history_limit
+      ) h;
+
+    insert into public.messages (group_id, user_id, content, role)
+    values (p_group_id, p_user_id, p_content, p_role);
+
+    select coalesce(jsonb_agg(distinct topic), '[]'::jsonb)
+      into v_topics
+      from public.tasks
+     where family_group_id = p_group_id
+       and status = 'pending'
+       and topic is not null
+       and topic <> '';
+
+    return jsonb_build_object('history', v_history, 'topics', v_topics);
+end;
+$$;
+
+create or replace function public.assign_latest_task(
+    p_group_id text,
+    p_assignee text,
+    p_assignable_topics text[]
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_result jsonb;
+begin
+    -- 直近の未完了タスクを行ロックして取り、日常系トピックのときだけ担当者を入れる
+    with target as (
+        select id, content, topic
+          from public.tasks
+         where family_group_id = p_group_id
+           and status = 'pending'
+         order by created_at desc
+         limit 1
+           for update
+    ), updated as (
+        update public.tasks t
+           set assignee_id = p_assignee
+          from target
+         where t.id = target.id
+           and target.topic = any(p_assignable_topics)
+        returning t.id
+    )
+    select jsonb_build_object(
+               'content', target.content,
+               'topic', target.topic,
+               'assigned', exists (select 1 from updated)
+           )
+      into v_result
+      from target;
+
+    return v_result;  -- 未完了タスクが無ければ null
+end;
+$$;
@@ -0,0 +1,30 @@
+-- modules/database.py・dashboard.py・reclassify_messages.py のクエリの形に合わせたインデックス
+-- （check_indexes.py で、各クエリがインデックスを使うことを EXPLAIN で確認できる）
+
+-- 直近の会話: where group_id = ? order by created_at desc limit N
+create index if not exists messages_group_created_idx
+    on public.messages (group_id, created_at desc);
+
+-- 再判定用の全件走査: where role = 'user' order by created_at（range でページング）
+create index if not exists messages_user_created_idx
+    on public.messages (created_at)
+    where role = 'user';
+
+-- 直近の未完了タスク（アサイン）: where family_group_id = ? and status = 'pending' order by created_at desc limit 1
+create index if not exists tasks_pending_group_created_idx
+    on public.tasks (family_group_id, created_at desc)
+    where status = 'pending';
+
+-- 進行中トピック・トピックでの絞り込み: where family_group_id = ? and status = 'pending' [and topic = ?]
+-- topic まで索引に入っているので、トピック一覧は表を見ずに index only scan で取れる
+create index if not exists tasks_pending_group_topic_idx
+    on public.tasks (family_group_id, topic)
+    where status = 'pending';
+
+-- ダッシュボードの一覧: order by created_at desc limit 100
+create index if not exists tasks_created_idx
+    on public.tasks (created_at desc);
+
+-- ダッシュボードの差分取得: where updated_at > ? order by updated_at
+create index if not exists tasks_updated_idx
+    on public.tasks (updated_at);
@@ -0,0 +1,32 @@
+-- グループごとの進行中トピックと未完了件数（ボットの TopicIndex の数え直しや集計用）
+-- 更新は refresh_active_topics() を呼ぶ。pg_cron があれば1分ごとに自動で更新する
+
+create materialized view if not exists public.active_topics as
+select family_group_id,
+       topic,
+       count(*) as pending_count
+  from public.tasks
+ where status = 'pending'
+   and topic is not null
+   and topic <> ''
+ group by family_group_id, topic;
+
+-- refresh ... concurrently には一意インデックスが必要（参照中のクエリを止めずに更新できる）
+create unique index if not exists active_topics_group_topic_idx
+    on public.active_topics (family_group_id, topic);
+
+create or replace function public.refresh_active_topics()
+returns void
+language sql
+security definer
+as $$
+    refresh materialized view concurrently public.active_topics;
+$$;
+
+do $$
+begin
+    if exists (select 1 from pg_extension where extname = 'pg_cron') then
+        perform cron.schedule('refresh-active-topics', '* * * * *', 'select public.refresh_active_topics()');
+    end if;
+end;
+$$;
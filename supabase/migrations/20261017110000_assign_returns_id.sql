@@ -0,0 +1,42 @@
+-- assign_latest_task の戻り値にタスクの id を足す（ボットが変更フィード /events に流すため）
+
+create or replace function public.assign_latest_task(
+    p_group_id text,
+    p_assignee text,
+    p_assignable_topics text[]
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_result jsonb;
+begin
+    -- 直近の未完了タスクを行ロックして取り、日常系トピックのときだけ担当者を入れる
+    with target as (
+        select id, content, topic
+          from public.tasks
+         where family_group_id = p_group_id
+           and status = 'pending'
+         order by created_at desc
+         limit 1
+           for update
+    ), updated as (
+        update public.tasks t
+           set assignee_id = p_assignee
+          from target
+         where t.id = target.id
+           and target.topic = any(p_assignable_topics)
+        returning t.id
+    )
+    select jsonb_build_object(
+               'id', target.id,
+               'content', target.content,
+               'topic', target.topic,
+               'assigned', exists (select 1 from updated)
+           )
+      into v_result
+      from target;
+
+    return v_result;  -- 未完了タスクが無ければ null
+end;
+$$;
@@ -0,0 +1,5 @@
+-- 共有リストの一覧 API（GET /tasks）のキーセット方式のページング:
+--   where family_group_id = ? and status = ? [and created_at <= ?] order by created_at desc, id desc limit N
+-- id まで索引の並びに入れておくと、同じ時刻の行があってもソートせずに索引順に読める
+create index if not exists tasks_group_status_created_id_idx
+    on public.tasks (family_group_id, status, created_at desc, id desc);
@@ -0,0 +1,13 @@
+-- メッセージごとの判定結果（GiNZA のルール / Gemini）を残しておき、ローカル分類器の学習に使う
+--   python train_local_classifier.py で読み、models/local_classifier-vN.json を作る
+-- Gemini がエラー・タイムアウトで判定できなかったものは入れない
+create table if not exists public.message_labels (
+    id bigint generated by default as identity primary key,
+    group_id text not null,
+    content text not null,
+    category text,  -- 'task' / 'idea' / 'accept' / null（雑談）
+    topic text,
+    source text not null,  -- 'ginza' / 'llm'
+    created_at timestamptz not null default now()
+);
+
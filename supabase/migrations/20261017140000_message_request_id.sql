@@ -0,0 +1,54 @@
+-- メッセージに呼び出し側の識別子（LINE のメッセージID）を持たせ、同じ発言を二度保存しないようにする
+--   ingest_message の RPC がタイムアウトしてもコミット済みのことがあり、アプリ側で保存し直すと二重に残る。
+--   内容や時刻で見分けると本当に同じ文面を続けて送ったときに取りこぼすので、識別子で弾く
+
+alter table public.messages add column if not exists request_id text;
+
+-- NULL（ボットの返信など識別子の無い行）は重複扱いにならない
+create unique index if not exists messages_request_id_key on public.messages (request_id);
+
+-- 引数が増えるので古いシグネチャは消しておく（残すとオーバーロードになる）
+drop function if exists public.ingest_message(text, text, text, text, integer);
+
+create or replace function public.ingest_message(
+    p_group_id text,
+    p_user_id text,
+    p_content text,
+    p_role text default 'user',
+    p_history_limit integer default 5,
+    p_request_id text default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_history jsonb;
+    v_topics jsonb;
+begin
+    -- 保存する前の直近履歴（古い順）。呼び直されたときも今回の発言は含めない
+    select coalesce(jsonb_agg(to_jsonb(h) order by h.created_at), '[]'::jsonb)
+      into v_history
+      from (
+          select content, role, created_at
+            from public.messages
+           where group_id = p_group_id
+             and (p_request_id is null or request_id is distinct from p_request_id)
+           order by created_at desc
+           limit p_history_limit
+      ) h;
+
+    insert into public.messages (group_id, user_id, content, role, request_id)
+    values (p_group_id, p_user_id, p_content, p_role, p_request_id)
+    on conflict (request_id) do nothing;
+
+    select coalesce(jsonb_agg(distinct topic), '[]'::jsonb)
+      into v_topics
+      from public.tasks
+     where family_group_id = p_group_id
+       and status = 'pending'
+       and topic is not null
+       and topic <> '';
+
+    return jsonb_build_object('history', v_history, 'topics', v_topics);
+end;
+$$;
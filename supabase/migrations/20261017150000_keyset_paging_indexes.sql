@@ -0,0 +1,27 @@
+-- ダッシュボード（dashboard_data.TaskStore）と reclassify_messages.py をキーセット方式のページングにしたので、
+-- 並びに id まで入れた索引に差し替える（同じ時刻の行があってもソートせずに索引順に読める）
+-- （check_indexes.py で、各クエリがインデックスを使うことを EXPLAIN で確認できる）
+
+-- ダッシュボードの全件読み込み（1グループ分）:
+--   where family_group_id = ? [and created_at <= ?] order by created_at desc, id desc limit N
+create index if not exists tasks_group_created_id_idx
+    on public.tasks (family_group_id, created_at desc, id desc);
+
+-- ダッシュボードの差分取得（1グループ分）:
+--   where family_group_id = ? and updated_at > ? [and updated_at >= ?] order by updated_at, id limit N
+create index if not exists tasks_group_updated_id_idx
+    on public.tasks (family_group_id, updated_at, id);
+
+-- 全グループを表示するときの同じクエリ（family_group_id の絞り込みなし）
+create index if not exists tasks_created_id_idx
+    on public.tasks (created_at desc, id desc);
+create index if not exists tasks_updated_id_idx
+    on public.tasks (updated_at, id);
+drop index if exists public.tasks_created_idx;
+drop index if exists public.tasks_updated_idx;
+
+-- 再判定用の全件走査: where role = 'user' [and created_at >= ?] order by created_at, id limit N
+create index if not exists messages_user_created_id_idx
+    on public.messages (created_at, id)
+    where role = 'user';
+drop index if exists public.messages_user_created_idx;
@@ -0,0 +1,154 @@
+"""
+判定結果（message_labels テーブル）からローカル分類器を学習し、models/local_classifier-vN.json に保存する
+    python train_local_classifier.py
+    python train_local_classifier.py --jsonl reclassified.jsonl --dry-run   # reclassify_messages.py の出力も足す
+
+学習に使っていないメッセージで正解率と「Gemini 呼び出しを減らせた割合」を出し、成果物にも同じものを入れる。
+閾値は検証用のメッセージで、ローカルで決める分の正解率が --target-precision を保てるように決める
+"""
+import argparse
+import hashlib
+import json
+import sys
+import time
+from collections import Counter
+
+from modules import local_classifier as lc
+
+
+def iter_labels(page_size):
+    """message_labels を古い順にページングして取得する"""
+    from modules.database import supabase
+
+    if not supabase:
+        sys.exit("Supabase設定エラー")
+    offset = 0
+    while True:
+        response = supabase.table("message_labels")\
+            .select("content, category, source, created_at")\
+            .order("created_at")\
+            .order("id")\
+            .range(offset, offset + page_size - 1)\
+            .execute()
+        rows = response.data
+        yield from rows
+        if len(rows) < page_size:
+            break
+        offset += page_size
+
+
+def iter_jsonl(path):
+    """{"content", "category", "source"} の行か、reclassify_messages.py の出力（"ginza" に判定結果）"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            if "ginza" in row:
+                if not row["ginza"]:
+                    continue  # ルールに掛からなかっただけで、雑談と決まったわけではない
+                row = {"content": row["content"], "category": row["ginza"].get("category"), "source": "ginza"}
+            yield row
+
+
+def collect(rows):
+    """同じ文面は最後の判定だけを残す。返り値は [(テキスト, ラベル, 判定元), ...]"""
+    latest = {}
+    for row in rows:
+        label = lc.label_of(row.get("category"))
+        content = (row.get("content") or "").strip()
+        if label and content:
+            latest[lc.normalize(content)] = (content, label, row.get("source", "llm"))
+    return list(latest.values())
+
+
+def split_of(text, dev_ratio, test_ratio):
+    """文面のハッシュで分ける（同じ文面が学習と評価の両方に入らず、実行のたびに同じ分け方になる）"""
+    bucket = int(hashlib.sha1(lc.normalize(text).encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+    if bucket < test_ratio:
+        return "test"
+    if bucket < test_ratio + dev_ratio:
+        return "dev"
+    return "train"
+
+
+def print_report(report, out=sys.stdout):
+    print(f"評価 {report['samples']}件（うち Gemini 判定 {report['llm_samples']}件）", file=out)
+    print("-" * 48, file=out)
+    print(f"正解率（全件, 閾値なし）    {_pct(report['accuracy'])}", file=out)
+    for label, stats in report["per_class"].items():
+        print(f"  {label:<7} support {stats['support']:>5}  precision {_pct(stats['precision'])}"
+              f"  recall {_pct(stats['recall'])}", file=out)
+    print(f"閾値 {report['threshold']:.3f}（ローカルで決めるカテゴリ: {', '.join(report['categories'])}）", file=out)
+    print(f"ローカルで決めた割合        {_pct(report['coverage'])}", file=out)
+    print(f"  そのうちの正解率          {_pct(report['accuracy_when_decided'])}", file=out)
+    print(f"Gemini 呼び出しを減らせた割合 {_pct(report['llm_calls_avoided'])}", file=out)
+    print(f"1件あたりの推論時間         {report['mean_predict_ms']}ms", file=out)
+
+
+def _pct(value):
+    return "   -  " if value is None else f"{value * 100:5.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--jsonl", action="append", default=[], help="学習データを足す JSONL（何度でも指定可）")
+    parser.add_argument("--no-db", action="store_true", help="message_labels を読まない（--jsonl だけで学習する）")
+    parser.add_argument("--categories", default=f"{lc.NONE_LABEL},accept",
+                        help="ローカルで決めてよいカテゴリ。task/idea は要約・トピックを Gemini に作らせるため既定では外す")
+    parser.add_argument("--target-precision", type=float, default=0.95)
+    parser.add_argument("--dev-ratio", type=float, default=0.1)
+    parser.add_argument("--test-ratio", type=float, default=0.2)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--min-count", type=int, default=2, help="これより少ないメッセージにしか出ない n-gram は使わない")
+    parser.add_argument("--models-dir", default="models")
+    parser.add_argument("--dry-run", action="store_true", help="評価だけして保存しない")
+    args = parser.parse_args()
+
+    categories = [c.strip() for c in args.categories.split(",") if c.strip()]
+    unknown = [c for c in categories if c not in lc.LABELS]
+    if unknown:
+        sys.exit(f"知らないカテゴリ: {unknown}（{lc.LABELS} から選ぶ）")
+
+    rows = []
+    if not args.no_db:
+        rows.extend(iter_labels(args.page_size))
+    for path in args.jsonl:
+        rows.extend(iter_jsonl(path))
+    samples = collect(rows)
+    if not samples:
+        sys.exit("学習データがありません")
+
+    splits = {"train": [], "dev": [], "test": []}
+    for sample in samples:
+        splits[split_of(sample[0], args.dev_ratio, args.test_ratio)].append(sample)
+    counts = Counter(label for _, label, _ in samples)
+    print(f"{len(samples)}件 {dict(counts)} 学習 {len(splits['train'])} / 検証 {len(splits['dev'])}"
+          f" / 評価 {len(splits['test'])}", file=sys.stderr)
+
+    start = time.perf_counter()
+    model = lc.train([(t, y) for t, y, _ in splits["train"]], epochs=args.epochs, min_count=args.min_count)
+    print(f"学習 {time.perf_counter() - start:.1f}s, n-gram {len(model.weights)}個", file=sys.stderr)
+
+    model.categories = set(categories)
+    model.threshold = lc.choose_threshold(
+        model, [(t, y) for t, y, _ in splits["dev"]], model.categories, args.target_precision,
+    )
+    report = lc.evaluate(model, [(t, y) for t, y, _ in splits["test"]], [s for _, _, s in splits["test"]])
+    print_report(report)
+
+    if args.dry_run:
+        return
+    model.version = lc.next_version(args.models_dir)
+    model.meta = {
+        "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "samples": {name: len(rows) for name, rows in splits.items()},
+        "target_precision": args.target_precision,
+        "evaluation": report,
+    }
+    path = lc.artifact_path(args.models_dir, model.version)
+    model.save(path)
+    print(f"{path} に保存しました", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()